@@ -1,6 +1,26 @@
 
 """
 This module contains the API endpoint configuration for the Instana Migrator.
+
+Entries may list the configuration types they reference in "depends_on".
+During an import, a type is only started once all of its dependencies that
+are part of the same run have finished.
+
+Entries for endpoints that return their items in pages describe them in
+"pagination":
+- page_param / size_param: the query parameters for the page number and size
+- page_size: the number of items requested per page
+- first_page: the number of the first page (default: 1)
+- items_key: the key of the items in a page (default: "items")
+- total_key: the key of the total number of items, if the endpoint sends one;
+  the remaining pages are then fetched ahead, "prefetch" at a time (default: 4)
+
+"cleaning" lists the transforms that remove backend-specific data from an
+item before it is imported, see cleaning.py.
+
+"references" lists the IDs of other types an item holds, as {"path": ...,
+"type": ...} entries with a dot-separated path. They are replaced by the IDs
+of the same items on the destination before an item is sent, see id_map.py.
 """
 
 API_CONFIG = {
@@ -15,12 +35,25 @@ API_CONFIG = {
         "export_path": "/application-monitoring/services",
         "import_path": "/application-monitoring/settings/service",
         "import_method": "POST",
-        "id_key": "id"
+        "id_key": "id",
+        "depends_on": ["applications"],
+        "pagination": {
+            "page_param": "page",
+            "size_param": "pageSize",
+            "page_size": 200,
+            "first_page": 1,
+            "items_key": "items",
+            "total_key": "totalHits"
+        }
     },
     "manual-services": {
         "export_path": "/application-monitoring/settings/manual-service",
         "import_path": "/application-monitoring/settings/manual-service",
-        "import_method": "POST"
+        "import_method": "POST",
+        "depends_on": ["services"],
+        "cleaning": [
+            {"op": "drop_invalid", "key": "tagFilterExpression", "required": "operator"}
+        ]
     },
     "alert-channels": {
         "export_path": "/events/settings/alertingChannels",
@@ -32,29 +65,50 @@ API_CONFIG = {
         "export_path": "/events/settings/alerts",
         "import_path": "/events/settings/alerts",
         "import_method": "PUT_ITERATE",
-        "id_key": "id"
+        "id_key": "id",
+        "depends_on": ["alert-channels", "applications", "custom-event-specifications"],
+        "references": [
+            {"path": "integrationIds", "type": "alert-channels"},
+            {"path": "eventFilteringConfiguration.applicationAliasIds", "type": "applications"},
+            {"path": "eventFilteringConfiguration.ruleIds", "type": "custom-event-specifications"}
+        ]
     },
     "global-application-smart-alerts": {
         "export_path": "/events/settings/global-alert-configs/applications",
         "import_path": "/events/settings/global-alert-configs/applications",
         "import_method": "POST",
-        "id_key": "id"
+        "id_key": "id",
+        "depends_on": ["alert-channels", "applications"],
+        "references": [
+            {"path": "alertChannelIds", "type": "alert-channels"},
+            {"path": "applicationId", "type": "applications"}
+        ]
     },
     "custom-event-specifications": {
         "export_path": "/events/settings/event-specifications/custom",
         "import_path": "/events/settings/event-specifications/custom",
-        "import_method": "POST"
+        "import_method": "POST",
+        "cleaning": [
+            {"op": "drop", "keys": ["lastUpdated"]}
+        ]
     },
     "global-custom-payloads": {
         "export_path": "/events/settings/custom-payload-configurations",
         "import_path": "/events/settings/custom-payload-configurations",
-        "import_method": "PUT"
+        "import_method": "PUT",
+        "cleaning": [
+            {"op": "drop", "keys": ["lastUpdated", "version"]}
+        ]
     },
     "maintenance": {
         "export_path": "/settings/v2/maintenance",
         "import_path": "/settings/v2/maintenance",
         "import_method": "PUT_ITERATE",
-        "id_key": "id"
+        "id_key": "id",
+        # The 'id' is kept for the PUT_ITERATE method, other server-generated fields are removed
+        "cleaning": [
+            {"op": "drop", "keys": ["lastUpdated", "state", "validVersion", "occurrence", "invalid"]}
+        ]
     },
     "api-tokens": {
         "export_path": "/settings/api-tokens",
@@ -64,19 +118,38 @@ API_CONFIG = {
     "groups": {
         "export_path": "/settings/rbac/groups",
         "import_path": "/settings/rbac/groups",
-        "import_method": "POST"
+        "import_method": "POST",
+        "cleaning": [
+            {"op": "drop", "keys": ["id"]}
+        ]
     },
     "custom-dashboards": {
         "export_path": "/custom-dashboard",
         "import_path": "/custom-dashboard",
         "import_method": "POST",
-        "id_key": "id"
+        "id_key": "id",
+        # Only GLOBAL access rules are kept, without their relatedId, and the
+        # dashboard is made readable and writable for everyone if it is not yet
+        "cleaning": [
+            {"op": "drop", "keys": ["id", "ownerId"]},
+            {"op": "coerce", "key": "accessRules", "type": "list"},
+            {"op": "filter", "key": "accessRules", "where": {"relationType": "GLOBAL"}},
+            {"op": "drop_nested", "key": "accessRules", "keys": ["relatedId"]},
+            {"op": "ensure", "key": "accessRules", "match": {"relationType": "GLOBAL", "accessType": "READ"},
+             "default": {"accessType": "READ", "relationType": "GLOBAL"}},
+            {"op": "ensure", "key": "accessRules", "match": {"accessType": "READ_WRITE"},
+             "default": {"accessType": "READ_WRITE", "relationType": "GLOBAL"}}
+        ]
     },
     # Not working API endpoints
     "synthetic-tests": {
         "export_path": "/synthetics/settings/tests",
         "import_path": "/synthetics/settings/tests",
-        "import_method": "POST"
+        "import_method": "POST",
+        "depends_on": ["synthetic-credentials", "applications"],
+        "references": [
+            {"path": "applicationId", "type": "applications"}
+        ]
     },
     "synthetic-credentials": {
         "export_path": "/synthetics/settings/credentials/associations",
@@ -86,12 +159,16 @@ API_CONFIG = {
     "slo": {
         "export_path": "/settings/slo",
         "import_path": "/settings/slo",
-        "import_method": "POST"
+        "import_method": "POST",
+        "depends_on": ["sli", "applications"]
     },
     "sli": {
         "export_path": "/settings/sli",
         "import_path": "/settings/sli",
-        "import_method": "POST"
+        "import_method": "POST",
+        "cleaning": [
+            {"op": "drop", "keys": ["lastUpdated"]}
+        ]
     },
     "website-config": {
         "export_path": "/website-monitoring/config",
@@ -101,6 +178,11 @@ API_CONFIG = {
     "mobile-app-config": {
         "export_path": "/mobile-app-monitoring/config",
         "import_path": "/mobile-app-monitoring/config",
-        "import_method": "POST"
+        "import_method": "POST",
+        # The API expects rbacTags to be an array; an exported empty object {}
+        # or other value causes a deserialization error
+        "cleaning": [
+            {"op": "reset", "key": "rbacTags", "value": []}
+        ]
     }
 }
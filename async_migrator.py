@@ -0,0 +1,340 @@
+"""
+This module contains the asyncio engine of the Instana Migrator.
+
+export_config_async and import_config_async do the same work as export_config
+and import_config, but run every request of a type as a task on one event
+loop through AsyncInstanaAPI. All types share one client per backend, whose
+semaphore caps the requests in flight at the backend's max_concurrency, so
+hundreds of requests can be outstanding without a thread per request.
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+from collections import Counter
+
+from api_endpoints import API_CONFIG
+from concurrency import async_ordered_map, iter_in_thread, run_tasks_async
+from dry_run import log_payload
+from export_files import open_export_writer, unwrap_items
+from fanout import split_task_name
+from id_map import source_id
+from imports import import_items, import_result
+from instana_api_async import AsyncInstanaAPI
+from manifest import ManifestBuilder, file_unchanged, load_manifest, save_manifest, unchanged_dashboards
+from sync import StateIndex, comparison_hash, current_document, destination_id
+from utils import APIError, ConfigError, get_item_key
+from verify import verify_state
+
+logger = logging.getLogger(__name__)
+
+
+async def run_types_async(backend_config, names, fn, max_parallel, dependencies=None):
+    """Runs fn(config_type, client) for every type with run_tasks_async.
+
+    All types share one AsyncInstanaAPI client for the backend.
+    """
+    async with AsyncInstanaAPI(backend_config) as client:
+        return await run_tasks_async(names, lambda config_type: fn(config_type, client), max_parallel, dependencies)
+
+
+async def run_destinations_async(destinations, names, fn, max_parallel, dependencies=None, on_skip=None):
+    """Runs fn(name, client) for every fan-out task with run_tasks_async.
+
+    destinations is a list of (name, backend configuration) pairs, and names
+    are task names as returned by fanout.fanout_tasks. Every destination gets
+    one AsyncInstanaAPI client, shared by its tasks. on_skip is passed on to
+    run_tasks_async.
+    """
+    async with contextlib.AsyncExitStack() as stack:
+        clients = {
+            destination: await stack.enter_async_context(AsyncInstanaAPI(backend_config))
+            for destination, backend_config in destinations
+        }
+        return await run_tasks_async(
+            names, lambda name: fn(name, clients[split_task_name(name)[0]]), max_parallel, dependencies, on_skip,
+        )
+
+
+async def fetch_current_state_async(api, config_type):
+    """The asyncio counterpart of sync.fetch_current_state."""
+    cfg = API_CONFIG[config_type]
+    if cfg.get('pagination'):
+        return [item async for item in api.iter_items(cfg['export_path'], cfg['pagination'])]
+    data = await api.get(cfg['export_path'])
+    if data is None:
+        return []
+    items = list(unwrap_items(data if isinstance(data, list) else [data]))
+
+    if config_type == 'custom-dashboards':
+        async def fetch_dashboard(summary):
+            try:
+                return await api.get(f"{cfg['export_path']}/{summary['id']}")
+            except APIError as e:
+                logger.warning(f"    - Could not fetch details for dashboard ID {summary['id']}. Error: {e}")
+                return None
+
+        summaries = [summary for summary in items if summary.get('id')]
+        items = [
+            dashboard async for dashboard in async_ordered_map(fetch_dashboard, summaries, api.max_concurrency)
+            if dashboard is not None
+        ]
+
+    return items
+
+
+async def export_config_async(config_type, client, export_dir, export_format="json", incremental=False, bundle=None, snapshot=None, item_filter=None):
+    """Exports a specific configuration type from a backend.
+
+    Behaves like export_config. Dashboard details are fetched with up to the
+    backend's max_concurrency requests in flight.
+    """
+    if config_type not in API_CONFIG:
+        raise ConfigError(f"Unknown configuration type '{config_type}'")
+
+    api = client.for_type(config_type)
+    cfg = API_CONFIG[config_type]
+
+    logger.info(f"Exporting '{config_type}' from {api.base_url}...")
+
+    os.makedirs(export_dir, exist_ok=True)
+    manifest = load_manifest(export_dir, config_type) if incremental else None
+    builder = ManifestBuilder(config_type, export_format)
+    failed_count = 0
+
+    if config_type == 'custom-dashboards':
+        logger.debug(f"  - Fetching dashboard list from {cfg['export_path']}")
+        dashboard_summaries = await api.get(cfg['export_path'])
+        logger.info(f"  - Found {len(dashboard_summaries)} dashboards to export.")
+        summaries = [summary for summary in dashboard_summaries if summary.get('id')]
+        if item_filter:
+            summaries = list(item_filter.select(summaries, config_type))
+            logger.info(f"  - {len(summaries)} dashboard(s) match the filters.")
+        previous = unchanged_dashboards(export_dir, manifest, summaries) if manifest else {}
+
+        async def fetch_dashboard(summary):
+            dashboard_id = summary['id']
+            if dashboard_id in previous:
+                return summary, previous[dashboard_id]
+            logger.debug(f"    - Fetching full details for dashboard ID: {dashboard_id}")
+            try:
+                return summary, await api.get(f"{cfg['export_path']}/{dashboard_id}")
+            except APIError as e:
+                logger.warning(f"    - Could not fetch details for dashboard ID {dashboard_id}. Error: {e}")
+                return summary, None
+
+        with open_export_writer(export_dir, config_type, export_format, bundle, snapshot) as writer:
+            async for summary, dashboard in async_ordered_map(fetch_dashboard, summaries, api.max_concurrency):
+                if dashboard is not None:
+                    writer.write(dashboard)
+                    builder.add(summary['id'], dashboard, summary)
+                else:
+                    failed_count += 1
+            new_manifest = builder.build()
+            if incremental and file_unchanged(manifest, new_manifest, writer.file_path):
+                writer.discard()
+
+    elif cfg.get('pagination'):
+        with open_export_writer(export_dir, config_type, export_format, bundle, snapshot) as writer:
+            async for item in api.iter_items(cfg['export_path'], cfg['pagination']):
+                if item_filter and not item_filter.matches(item, config_type):
+                    continue
+                writer.write(item)
+                builder.add(get_item_key(item, cfg.get('id_key')), item)
+            new_manifest = builder.build()
+            if incremental and file_unchanged(manifest, new_manifest, writer.file_path):
+                writer.discard()
+
+    else:
+        data = await api.get(cfg['export_path'])
+        if item_filter:
+            data = item_filter.select_data(data, config_type)
+        with open_export_writer(export_dir, config_type, export_format, bundle, snapshot) as writer:
+            if cfg['import_method'] == 'PUT':
+                # Imported as a whole, so kept in the shape the backend returned it
+                if data is not None:
+                    writer.write_document(data)
+            else:
+                writer.write_data(data)
+            for item in unwrap_items(data if isinstance(data, list) else [data]):
+                builder.add(get_item_key(item, cfg.get('id_key')), item)
+            new_manifest = builder.build()
+            if incremental and file_unchanged(manifest, new_manifest, writer.file_path):
+                writer.discard()
+
+    save_manifest(export_dir, new_manifest)
+    count = writer.count
+    if writer.discarded:
+        logger.info(f"No changes since the last export, kept {count} item(s) in {writer.file_path}")
+    else:
+        logger.info(f"Successfully exported {count} item(s) to {writer.file_path}")
+    return {'success': count, 'failed': failed_count}
+
+
+async def import_config_async(config_type, client, export_dir, dry_run=False, sync=False, journal=None, plan=None, item_filter=None, prepared=None, id_map=None):
+    """Imports a specific configuration type to a backend.
+
+    Behaves like import_config. Items are sent with up to the backend's
+    max_concurrency requests in flight. The export is read and cleaned on a
+    worker thread, in chunks, so it does not block the event loop.
+    """
+    if config_type not in API_CONFIG:
+        raise ConfigError(f"Unknown configuration type '{config_type}'")
+
+    items = prepared if prepared is not None else await asyncio.to_thread(import_items, export_dir, config_type, item_filter)
+
+    api = client.for_type(config_type)
+    cfg = API_CONFIG[config_type]
+    id_key = cfg.get('id_key')
+
+    logger.info(f"Importing '{config_type}' to {api.base_url}...")
+    if dry_run:
+        logger.info("DRY RUN: No actual changes will be made.")
+
+    state = None
+    if sync:
+        logger.info("Fetching the current state of the destination...")
+        state = StateIndex(await fetch_current_state_async(api, config_type), config_type)
+        logger.info(f"  - Found {len(state.items)} existing item(s).")
+
+    if cfg['import_method'] == 'PUT':
+        logger.info("Using PUT method to replace entire configuration...")
+        ((data, payload, payload_hash),) = items
+
+        if journal and journal.is_done(api.base_url, config_type, config_type, payload_hash):
+            logger.info(f"Configuration for '{config_type}' was already imported, skipping.")
+            return import_result(Counter(['resumed']))
+
+        if state is not None and comparison_hash(current_document(state.items, data), config_type) == comparison_hash(data, config_type):
+            logger.info(f"Configuration for '{config_type}' is unchanged, nothing to import.")
+            if journal and not dry_run:
+                journal.record(api.base_url, config_type, config_type, payload_hash, 'unchanged')
+            return import_result(Counter(['unchanged']))
+
+        if not dry_run:
+            try:
+                await api.put(cfg['import_path'], json=payload)
+            except APIError:
+                if journal:
+                    journal.record(api.base_url, config_type, config_type, payload_hash, 'failed')
+                raise
+            if journal:
+                journal.record(api.base_url, config_type, config_type, payload_hash, 'updated')
+        else:
+            logger.info(f"  - (Dry Run) Would replace configuration for '{config_type}'")
+            log_payload(payload)
+            if plan:
+                plan.record(config_type, 'PUT', api.base_url + cfg['import_path'], config_type, payload_hash)
+
+        logger.info(f"Successfully imported '{config_type}'.")
+        return import_result(Counter(['updated']))
+
+    async def import_item(entry):
+        item, payload, payload_hash = entry
+        # POST items are identified by their id_key, name or title; PUT_ITERATE
+        # items by their id_key, which is also part of the update URL
+        if cfg['import_method'] == 'POST':
+            item_key = get_item_key(item, id_key) or 'N/A'
+            item_name = item_key
+        else:
+            item_key = item.get(id_key)
+            if not item_key:
+                logger.warning(f"  - Skipping item due to missing ID (using id_key: '{id_key}'). Item data: {item}")
+                return 'failed'
+            item_name = item.get('name', item_key)
+        if id_map is not None:
+            # The item is rewritten as well, so that --sync compares what is sent
+            item, payload = id_map.rewrite(item, config_type, api.base_url), id_map.rewrite(payload, config_type, api.base_url)
+
+        def record(result, response=None, dest_id=None):
+            if isinstance(response, dict) and response.get('id'):
+                dest_id = response['id']
+            if journal and not dry_run:
+                journal.record(api.base_url, config_type, item_key, payload_hash, result, dest_id)
+            # PUT_ITERATE items keep their ID on the destination
+            if id_map is not None and not dry_run and cfg['import_method'] == 'POST':
+                id_map.record(api.base_url, config_type, source_id(item, config_type), dest_id)
+            return result
+
+        if journal and journal.is_done(api.base_url, config_type, item_key, payload_hash):
+            logger.info(f"  - Item was already imported, skipping: {item_name}")
+            return 'resumed'
+
+        default_status = 'missing' if cfg['import_method'] == 'POST' else 'changed'
+        mapped_id = id_map.mapped_id(api.base_url, config_type, item) if id_map is not None else None
+        status, match = state.compare(item, mapped_id) if state is not None else (default_status, None)
+        if status == 'unchanged':
+            logger.info(f"  - Item is unchanged, skipping: {item_name}")
+            return record('unchanged', dest_id=destination_id(match, config_type))
+
+        dest_id = None
+        if cfg['import_method'] == 'PUT_ITERATE':
+            method, import_url, outcome = 'PUT', f"{cfg['import_path']}/{item_key}", 'created' if status == 'missing' else 'updated'
+            # The payload may be shared with other destinations, so it is copied
+            payload = dict(payload, id=item_key)
+            logger.info(f"  - Preparing to update item: {item_name} (ID: {item_key})")
+        elif status == 'changed':
+            # Existing items are replaced in place, using the destination ID
+            dest_id = destination_id(match, config_type)
+            if not dest_id:
+                logger.warning(f"  - Skipping changed item without a destination ID: {item_name}")
+                return record('failed')
+            method, import_url, outcome = 'PUT', f"{cfg['import_path']}/{dest_id}", 'updated'
+            payload = dict(payload, id=dest_id)
+            logger.info(f"  - Preparing to update item: {item_name} (ID: {dest_id})")
+        else:
+            method, import_url, outcome = 'POST', cfg['import_path'], 'created'
+            logger.info(f"  - Preparing to import item: {item_name}")
+
+        action, done = ("import", "imported") if method == 'POST' else ("update", "updated")
+        if dry_run:
+            logger.info(f"  - (Dry Run) Would {action} item: {item_name}")
+            logger.info(f"    URL: {method} {import_url}")
+            log_payload(payload)
+            if plan:
+                plan.record(config_type, method, api.base_url + import_url, item_key, payload_hash)
+            return outcome
+        try:
+            if method == 'POST':
+                response = await api.post(import_url, json=payload)
+            else:
+                response = await api.put(import_url, json=payload)
+            logger.info(f"  - Successfully {done} item: {item_name}")
+            return record(outcome, response, dest_id)
+        except APIError as e:
+            logger.error(f"  - Failed to {action} item: {item_name}")
+            logger.error(f"    Error: {e}")
+            return record('failed')
+
+    if cfg['import_method'] == 'PUT_ITERATE':
+        logger.info("Using PUT_ITERATE method to update items individually...")
+    counts = Counter([outcome async for outcome in async_ordered_map(import_item, iter_in_thread(items), api.max_concurrency)])
+    result = import_result(counts)
+    logger.info(f"Import complete. Successfully imported {result['success']}/{sum(counts.values())} items.")
+    if sync:
+        logger.info(f"  - Created: {counts['created']}, updated: {counts['updated']}, unchanged: {counts['unchanged']}")
+    if counts['resumed']:
+        logger.info(f"  - Skipped {counts['resumed']} item(s) already imported by a previous run.")
+    return result
+
+
+async def verify_config_async(config_type, client, export_dir, item_filter=None, prepared=None, id_map=None, report=None):
+    """Checks that a backend holds the exported items of a specific configuration type.
+
+    Behaves like verify_config. Dashboard details are fetched with up to the
+    backend's max_concurrency requests in flight. The export is read and
+    compared on a worker thread, so it does not block the event loop.
+    """
+    if config_type not in API_CONFIG:
+        raise ConfigError(f"Unknown configuration type '{config_type}'")
+
+    entries = prepared if prepared is not None else await asyncio.to_thread(import_items, export_dir, config_type, item_filter)
+    api = client.for_type(config_type)
+    logger.info(f"Verifying '{config_type}' on {api.base_url}...")
+    current = await fetch_current_state_async(api, config_type)
+    logger.info(f"  - Found {len(current)} item(s) on the destination.")
+    result = await asyncio.to_thread(verify_state, config_type, entries, current, api.base_url, id_map, report, item_filter)
+    if report:
+        report.record_totals(api.base_url, config_type, result)
+    return result
@@ -0,0 +1,143 @@
+"""
+Micro-benchmark of the import cleaning.
+
+Compares the compiled per-type cleaners of cleaning.py with the if-chain clean_for_import they replaced. The legacy
+function modifies its input, so it is timed the way the import called it,
+on a shallow copy of every item (and on a deep copy for the --sync
+comparison, which must not modify the items). Note that on a shallow copy it
+still changes the nested access rules of the input, which makes its later
+repetitions a little cheaper. Before timing, the outputs of
+both are checked to be identical.
+
+Usage:
+    python benchmarks/bench_cleaning.py --items 50000 --widgets 20
+"""
+
+import argparse
+import copy
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_server import make_item  # noqa: E402
+from cleaning import clean_for_import  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+TYPES = ["custom-dashboards", "maintenance", "mobile-app-config", "manual-services", "applications"]
+
+
+def legacy_clean_for_import(item, config_type):
+    """The if-chain clean_for_import, as it was before the rules were compiled."""
+    keys_to_remove = ['scope']
+
+    if config_type == 'global-custom-payloads':
+        keys_to_remove.extend(['lastUpdated', 'version'])
+    elif (config_type == 'sli' or config_type == 'custom-event-specifications'):
+        keys_to_remove.append('lastUpdated')
+    elif config_type == 'maintenance':
+        keys_to_remove.extend(['lastUpdated', 'state', 'validVersion', 'occurrence', 'invalid'])
+    elif config_type == 'groups' or config_type == "custom-dashboards":
+        keys_to_remove.append('id')
+
+    for key in keys_to_remove:
+        if key in item:
+            del item[key]
+            logger.debug(f"      - Removed {key}")
+
+    if config_type == 'mobile-app-config':
+        if 'rbacTags' in item:
+            logger.debug("      - Ensuring rbacTags is an empty array for mobile-app-config.")
+            item['rbacTags'] = []
+
+    if config_type == 'custom-dashboards':
+        logger.debug(" - Cleaning custom dashboard-specific fields...")
+        if 'ownerId' in item:
+            del item['ownerId']
+            logger.debug(" - Removed ownerId")
+        rules = item.get('accessRules', [])
+        if not isinstance(rules, list):
+            rules = []
+        rules = [r for r in rules if r.get('relationType') == 'GLOBAL']
+        for r in rules:
+            if 'relatedId' in r:
+                r.pop('relatedId', None)
+        has_global_read = any(r.get('relationType') == 'GLOBAL' and r.get('accessType') == 'READ' for r in rules)
+        if not has_global_read:
+            rules.append({'accessType': 'READ', 'relationType': 'GLOBAL'})
+        has_write = any(r.get('accessType') == 'READ_WRITE' for r in rules)
+        if not has_write:
+            rules.append({'accessType': 'READ_WRITE', 'relationType': 'GLOBAL'})
+        item['accessRules'] = rules
+
+    if config_type == 'manual-services':
+        tfe = item.get('tagFilterExpression')
+        is_invalid = False
+        if tfe is not None:
+            if not isinstance(tfe, dict) or tfe.get('operator') is None:
+                is_invalid = True
+        if is_invalid:
+            if 'tagFilterExpression' in item:
+                del item['tagFilterExpression']
+
+    return item
+
+
+def make_items(config_type, count, widgets):
+    """Returns generated items with the fields the cleaning rules act on."""
+    items = []
+    for index in range(count):
+        item = make_item(config_type, index, widgets)
+        if config_type == 'maintenance':
+            item.update({'state': 'ACTIVE', 'validVersion': 1, 'occurrence': {'start': 0}, 'invalid': False})
+        elif config_type == 'mobile-app-config':
+            item['rbacTags'] = {}
+        elif config_type == 'manual-services':
+            item['tagFilterExpression'] = {'type': 'EXPRESSION'} if index % 2 else {'type': 'TAG_FILTER', 'operator': 'EQUALS'}
+        items.append(item)
+    return items
+
+
+def best_of(repeat, fn):
+    """Returns the shortest of repeat timings of fn, in seconds."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark of the import cleaning")
+    parser.add_argument("--items", type=int, default=20000, help="Number of items per type (default: 20000)")
+    parser.add_argument("--widgets", type=int, default=10, help="Number of widgets per dashboard (default: 10)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timings per case, the best is reported (default: 5)")
+    args = parser.parse_args()
+
+    print(f"{'Type':<20} {'Legacy copy':>12} {'Legacy deep':>12} {'Compiled':>12} {'Speedup':>8}")
+    for config_type in TYPES:
+        items = make_items(config_type, args.items, args.widgets)
+        expected = [legacy_clean_for_import(copy.deepcopy(item), config_type) for item in items]
+        originals = copy.deepcopy(items)
+        if [clean_for_import(item, config_type) for item in items] != expected or items != originals:
+            sys.exit(f"Compiled cleaning of '{config_type}' differs from the legacy function")
+
+        legacy = best_of(args.repeat, lambda: [legacy_clean_for_import(item.copy(), config_type) for item in items])
+        legacy_deep = best_of(args.repeat, lambda: [legacy_clean_for_import(copy.deepcopy(item), config_type) for item in items])
+        compiled = best_of(args.repeat, lambda: [clean_for_import(item, config_type) for item in items])
+
+        def rate(seconds):
+            return f"{args.items / seconds / 1000:.0f}k/s"
+
+        print(
+            f"{config_type:<20} {rate(legacy):>12} {rate(legacy_deep):>12} {rate(compiled):>12} "
+            f"{legacy / compiled:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
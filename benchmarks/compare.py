@@ -0,0 +1,49 @@
+"""
+Compares two result files written by run_benchmark.py.
+
+Usage:
+    python benchmarks/compare.py baseline.json candidate.json
+"""
+
+import argparse
+import json
+
+
+def change(before, after):
+    """Returns the relative change from before to after as a string."""
+    if not before or after is None:
+        return "n/a"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline", help="Result file of the baseline run")
+    parser.add_argument("candidate", help="Result file of the run to compare")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f"Baseline:  {baseline.get('label') or ''} {baseline.get('revision') or ''}")
+    print(f"Candidate: {candidate.get('label') or ''} {candidate.get('revision') or ''}")
+    print(f"{'Scenario':<28} {'Wall time':>10} {'Req/s':>10} {'p95':>10} {'Peak RSS':>10}")
+
+    before_by_scenario = {result['scenario']: result for result in baseline['results']}
+    for after in candidate['results']:
+        before = before_by_scenario.get(after['scenario'])
+        if before is None:
+            continue
+        print(
+            f"{after['scenario']:<28} "
+            f"{change(before['wall_time_s'], after['wall_time_s']):>10} "
+            f"{change(before['requests_per_s'], after['requests_per_s']):>10} "
+            f"{change(before['latency_ms']['p95'], after['latency_ms']['p95']):>10} "
+            f"{change(before['peak_rss_mb'], after['peak_rss_mb']):>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
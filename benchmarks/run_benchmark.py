@@ -0,0 +1,252 @@
+"""
+End-to-end throughput benchmark for the Instana Migrator.
+
+Every scenario starts a fresh stub server (see stub_server.py) in its own
+process and runs an export or import against it in a separate client
+process, so the peak RSS reported for a scenario only covers that scenario.
+Results are written as JSON, so runs can be compared with compare.py.
+
+Usage:
+    python benchmarks/run_benchmark.py --items 500 --latency 20 --output results.json
+    python benchmarks/run_benchmark.py --scenario export-custom-dashboards --workers 32
+    python benchmarks/run_benchmark.py --engine async --max-concurrency 200 --output async.json
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from api_endpoints import API_CONFIG  # noqa: E402
+
+DEFAULT_SCENARIOS = [
+    "export-custom-dashboards",
+    "import-custom-dashboards",
+    "export-alert-configs",
+    "import-alert-configs",
+    "export-all",
+    "import-all",
+]
+
+
+def parse_scenario(scenario):
+    """Returns (command, types) for a scenario named '<command>-<type>'."""
+    command, _, type_arg = scenario.partition("-")
+    if command not in ("export", "import"):
+        raise ValueError(f"Unknown scenario '{scenario}', expected export-<type> or import-<type>")
+    if type_arg == "all":
+        return command, list(API_CONFIG.keys())
+    if type_arg not in API_CONFIG:
+        raise ValueError(f"Unknown configuration type in scenario '{scenario}'")
+    return command, [type_arg]
+
+
+def start_stub_server(options):
+    """Starts the stub server in a subprocess and returns (process, api_url)."""
+    command = [
+        sys.executable, os.path.join(ROOT_DIR, "benchmarks", "stub_server.py"),
+        "--items", str(options['items']),
+        "--widgets", str(options['widgets']),
+        "--latency", str(options['latency']),
+        "--jitter", str(options['jitter']),
+        "--error-rate", str(options['error_rate']),
+        "--rate-limit", str(options['rate_limit']),
+        "--seed", "1",
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline().strip()
+    if not line.startswith("Listening on "):
+        process.kill()
+        raise RuntimeError(f"Stub server did not start: {line}")
+    return process, line[len("Listening on "):]
+
+
+def fetch_server_stats(api_url):
+    """Returns the request counters of the stub server."""
+    stats_url = api_url[:-len("/api")] + "/__stats"
+    with urllib.request.urlopen(stats_url) as response:
+        return json.load(response)
+
+
+def write_export_files(export_dir, types, options):
+    """Writes generated export files to import from."""
+    from benchmarks.stub_server import make_item
+    from export_files import ExportWriter, export_file_path
+
+    for config_type in types:
+        file_path = export_file_path(export_dir, config_type, options['format'])
+        with ExportWriter(file_path, options['format']) as writer:
+            if API_CONFIG[config_type]['import_method'] == 'PUT':
+                writer.write_data({'payloads': []})
+                continue
+            for index in range(options['items']):
+                writer.write(make_item(config_type, index, options['widgets']))
+
+
+def run_scenario(scenario, api_url, options):
+    """Runs one scenario in the current (client) process and returns its metrics."""
+    import asyncio
+
+    from concurrency import run_tasks
+    from instana_migrator import export_config, import_config
+    from metrics import METRICS, percentile
+
+    logging.basicConfig(level=logging.WARNING)
+    command, types = parse_scenario(scenario)
+    backend_config = {
+        'api_url': api_url,
+        'api_token': 'benchmark',
+        'pool_size': options['pool_size'],
+        'max_concurrency': options['max_concurrency'],
+        'adaptive_concurrency': options['adaptive'],
+    }
+
+    METRICS.reset()
+    with tempfile.TemporaryDirectory() as export_dir:
+        if command == "import":
+            write_export_files(export_dir, types, options)
+            dependencies = {config_type: API_CONFIG[config_type].get('depends_on', []) for config_type in types}
+
+            def task(config_type):
+                return import_config(config_type, backend_config, export_dir, workers=options['workers'])
+
+            def async_task(config_type, client):
+                return import_config_async(config_type, client, export_dir)
+        else:
+            dependencies = None
+
+            def task(config_type):
+                return export_config(config_type, backend_config, export_dir, options['workers'], options['format'])
+
+            def async_task(config_type, client):
+                return export_config_async(config_type, client, export_dir, options['format'])
+
+        started = time.perf_counter()
+        if options['engine'] == "async":
+            from async_migrator import export_config_async, import_config_async, run_types_async
+            outcomes = asyncio.run(run_types_async(backend_config, types, async_task, options['parallel_types'], dependencies))
+        else:
+            outcomes = run_tasks(types, task, options['parallel_types'], dependencies)
+        wall_time = time.perf_counter() - started
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+
+    # Durations of every logical request, including the time spent on retries
+    latencies = sorted(METRICS.durations())
+    endpoints = METRICS.summary()['endpoints']
+    results = [outcome['result'] or {} for outcome in outcomes.values()]
+    return {
+        'scenario': scenario,
+        'wall_time_s': round(wall_time, 4),
+        'requests': len(latencies),
+        'requests_per_s': round(len(latencies) / wall_time, 2) if wall_time else None,
+        'latency_ms': {
+            name: round(percentile(latencies, fraction) * 1000, 3) if latencies else None
+            for name, fraction in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99))
+        },
+        'retries': sum(entry['retries'] for entry in endpoints),
+        'peak_rss_mb': round(peak_rss_mb, 1),
+        'items_succeeded': sum(result.get('success', 0) for result in results),
+        'items_failed': sum(result.get('failed', 0) for result in results),
+        'types_failed': sorted(name for name, outcome in outcomes.items() if outcome['error']),
+    }
+
+
+def git_revision():
+    """Returns the current git commit, or None outside a git checkout."""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Instana Migrator throughput benchmark")
+    parser.add_argument("--scenario", action="append", help=f"Scenario to run, '<export|import>-<type|all>'. Can be repeated (default: {', '.join(DEFAULT_SCENARIOS)})")
+    parser.add_argument("--items", type=int, default=200, help="Number of items per configuration type (default: 200)")
+    parser.add_argument("--widgets", type=int, default=10, help="Number of widgets per dashboard (default: 10)")
+    parser.add_argument("--latency", type=float, default=10.0, help="Server latency per request, in milliseconds (default: 10)")
+    parser.add_argument("--jitter", type=float, default=2.0, help="Random variation of the latency, in milliseconds (default: 2)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 503 (default: 0)")
+    parser.add_argument("--rate-limit", type=int, default=0, help="Server rate limit in requests per second (default: unlimited)")
+    parser.add_argument("--workers", type=int, default=8, help="Migrator --workers (default: 8)")
+    parser.add_argument("--parallel-types", type=int, default=4, help="Migrator --parallel-types (default: 4)")
+    parser.add_argument("--pool-size", type=int, default=10, help="Connection pool size of the client (default: 10)")
+    parser.add_argument("--engine", default="sync", choices=("sync", "async"), help="Migrator --engine (default: sync)")
+    parser.add_argument("--max-concurrency", type=int, default=100, help="Requests in flight per backend with the async engine, and the upper bound of --adaptive (default: 100)")
+    parser.add_argument("--adaptive", action="store_true", help="Enable adaptive_concurrency for the client")
+    parser.add_argument("--format", default="json", choices=("json", "ndjson"), help="Export file format (default: json)")
+    parser.add_argument("--label", help="Free-form label stored with the results")
+    parser.add_argument("--output", default="benchmark-results.json", help="File to write the results to (default: benchmark-results.json)")
+    args = parser.parse_args()
+
+    options = {
+        'items': args.items,
+        'widgets': args.widgets,
+        'latency': args.latency,
+        'jitter': args.jitter,
+        'error_rate': args.error_rate,
+        'rate_limit': args.rate_limit,
+        'workers': args.workers,
+        'parallel_types': args.parallel_types,
+        'pool_size': args.pool_size,
+        'engine': args.engine,
+        'max_concurrency': args.max_concurrency,
+        'adaptive': args.adaptive,
+        'format': args.format,
+    }
+    scenarios = args.scenario or DEFAULT_SCENARIOS
+    for scenario in scenarios:
+        parse_scenario(scenario)
+
+    # Each scenario gets a fresh client process so its peak RSS is its own
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for scenario in scenarios:
+        server, api_url = start_stub_server(options)
+        try:
+            with context.Pool(1) as pool:
+                result = pool.apply(run_scenario, (scenario, api_url, options))
+            result['server'] = fetch_server_stats(api_url)
+        finally:
+            server.terminate()
+            server.wait()
+        results.append(result)
+        latency = result['latency_ms']
+        print(
+            f"{scenario:<28} {result['wall_time_s']:>8.2f}s {result['requests']:>7} req "
+            f"{result['requests_per_s'] or 0:>9.1f} req/s  p50 {latency['p50']}ms  p95 {latency['p95']}ms  "
+            f"p99 {latency['p99']}ms  rss {result['peak_rss_mb']}MB",
+            flush=True,
+        )
+
+    report = {
+        'label': args.label,
+        'revision': git_revision(),
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'python': platform.python_version(),
+        'options': options,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
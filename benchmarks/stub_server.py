@@ -0,0 +1,307 @@
+"""
+A local stand-in for the Instana API, used to benchmark the Instana Migrator.
+
+The server implements the export and import endpoints listed in
+api_endpoints.API_CONFIG with generated data. Item counts, per-request
+latency, error rate and rate limiting (HTTP 429, with X-RateLimit-* headers)
+are configurable.
+
+Usage:
+    python benchmarks/stub_server.py --port 8080 --items 1000 --latency 20
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api_endpoints import API_CONFIG  # noqa: E402
+
+API_PREFIX = "/api"
+STATS_PATH = "/__stats"
+
+
+def make_item(config_type, index, widgets=10):
+    """Returns a generated item of a configuration type."""
+    item = {
+        'id': f"{config_type}-{index}",
+        'name': f"{config_type} {index}",
+        'lastUpdated': 1700000000000 + index,
+        'scope': 'INCLUDE_ALL_DOWNSTREAM',
+    }
+    if config_type == 'custom-dashboards':
+        item = {
+            'id': f"{config_type}-{index}",
+            'title': f"Dashboard {index}",
+            'ownerId': 'owner-1',
+            'accessRules': [
+                {'accessType': 'READ_WRITE', 'relationType': 'USER', 'relatedId': 'owner-1'},
+                {'accessType': 'READ', 'relationType': 'GLOBAL', 'relatedId': ''},
+            ],
+            'widgets': [
+                {
+                    'id': f"widget-{index}-{number}",
+                    'title': f"Widget {number}",
+                    'type': 'chart',
+                    'width': 6,
+                    'height': 13,
+                    'x': (number % 2) * 6,
+                    'y': (number // 2) * 13,
+                    'config': {'metric': 'calls', 'aggregation': 'SUM', 'query': f"entity.service.name:svc-{number}"},
+                }
+                for number in range(widgets)
+            ],
+        }
+    elif config_type == 'alert-configs':
+        item.update({
+            'alertName': f"Alert {index}",
+            'integrationIds': [f"alert-channels-{index % 10}"],
+            'eventFilteringConfiguration': {'query': '', 'ruleIds': [], 'eventTypes': ['incident', 'critical']},
+        })
+    return item
+
+
+def dashboard_summary(dashboard):
+    """Returns the list entry of a generated dashboard."""
+    return {
+        'id': dashboard['id'],
+        'title': dashboard['title'],
+        'ownerId': dashboard['ownerId'],
+        'writable': True,
+    }
+
+
+class StubState:
+    """Data and behaviour shared by all requests to the stub server."""
+
+    def __init__(self, counts, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=0, widgets=10, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.stats = {'requests': 0, 'throttled': 0, 'errors': 0, 'by_method': {}}
+        self._tokens = float(rate_limit)
+        self._refilled = time.monotonic()
+
+        self.collections = {}
+        self.paginated = {}
+        self.dashboards = {}
+        for config_type, cfg in API_CONFIG.items():
+            count = counts.get(config_type, counts.get('default', 0))
+            items = [make_item(config_type, index, widgets) for index in range(count)]
+            if cfg['import_method'] == 'PUT':
+                self.collections[cfg['export_path']] = {'payloads': [], 'lastUpdated': 1700000000000}
+            elif config_type == 'custom-dashboards':
+                self.dashboards = {item['id']: item for item in items}
+                self.collections[cfg['export_path']] = [dashboard_summary(item) for item in items]
+            elif cfg.get('pagination'):
+                self.paginated[cfg['export_path']] = (cfg['pagination'], items)
+            else:
+                self.collections[cfg['export_path']] = items
+
+    def delay(self):
+        """Returns the simulated processing time of a request."""
+        if not self.latency and not self.jitter:
+            return 0.0
+        return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def page(self, path, query):
+        """Returns the requested page of a paginated collection."""
+        pagination, items = self.paginated[path]
+        params = urllib.parse.parse_qs(query)
+        first_page = pagination.get('first_page', 1)
+        page = int(params.get(pagination['page_param'], [first_page])[0])
+        page_size = int(params.get(pagination['size_param'], [pagination['page_size']])[0])
+        start = (page - first_page) * page_size
+        return {
+            pagination.get('items_key', 'items'): items[start:start + page_size],
+            pagination['page_param']: page,
+            pagination['size_param']: page_size,
+            pagination['total_key']: len(items),
+        }
+
+    def rate_limit_headers(self):
+        """Returns the X-RateLimit-* headers Instana sends, if rate limiting is enabled."""
+        if not self.rate_limit:
+            return {}
+        with self.lock:
+            tokens = self._tokens
+        reset = time.time() + max(0.0, 1 - tokens) / self.rate_limit
+        return {
+            'X-RateLimit-Limit': str(self.rate_limit),
+            'X-RateLimit-Remaining': str(int(tokens)),
+            'X-RateLimit-Reset': f"{reset:.3f}",
+        }
+
+    def admit(self, method):
+        """Counts a request and returns the status it should fail with, or None."""
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['by_method'][method] = self.stats['by_method'].get(method, 0) + 1
+            if self.rate_limit:
+                now = time.monotonic()
+                self._tokens = min(float(self.rate_limit), self._tokens + (now - self._refilled) * self.rate_limit)
+                self._refilled = now
+                if self._tokens < 1:
+                    self.stats['throttled'] += 1
+                    return 429
+                self._tokens -= 1
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.stats['errors'] += 1
+                return 503
+        return None
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Handles the Instana API requests made by the migrator."""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without this, Nagle's algorithm
+    # adds delayed-ACK stalls that dwarf the simulated latency
+    disable_nagle_algorithm = True
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    rate_limit_headers = {}
+
+    def _send(self, status, body=None, headers=None):
+        data = b"" if body is None else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in dict(self.rate_limit_headers, **(headers or {})).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if not length:
+            return None
+        return json.loads(self.rfile.read(length))
+
+    def _handle(self, method):
+        path, _, query = self.path.partition("?")
+        body = self._read_body() if method in ("POST", "PUT") else None
+
+        if path == STATS_PATH:
+            with self.state.lock:
+                return self._send(200, self.state.stats)
+        if not path.startswith(API_PREFIX):
+            return self._send(404, {'errors': [f"Unknown path {path}"]})
+        path = path[len(API_PREFIX):]
+
+        failure = self.state.admit(method)
+        self.rate_limit_headers = self.state.rate_limit_headers()
+        time.sleep(self.state.delay())
+        if failure == 429:
+            return self._send(429, {'errors': ['Too many requests']}, {'Retry-After': '1'})
+        if failure:
+            return self._send(failure, {'errors': ['Service unavailable']})
+
+        if method == "GET":
+            if path in self.state.collections:
+                return self._send(200, self.state.collections[path])
+            if path in self.state.paginated:
+                return self._send(200, self.state.page(path, query))
+            collection, _, item_id = path.rpartition("/")
+            if collection == API_CONFIG['custom-dashboards']['export_path'] and item_id in self.state.dashboards:
+                return self._send(200, self.state.dashboards[item_id])
+            return self._send(404, {'errors': [f"Not found: {path}"]})
+
+        if method == "POST":
+            if not isinstance(body, dict):
+                return self._send(400, {'errors': ['Expected a JSON object']})
+            created = dict(body, id=f"created-{next(self.state.ids)}")
+            return self._send(200, created)
+
+        if method == "PUT":
+            if isinstance(body, dict):
+                return self._send(200, dict(body, id=body.get('id') or path.rpartition("/")[2]))
+            return self._send(200, body)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+
+class StubServer(ThreadingHTTPServer):
+    """Threaded HTTP server that accepts bursts of new connections."""
+
+    daemon_threads = True
+    # The default backlog of 5 drops connection attempts when a client opens
+    # hundreds of connections at once, and each drop costs a 1s SYN retry
+    request_queue_size = 1024
+
+
+def create_server(state, host="127.0.0.1", port=0):
+    """Returns a stub server bound to host and port (0 picks a free port)."""
+    handler = type("BoundStubHandler", (StubHandler,), {'state': state})
+    return StubServer((host, port), handler)
+
+
+def parse_counts(items, counts):
+    """Returns the item count per type from --items and --count TYPE=N options."""
+    result = {'default': items}
+    for entry in counts or []:
+        config_type, _, count = entry.partition("=")
+        if config_type not in API_CONFIG or not count.isdigit():
+            raise argparse.ArgumentTypeError(f"Invalid --count '{entry}', expected TYPE=N")
+        result[config_type] = int(count)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Instana API")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=0, help="Port to listen on (default: a free port)")
+    parser.add_argument("--items", type=int, default=100, help="Number of items per configuration type (default: 100)")
+    parser.add_argument("--count", action="append", metavar="TYPE=N", help="Number of items for a single type, overrides --items")
+    parser.add_argument("--widgets", type=int, default=10, help="Number of widgets per dashboard (default: 10)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Latency added to every request, in milliseconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random variation of the latency, in milliseconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 503")
+    parser.add_argument("--rate-limit", type=int, default=0, help="Requests per second before answering HTTP 429 (default: unlimited)")
+    parser.add_argument("--seed", type=int, help="Seed for latency jitter and error injection")
+    args = parser.parse_args()
+
+    state = StubState(
+        parse_counts(args.items, args.count),
+        latency=args.latency / 1000.0,
+        jitter=args.jitter / 1000.0,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        widgets=args.widgets,
+        seed=args.seed,
+    )
+    server = create_server(state, args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f"Listening on http://{host}:{port}{API_PREFIX}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+This module reads and writes export bundles.
+
+A bundle stores the export of every type in a single compressed file:
+
+- the magic bytes, followed by a length-prefixed JSON header (format version,
+  creation time, compression, block size and any metadata of the export)
+- the items of each type as NDJSON lines, compressed with zlib in blocks of
+  about BLOCK_SIZE bytes; all blocks of a type are contiguous
+- a zlib-compressed JSON index: for every type the offset and length of each
+  block, the number of items, and for every item key the block and the
+  position of the item in the decompressed block
+- a fixed-size footer holding the offset and length of the index
+
+Reading a type only decompresses the blocks of that type, and reading a
+single item only decompresses the block that holds it.
+"""
+
+import functools
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+from api_endpoints import API_CONFIG
+from utils import InstanaMigratorError, get_item_key
+
+BUNDLE_FILE = "export.bundle"
+BUNDLE_FORMAT = "bundle"
+BUNDLE_VERSION = 1
+BLOCK_SIZE = 64 * 1024
+MAGIC = b"IMBUNDL1"
+# Index offset and length, followed by the magic bytes again
+_FOOTER = struct.Struct(">QQ8s")
+_HEADER_LENGTH = struct.Struct(">I")
+
+
+def bundle_path(export_dir):
+    """Returns the path of the bundle in an export directory."""
+    return os.path.join(export_dir, BUNDLE_FILE)
+
+
+class BundleWriter:
+    """Writes a bundle from the exports of several types.
+
+    Each type is written through its own BundleTypeWriter, which compresses
+    its items in memory and appends them to the bundle in one piece when it is
+    closed, so types can be exported in parallel. The bundle replaces the
+    previous one only when the writer is closed. Types whose export was
+    discarded or failed are copied from the previous bundle, without being
+    decompressed.
+    """
+
+    def __init__(self, path, metadata=None):
+        self.path = path
+        self._tmp_path = f"{path}.tmp"
+        self._lock = threading.Lock()
+        self._index = {}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._previous = open_bundle(path) if os.path.exists(path) else None
+        self._file = open(self._tmp_path, 'wb')
+        header = json.dumps({
+            'version': BUNDLE_VERSION,
+            'created': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            'compression': 'zlib',
+            'block_size': BLOCK_SIZE,
+            **(metadata or {}),
+        }).encode('utf-8')
+        self._file.write(MAGIC + _HEADER_LENGTH.pack(len(header)) + header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def type_writer(self, config_type):
+        """Returns a writer for the items of a type, with the interface of ExportWriter."""
+        return BundleTypeWriter(self, config_type)
+
+    def has_previous(self, config_type):
+        """Returns True if the previous bundle holds a type."""
+        return self._previous is not None and config_type in self._previous.types
+
+    def _append(self, config_type, blocks, entry):
+        """Appends the compressed blocks of a type and records them in the index."""
+        with self._lock:
+            offset = self._file.tell()
+            for data in blocks:
+                self._file.write(data)
+            entry['blocks'] = [[offset + start, length] for start, length in entry['blocks']]
+            self._index[config_type] = entry
+
+    def keep_previous(self, config_type):
+        """Copies a type from the previous bundle. Returns False if it has none."""
+        if not self.has_previous(config_type):
+            return False
+        entry = self._previous.index[config_type]
+        start = entry['blocks'][0][0] if entry['blocks'] else 0
+        end = entry['blocks'][-1][0] + entry['blocks'][-1][1] if entry['blocks'] else 0
+        with open(self._previous.path, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start)
+        relative = dict(entry, blocks=[[offset - start, length] for offset, length in entry['blocks']])
+        self._append(config_type, [data], relative)
+        return True
+
+    def close(self):
+        """Writes the index and replaces the previous bundle.
+
+        Types of the previous bundle that were not exported in this run are
+        copied over, so exporting some types keeps the others.
+        """
+        if self._previous is not None:
+            with self._lock:
+                written = set(self._index)
+            for config_type in self._previous.types:
+                if config_type not in written:
+                    self.keep_previous(config_type)
+        with self._lock:
+            index_offset = self._file.tell()
+            index = zlib.compress(json.dumps(self._index, separators=(',', ':')).encode('utf-8'))
+            self._file.write(index)
+            self._file.write(_FOOTER.pack(index_offset, len(index), MAGIC))
+            self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        """Discards the new bundle and keeps the previous one."""
+        self._file.close()
+        os.remove(self._tmp_path)
+
+
+class BundleTypeWriter:
+    """Collects the items of one type for a bundle."""
+
+    def __init__(self, bundle, config_type):
+        self.bundle = bundle
+        self.config_type = config_type
+        self.file_path = bundle.path
+        self.count = 0
+        self._id_key = API_CONFIG.get(config_type, {}).get('id_key')
+        self._blocks = []
+        self._block_entries = []
+        self._items = {}
+        self._buffer = []
+        self._buffer_size = 0
+        self._compressed_size = 0
+        self._discarded = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None and not self._discarded:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, item):
+        """Adds a single item to the export."""
+        line = (json.dumps(item, separators=(',', ':')) + "\n").encode('utf-8')
+        key = get_item_key(item, self._id_key) if isinstance(item, dict) else None
+        if key is not None:
+            self._items.setdefault(str(key), [len(self._blocks), self._buffer_size, self._buffer_size + len(line)])
+        self._buffer.append(line)
+        self._buffer_size += len(line)
+        self.count += 1
+        if self._buffer_size >= BLOCK_SIZE:
+            self._flush_block()
+
+    def write_data(self, data):
+        """Adds the response of a list endpoint, as ExportWriter does for ndjson."""
+        if isinstance(data, list):
+            for item in data:
+                self.write(item)
+        elif isinstance(data, dict) and isinstance(data.get('items'), list):
+            for item in data['items']:
+                self.write(item)
+        elif data is not None:
+            self.write(data)
+
+    def write_document(self, data):
+        """Adds a whole configuration on a single line, as ExportWriter does for ndjson."""
+        self.write(data)
+
+    def _flush_block(self):
+        if not self._buffer:
+            return
+        data = zlib.compress(b"".join(self._buffer))
+        self._blocks.append(data)
+        self._block_entries.append([self._compressed_size, len(data)])
+        self._compressed_size += len(data)
+        self._buffer = []
+        self._buffer_size = 0
+
+    def close(self):
+        """Appends the type to the bundle."""
+        self._flush_block()
+        entry = {'count': self.count, 'blocks': self._block_entries, 'items': self._items}
+        self.bundle._append(self.config_type, self._blocks, entry)
+
+    @property
+    def discarded(self):
+        """True if the type was copied from the previous bundle."""
+        return self._discarded
+
+    def discard(self):
+        """Marks the type as unchanged, so it is copied from the previous bundle.
+
+        Ignored if the previous bundle does not hold the type.
+        """
+        self._discarded = self.bundle.has_previous(self.config_type)
+
+    def abort(self):
+        """Keeps the type of the previous bundle, if any."""
+        self._blocks = []
+        self.bundle.keep_previous(self.config_type)
+
+
+class BundleReader:
+    """Reads types and items from a bundle."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise InstanaMigratorError(f"'{path}' is not an export bundle")
+            (header_length,) = _HEADER_LENGTH.unpack(f.read(_HEADER_LENGTH.size))
+            try:
+                self.header = json.loads(f.read(header_length))
+                f.seek(-_FOOTER.size, os.SEEK_END)
+                index_offset, index_length, magic = _FOOTER.unpack(f.read(_FOOTER.size))
+                if magic != MAGIC:
+                    raise InstanaMigratorError(f"Export bundle '{path}' is incomplete")
+                f.seek(index_offset)
+                self.index = json.loads(zlib.decompress(f.read(index_length)))
+            except (ValueError, zlib.error, struct.error) as e:
+                raise InstanaMigratorError(f"Invalid export bundle '{path}': {e}")
+        if self.header.get('version') != BUNDLE_VERSION:
+            raise InstanaMigratorError(f"Unsupported version {self.header.get('version')} of export bundle '{path}'")
+
+    @property
+    def types(self):
+        """The types stored in the bundle."""
+        return list(self.index)
+
+    def _read_block(self, f, block):
+        offset, length = block
+        f.seek(offset)
+        return zlib.decompress(f.read(length))
+
+    def iter_items(self, config_type):
+        """Yields the items of a type, decompressing one block at a time."""
+        entry = self.index.get(config_type)
+        if entry is None:
+            return
+        with open(self.path, 'rb') as f:
+            for block in entry['blocks']:
+                for line in self._read_block(f, block).splitlines():
+                    yield json.loads(line)
+
+    def get_items(self, config_type, keys):
+        """Yields the items of a type with the given keys, in the order of the bundle.
+
+        Only the blocks holding these items are decompressed.
+        """
+        entry = self.index.get(config_type)
+        if entry is None:
+            return
+        positions = sorted(entry['items'][str(key)] for key in keys if str(key) in entry['items'])
+        with open(self.path, 'rb') as f:
+            block_number, data = None, None
+            for number, start, end in positions:
+                if number != block_number:
+                    block_number, data = number, self._read_block(f, entry['blocks'][number])
+                yield json.loads(data[start:end])
+
+
+@functools.lru_cache(maxsize=8)
+def _open_bundle(path, mtime_ns, size):
+    return BundleReader(path)
+
+
+def open_bundle(path):
+    """Returns a reader for a bundle, reusing it while the file is unchanged."""
+    stat = os.stat(path)
+    return _open_bundle(path, stat.st_mtime_ns, stat.st_size)
@@ -0,0 +1,172 @@
+"""
+This module prepares exported items for import into another backend.
+
+The cleaning rules of each type are declared with "cleaning" in
+api_endpoints.API_CONFIG, as a list of transforms applied in order. Every
+type also gets DEFAULT_RULES first. A transform is a dict with an "op":
+
+- drop: removes the top-level "keys"
+- reset: replaces the value of "key" with "value", if the key is present
+- coerce: sets "key" to an empty value of "type" ("list" or "dict") unless it
+  already holds one
+- filter: keeps the elements of the list in "key" whose fields equal "where"
+- drop_nested: removes "keys" from every element of the list in "key"
+- ensure: appends "default" to the list in "key" if no element matches the
+  fields in "match"
+- drop_invalid: removes "key" if its value is set but is not an object with
+  a "required" field
+
+The rules are compiled once per type into a single function. Cleaning never
+modifies its input: it returns a new top-level object, shares the nested
+values it does not change, and replaces the ones it changes.
+"""
+
+from api_endpoints import API_CONFIG
+from utils import ConfigError
+
+DEFAULT_RULES = [
+    {"op": "drop", "keys": ["scope"]},
+]
+
+_EMPTY_TYPES = {"list": list, "dict": dict}
+
+
+def _matcher(fields):
+    """Returns a function telling whether a list element has the given field values."""
+    pairs = tuple(fields.items())
+    if len(pairs) == 1:
+        ((name, value),) = pairs
+        return lambda element: isinstance(element, dict) and element.get(name) == value
+
+    def matches(element):
+        if not isinstance(element, dict):
+            return False
+        for name, value in pairs:
+            if element.get(name) != value:
+                return False
+        return True
+
+    return matches
+
+
+def _compile_step(rule):
+    """Returns a function applying one transform to a fresh top-level dict.
+
+    Steps are called with the fresh dict and the original item. A list in the
+    fresh dict that is not the one of the original was created by an earlier
+    step, so it may be changed in place instead of being copied again.
+    """
+    op = rule.get("op")
+
+    if op == "drop":
+        keys = tuple(rule["keys"])
+
+        def step(item, original):
+            for key in keys:
+                if key in item:
+                    del item[key]
+
+    elif op == "reset":
+        key, value = rule["key"], rule["value"]
+
+        def step(item, original):
+            if key in item:
+                # Every item gets its own copy of mutable defaults
+                item[key] = type(value)(value) if isinstance(value, (list, dict)) else value
+
+    elif op == "coerce":
+        key = rule["key"]
+        empty = _EMPTY_TYPES.get(rule.get("type"))
+        if empty is None:
+            raise ConfigError(f"Unknown type '{rule.get('type')}' in cleaning rule {rule}")
+
+        def step(item, original):
+            if not isinstance(item.get(key), empty):
+                item[key] = empty()
+
+    elif op == "filter":
+        key, matches = rule["key"], _matcher(rule["where"])
+
+        def step(item, original):
+            elements = item.get(key)
+            if isinstance(elements, list):
+                item[key] = [element for element in elements if matches(element)]
+
+    elif op == "drop_nested":
+        key, keys = rule["key"], frozenset(rule["keys"])
+
+        def step(item, original):
+            elements = item.get(key)
+            if not isinstance(elements, list):
+                return
+            if elements is original.get(key):
+                elements = item[key] = list(elements)
+            # Elements are shared with the original, so they are replaced
+            for index, element in enumerate(elements):
+                if isinstance(element, dict) and not keys.isdisjoint(element):
+                    elements[index] = {name: value for name, value in element.items() if name not in keys}
+
+    elif op == "ensure":
+        key, matches, default = rule["key"], _matcher(rule["match"]), dict(rule["default"])
+
+        def step(item, original):
+            elements = item.get(key)
+            if not isinstance(elements, list) or any(map(matches, elements)):
+                return
+            if elements is original.get(key):
+                elements = item[key] = list(elements)
+            elements.append(dict(default))
+
+    elif op == "drop_invalid":
+        key, required = rule["key"], rule["required"]
+
+        def step(item, original):
+            value = item.get(key)
+            if value is not None and (not isinstance(value, dict) or value.get(required) is None):
+                del item[key]
+
+    else:
+        raise ConfigError(f"Unknown cleaning operation in rule {rule}")
+
+    return step
+
+
+def compile_rules(rules):
+    """Compiles a list of transforms into a function cleaning one item.
+
+    Leading drop transforms are merged into one, applied right after the
+    top-level copy.
+    """
+    dropped = []
+    index = 0
+    while index < len(rules) and rules[index].get("op") == "drop":
+        dropped.extend(key for key in rules[index]["keys"] if key not in dropped)
+        index += 1
+    dropped = tuple(dropped)
+    steps = tuple(_compile_step(rule) for rule in rules[index:])
+
+    def clean(item):
+        if not isinstance(item, dict):
+            return item
+        cleaned = dict(item)
+        for key in dropped:
+            if key in cleaned:
+                del cleaned[key]
+        for step in steps:
+            step(cleaned, item)
+        return cleaned
+
+    return clean
+
+
+# Compiled once, when the module is loaded
+CLEANERS = {
+    config_type: compile_rules(DEFAULT_RULES + cfg.get('cleaning', []))
+    for config_type, cfg in API_CONFIG.items()
+}
+_DEFAULT_CLEANER = compile_rules(DEFAULT_RULES)
+
+
+def clean_for_import(item, config_type):
+    """Returns a copy of an object without its backend-specific keys."""
+    return CLEANERS.get(config_type, _DEFAULT_CLEANER)(item)
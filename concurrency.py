@@ -0,0 +1,242 @@
+"""
+This module contains the concurrency helpers used by the Instana Migrator.
+"""
+
+import asyncio
+import contextvars
+import itertools
+import logging
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from utils import ConfigError, InstanaMigratorError
+
+logger = logging.getLogger(__name__)
+
+# Prefix added to every log line emitted while working on a configuration type.
+# Context variables are copied into worker threads by the helpers below, so
+# lines logged from nested pools keep the prefix of the type they belong to.
+LOG_PREFIX = contextvars.ContextVar("log_prefix", default="")
+# Elements read at a time from a blocking iterable by iter_in_thread
+THREAD_CHUNK_SIZE = 500
+
+
+class LogPrefixFilter(logging.Filter):
+    """Adds the current LOG_PREFIX to every log record as 'prefix'."""
+
+    def filter(self, record):
+        record.prefix = LOG_PREFIX.get()
+        return True
+
+
+def submit_with_context(executor, fn, *args):
+    """Submits fn to executor, running it in a copy of the current context."""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def ordered_map(fn, iterable, workers):
+    """Applies fn to every element of iterable using a bounded thread pool.
+
+    Results are yielded in input order. At most ``workers * 2`` calls are in
+    flight at any time, so the iterable is consumed lazily.
+    """
+    if workers <= 1:
+        for element in iterable:
+            yield fn(element)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for element in iterable:
+            pending.append(submit_with_context(executor, fn, element))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _run_task(name, fn):
+    """Runs fn(name) with the log prefix set and returns its outcome."""
+    LOG_PREFIX.set(f"[{name}] ")
+    started = time.monotonic()
+    outcome = {'result': None, 'error': None, 'skipped': False}
+    try:
+        outcome['result'] = fn(name)
+    except InstanaMigratorError as e:
+        logger.error(f"An error occurred: {e}")
+        outcome['error'] = e
+    except Exception as e:
+        logger.error(f"An unexpected error occurred: {e}", exc_info=True)
+        outcome['error'] = e
+    outcome['duration'] = time.monotonic() - started
+    return outcome
+
+
+def dependency_levels(names, dependencies):
+    """Groups names into levels that can run in parallel.
+
+    Only dependencies between the given names are taken into account. Every
+    name is placed one level after the last of its dependencies. Raises a
+    ConfigError if the dependencies contain a cycle.
+    """
+    remaining = {
+        name: {dep for dep in dependencies.get(name, ()) if dep in names and dep != name}
+        for name in names
+    }
+    levels = []
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            raise ConfigError(f"Circular dependency between configuration types: {', '.join(remaining)}")
+        levels.append(ready)
+        for name in ready:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+    return levels
+
+
+def run_tasks(names, fn, max_workers, dependencies=None, on_skip=None):
+    """Runs fn(name) for every name, at most max_workers at the same time.
+
+    dependencies optionally maps a name to the names that must finish before
+    it may start. A task starts as soon as all of its dependencies are done,
+    and is skipped if one of them failed; on_skip(name) is then called, if
+    given. Errors are logged and recorded instead of stopping the other tasks.
+
+    Returns a dict mapping each name to a dict with 'result', 'error',
+    'skipped' and 'duration' (in seconds), in the order of names.
+    """
+    dependencies = dependencies or {}
+    dependency_levels(names, dependencies)  # Fail early on cycles
+    waiting = {
+        name: {dep for dep in dependencies.get(name, ()) if dep in names and dep != name}
+        for name in names
+    }
+    outcomes = {}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        def start_ready_tasks():
+            started = True
+            while started:
+                started = False
+                for name in list(waiting):
+                    if not waiting[name] <= outcomes.keys():
+                        continue
+                    failed = sorted(dep for dep in waiting.pop(name) if outcomes[dep]['error'])
+                    started = True
+                    if failed:
+                        error = InstanaMigratorError(f"Skipped because '{', '.join(failed)}' failed")
+                        logger.error(f"[{name}] {error}")
+                        outcomes[name] = {'result': None, 'error': error, 'skipped': True, 'duration': 0.0}
+                        if on_skip:
+                            on_skip(name)
+                    else:
+                        future = executor.submit(contextvars.copy_context().run, _run_task, name, fn)
+                        running[future] = name
+
+        start_ready_tasks()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                outcomes[running.pop(future)] = future.result()
+            start_ready_tasks()
+
+    return {name: outcomes[name] for name in names}
+
+
+async def iter_in_thread(iterable, chunk_size=THREAD_CHUNK_SIZE):
+    """Yields the elements of a blocking iterable without blocking the event loop.
+
+    The iterable is consumed in chunks of chunk_size elements on a worker
+    thread, so reading and parsing files does not hold up the requests in
+    flight. Lists are yielded directly.
+    """
+    if isinstance(iterable, list):
+        for element in iterable:
+            yield element
+        return
+    iterator = iter(iterable)
+    while True:
+        chunk = await asyncio.to_thread(list, itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        for element in chunk:
+            yield element
+
+
+async def async_ordered_map(fn, iterable, limit):
+    """Awaits fn(element) for every element of iterable as concurrent tasks.
+
+    The asyncio counterpart of ordered_map: results are yielded in input
+    order, and at most ``limit`` calls are in flight at any time. iterable
+    may also be an asynchronous iterable.
+    """
+    if not hasattr(iterable, '__aiter__'):
+        iterable = _as_async(iterable)
+    pending = deque()
+    try:
+        async for element in iterable:
+            pending.append(asyncio.ensure_future(fn(element)))
+            if len(pending) >= limit:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _as_async(iterable):
+    for element in iterable:
+        yield element
+
+
+async def _run_task_async(name, fn):
+    """Awaits fn(name) with the log prefix set and returns its outcome."""
+    LOG_PREFIX.set(f"[{name}] ")
+    started = time.monotonic()
+    outcome = {'result': None, 'error': None, 'skipped': False}
+    try:
+        outcome['result'] = await fn(name)
+    except InstanaMigratorError as e:
+        logger.error(f"An error occurred: {e}")
+        outcome['error'] = e
+    except Exception as e:
+        logger.error(f"An unexpected error occurred: {e}", exc_info=True)
+        outcome['error'] = e
+    outcome['duration'] = time.monotonic() - started
+    return outcome
+
+
+async def run_tasks_async(names, fn, max_parallel, dependencies=None, on_skip=None):
+    """The asyncio counterpart of run_tasks, for a coroutine function fn.
+
+    Tasks are scheduled the same way and the same outcomes are returned.
+    """
+    dependencies = dependencies or {}
+    levels = dependency_levels(names, dependencies)  # Fail early on cycles
+    slots = asyncio.Semaphore(max_parallel)
+    tasks = {}
+
+    async def run(name):
+        deps = [dep for dep in dependencies.get(name, ()) if dep in names and dep != name]
+        outcomes = await asyncio.gather(*(tasks[dep] for dep in deps))
+        failed = sorted(dep for dep, outcome in zip(deps, outcomes) if outcome['error'])
+        if failed:
+            error = InstanaMigratorError(f"Skipped because '{', '.join(failed)}' failed")
+            logger.error(f"[{name}] {error}")
+            if on_skip:
+                on_skip(name)
+            return {'result': None, 'error': error, 'skipped': True, 'duration': 0.0}
+        async with slots:
+            return await _run_task_async(name, fn)
+
+    # Tasks are created level by level, so the tasks a task waits for exist
+    for level in levels:
+        for name in level:
+            tasks[name] = asyncio.ensure_future(run(name))
+    return {name: await tasks[name] for name in names}
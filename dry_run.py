@@ -0,0 +1,73 @@
+"""
+This module writes the plan of a dry-run import.
+
+The plan is an NDJSON file with one line per request the import would make
+(type, method, URL, item key and payload hash), followed by one line of
+totals per type: the number of requests per method and the item counts of
+the import. Entries are sorted, so the plans of two runs can be compared
+with diff regardless of the order in which the items were processed.
+"""
+
+import json
+import logging
+import os
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+def log_payload(payload):
+    """Logs a payload at DEBUG level, formatting it only if DEBUG is enabled."""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"    Payload: {json.dumps(payload, indent=2)}")
+
+
+class DryRunPlan:
+    """Collects the requests of a dry-run import and writes them on close."""
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def record(self, config_type, method, url, key, payload_hash):
+        """Adds a request the import would make."""
+        entry = (str(key), method, url, payload_hash)
+        with self._lock:
+            self._entries.setdefault(config_type, []).append(entry)
+
+    def close(self, results=None):
+        """Writes the plan file.
+
+        results optionally maps types to the results returned by the import,
+        whose item counts are added to the totals of each type.
+        """
+        results = results or {}
+        with self._lock:
+            entries = {config_type: sorted(items) for config_type, items in self._entries.items()}
+        for config_type in results:
+            entries.setdefault(config_type, [])
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            for config_type in sorted(entries):
+                methods = Counter()
+                for key, method, url, payload_hash in entries[config_type]:
+                    methods[method] += 1
+                    f.write(json.dumps({
+                        'type': config_type, 'method': method, 'url': url, 'key': key, 'payload_hash': payload_hash,
+                    }, separators=(',', ':')) + "\n")
+                totals = {'requests': sum(methods.values()), **dict(sorted(methods.items()))}
+                totals.update(results.get(config_type) or {})
+                f.write(json.dumps({'type': config_type, 'totals': totals}, separators=(',', ':')) + "\n")
+        os.replace(tmp_path, self.path)
+        logger.info(f"Dry-run plan with {sum(map(len, entries.values()))} request(s) written to {self.path}")
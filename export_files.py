@@ -0,0 +1,224 @@
+"""
+This module reads and writes the export files of the Instana Migrator.
+
+Three formats are supported:
+- json: one pretty-printed JSON document per type (<type>.json)
+- ndjson: one compact JSON object per line (<type>.ndjson), written as the
+  items arrive and read back line by line
+- bundle: every type in a single compressed file with an index
+  (export.bundle), see the bundle module
+"""
+
+import json
+import os
+
+from api_endpoints import API_CONFIG
+from bundle import BUNDLE_FORMAT, bundle_path, open_bundle
+from utils import InstanaMigratorError, get_item_key
+
+EXPORT_FORMATS = ("json", "ndjson")
+
+
+def export_file_path(export_dir, config_type, export_format):
+    """Returns the path of the export file for a type and format."""
+    return os.path.join(export_dir, f"{config_type}.{export_format}")
+
+
+def find_export_file(export_dir, config_type):
+    """Returns the most recently written export file or bundle holding a type, or None."""
+    candidates = [
+        export_file_path(export_dir, config_type, export_format)
+        for export_format in EXPORT_FORMATS
+    ]
+    existing = [path for path in candidates if os.path.exists(path)]
+    bundle_file = bundle_path(export_dir)
+    if os.path.exists(bundle_file) and config_type in open_bundle(bundle_file).types:
+        existing.append(bundle_file)
+    if not existing:
+        return None
+    return max(existing, key=os.path.getmtime)
+
+
+def iter_export_items(file_path, config_type=None, keys=None):
+    """Yields the items stored in an export file.
+
+    A JSON file holding a list yields its elements, and a JSON file holding a
+    single object yields that object. NDJSON files are read line by line, so
+    memory use does not depend on the size of the file. Bundles yield the
+    items of config_type.
+
+    With keys, only the items with these keys are yielded. In a bundle, only
+    the blocks holding them are decompressed.
+    """
+    if file_path.endswith(f".{BUNDLE_FORMAT}"):
+        reader = open_bundle(file_path)
+        if keys is None:
+            yield from reader.iter_items(config_type)
+        else:
+            yield from reader.get_items(config_type, keys)
+        return
+    if keys is not None:
+        keys = {str(key) for key in keys}
+        id_key = API_CONFIG.get(config_type, {}).get('id_key')
+        for item in unwrap_items(iter_export_items(file_path)):
+            if isinstance(item, dict) and str(get_item_key(item, id_key)) in keys:
+                yield item
+        return
+
+    if file_path.endswith(".ndjson"):
+        with open(file_path, 'r') as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise InstanaMigratorError(f"Invalid JSON on line {line_number} of '{file_path}': {e}")
+        return
+
+    with open(file_path, 'r') as f:
+        try:
+            data = json.load(f)
+        except json.JSONDecodeError as e:
+            raise InstanaMigratorError(f"Invalid JSON in '{file_path}': {e}")
+    if isinstance(data, list):
+        yield from data
+    else:
+        yield data
+
+
+def read_export_document(file_path, config_type):
+    """Returns the configuration of a type imported with PUT, in the shape it was exported.
+
+    JSON files hold the document as it is. NDJSON files and bundles hold it on
+    a single line (see ExportWriter.write_document); the exports of older
+    versions, which wrote the elements of a list one per line, are read back
+    as a list.
+    """
+    if file_path.endswith(".json"):
+        with open(file_path, 'r') as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError as e:
+                raise InstanaMigratorError(f"Invalid JSON in '{file_path}': {e}")
+    items = list(iter_export_items(file_path, config_type))
+    return items[0] if len(items) == 1 else items
+
+
+def unwrap_items(items):
+    """Yields the elements of 'items' for objects that nest them, as services do."""
+    for item in items:
+        if isinstance(item, dict) and isinstance(item.get('items'), list):
+            yield from item['items']
+        else:
+            yield item
+
+
+def open_export_writer(export_dir, config_type, export_format, bundle=None, snapshot=None):
+    """Returns the writer for the export of a type: its own file, or its part of bundle.
+
+    With snapshot, a SnapshotWriter, the items are also recorded in the snapshot.
+    """
+    if export_format == BUNDLE_FORMAT:
+        if bundle is None:
+            raise InstanaMigratorError("The bundle format needs the BundleWriter of the export")
+        writer = bundle.type_writer(config_type)
+    else:
+        writer = ExportWriter(export_file_path(export_dir, config_type, export_format), export_format)
+    return snapshot.type_writer(config_type, writer) if snapshot is not None else writer
+
+
+class ExportWriter:
+    """Writes the exported items of one type to a file.
+
+    In ndjson format every item is written as soon as it is passed in. In json
+    format the items are collected and written as one document on close. The
+    data is written to a temporary file that replaces the previous export only
+    when the writer is closed without an error.
+    """
+
+    def __init__(self, file_path, export_format):
+        if export_format not in EXPORT_FORMATS:
+            raise InstanaMigratorError(f"Unknown export format '{export_format}'")
+        self.file_path = file_path
+        self.export_format = export_format
+        self.count = 0
+        self._tmp_path = f"{file_path}.tmp"
+        self._file = open(self._tmp_path, 'w')
+        self._data = []
+        self._discarded = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None and not self._discarded:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, item):
+        """Adds a single item to the export."""
+        self.count += 1
+        if self.export_format == "ndjson":
+            self._file.write(json.dumps(item, separators=(',', ':')))
+            self._file.write("\n")
+        else:
+            self._data.append(item)
+
+    def write_data(self, data):
+        """Adds the response of a list endpoint to the export.
+
+        Lists are added item by item. Objects are stored as they are in json
+        format; in ndjson format their 'items' (as returned for services) are
+        written one per line, or the object itself if it has no 'items'.
+        """
+        if isinstance(data, list):
+            for item in data:
+                self.write(item)
+        elif data is None:
+            return
+        elif self.export_format == "ndjson":
+            items = data.get('items') if isinstance(data, dict) else None
+            if isinstance(items, list):
+                for item in items:
+                    self.write(item)
+            else:
+                self.write(data)
+        else:
+            self._data = data
+            # Handle case where services are nested under 'items'
+            self.count = len(data.get('items', [1])) if isinstance(data, dict) else 1
+
+    def write_document(self, data):
+        """Adds a whole configuration, as imported with PUT, keeping its shape.
+
+        In ndjson format the document is written on a single line, so a list
+        with one element can be told apart from an object.
+        """
+        if self.export_format == "ndjson":
+            self.write(data)
+        else:
+            self._data = data
+            self.count = 1
+
+    def close(self):
+        """Finishes the export file."""
+        if self.export_format == "json":
+            json.dump(self._data, self._file, indent=2)
+        self._file.close()
+        os.replace(self._tmp_path, self.file_path)
+
+    @property
+    def discarded(self):
+        """True if the previous export file was kept."""
+        return self._discarded
+
+    def discard(self):
+        """Marks the export as unchanged, so the previous file is kept on exit."""
+        self._discarded = True
+
+    def abort(self):
+        """Discards the export file and keeps the previous export, if any."""
+        self._file.close()
+        os.remove(self._tmp_path)
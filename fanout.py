@@ -0,0 +1,194 @@
+"""
+This module imports one export into several destination backends.
+
+The destinations are listed under "destinations" in config.yaml, each with a
+"name" and the same settings as "destination". Every destination imports
+every selected type as a task of its own, named "<destination>/<type>", so
+each destination keeps its own InstanaAPI clients, limits, dependency order
+and report. The items of each type are read and cleaned once and shared by
+all destinations through SharedImports.
+"""
+
+import itertools
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+from utils import ConfigError
+
+logger = logging.getLogger(__name__)
+
+TASK_SEPARATOR = "/"
+# Types with more items are shared through a temporary file instead of memory
+MAX_SHARED_ITEMS = 10000
+
+
+def destination_configs(config, names=None):
+    """Returns the (name, backend configuration) pairs of the destinations to import into.
+
+    Uses "destinations" if config.yaml has it, else the single "destination",
+    named "destination". names optionally selects destinations by name.
+    """
+    entries = config.get('destinations')
+    if entries is None:
+        if not config.get('destination'):
+            raise ConfigError("'destination' configuration not found in config.yaml")
+        destinations = [('destination', config['destination'])]
+    else:
+        if not isinstance(entries, list) or not entries:
+            raise ConfigError("'destinations' in config.yaml must be a non-empty list")
+        destinations = []
+        for position, entry in enumerate(entries, start=1):
+            if not isinstance(entry, dict) or not entry.get('api_url'):
+                raise ConfigError(f"Destination {position} in config.yaml has no 'api_url'")
+            name = str(entry.get('name') or position)
+            if TASK_SEPARATOR in name:
+                raise ConfigError(f"Destination name '{name}' must not contain '{TASK_SEPARATOR}'")
+            destinations.append((name, entry))
+        duplicates = sorted({name for name, _ in destinations if [n for n, _ in destinations].count(name) > 1})
+        if duplicates:
+            raise ConfigError(f"Duplicate destination name(s) in config.yaml: {', '.join(duplicates)}")
+
+    if names:
+        known = dict(destinations)
+        unknown = [name for name in names if name not in known]
+        if unknown:
+            raise ConfigError(f"Unknown destination(s) '{', '.join(unknown)}'. Configured: {', '.join(known)}")
+        destinations = [(name, known[name]) for name in dict.fromkeys(names)]
+    return destinations
+
+
+def task_name(destination, config_type):
+    """Returns the name of the task importing a type into a destination."""
+    return f"{destination}{TASK_SEPARATOR}{config_type}"
+
+
+def split_task_name(name):
+    """Returns the destination and type of a task name."""
+    destination, _, config_type = name.rpartition(TASK_SEPARATOR)
+    return destination, config_type
+
+
+def fanout_tasks(destinations, config_types, dependencies):
+    """Returns the task names and their dependencies for importing types into destinations.
+
+    A type depends on the types it references in the same destination only.
+    """
+    names = [task_name(destination, config_type) for destination, _ in destinations for config_type in config_types]
+    task_dependencies = {
+        task_name(destination, config_type): [task_name(destination, dep) for dep in dependencies.get(config_type, [])]
+        for destination, _ in destinations
+        for config_type in config_types
+    }
+    return names, task_dependencies
+
+
+def group_by_destination(outcomes):
+    """Splits the outcomes of the fan-out tasks into a dict per destination."""
+    grouped = {}
+    for name, outcome in outcomes.items():
+        destination, config_type = split_task_name(name)
+        grouped.setdefault(destination, {})[config_type] = outcome
+    return grouped
+
+
+def combine_results(outcomes):
+    """Adds up the results of every destination per type."""
+    combined = {}
+    for name, outcome in outcomes.items():
+        _, config_type = split_task_name(name)
+        totals = combined.setdefault(config_type, {})
+        for key, value in (outcome['result'] or {}).items():
+            totals[key] = totals.get(key, 0) + value
+    return combined
+
+
+class SharedImports:
+    """Reads and cleans the items of each type once for all destinations.
+
+    load(config_type) returns the items of a type as import_items does. The
+    first destination to ask for a type loads its items, the others wait for
+    them and get the same list. A type is dropped once every destination has
+    released it, or its import was skipped.
+
+    Types with more than max_items items are not kept in memory: their
+    prepared items are written once to a temporary NDJSON file, which every
+    destination then reads one item at a time. close() removes any files
+    left over.
+    """
+
+    def __init__(self, load, users, max_items=MAX_SHARED_ITEMS):
+        self._load = load
+        self._users = users
+        self.max_items = max_items
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._spill_dir = None
+
+    def _entry(self, config_type):
+        """Returns the entry of a type, created on first use. Must hold the lock."""
+        entry = self._entries.get(config_type)
+        if entry is None:
+            entry = self._entries[config_type] = {
+                'lock': threading.Lock(), 'items': None, 'path': None, 'users': self._users,
+            }
+        return entry
+
+    def get(self, config_type):
+        """Returns the prepared items of a type, as a list or, for large types, an iterator."""
+        with self._lock:
+            entry = self._entry(config_type)
+        with entry['lock']:
+            if entry['items'] is None and entry['path'] is None:
+                items = iter(self._load(config_type))
+                head = list(itertools.islice(items, self.max_items + 1))
+                if len(head) <= self.max_items:
+                    entry['items'] = head
+                else:
+                    logger.info(f"'{config_type}' has more than {self.max_items} items, they are shared through a temporary file.")
+                    entry['path'] = self._spill(config_type, itertools.chain(head, items))
+        if entry['path'] is not None:
+            return _read_spilled(entry['path'])
+        return entry['items']
+
+    def _spill(self, config_type, entries):
+        """Writes prepared items to a temporary NDJSON file and returns its path."""
+        with self._lock:
+            if self._spill_dir is None:
+                self._spill_dir = tempfile.mkdtemp(prefix="instana-migrator-")
+        path = os.path.join(self._spill_dir, f"{config_type}.ndjson")
+        with open(path, 'w') as f:
+            for item, payload, payload_hash in entries:
+                f.write(json.dumps([item, payload, payload_hash], separators=(',', ':')))
+                f.write("\n")
+        return path
+
+    def release(self, config_type):
+        """Marks a type as done, or skipped, for one destination."""
+        with self._lock:
+            # A destination may skip a type before any other one loaded it
+            entry = self._entry(config_type)
+            entry['users'] -= 1
+            if entry['users'] > 0:
+                return
+            del self._entries[config_type]
+        if entry['path'] is not None:
+            os.remove(entry['path'])
+
+    def close(self):
+        """Removes the temporary files of the types that were not released."""
+        with self._lock:
+            spill_dir, self._spill_dir = self._spill_dir, None
+        if spill_dir is not None:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+def _read_spilled(path):
+    """Yields the prepared items written by SharedImports._spill."""
+    with open(path, 'r') as f:
+        for line in f:
+            item, payload, payload_hash = json.loads(line)
+            yield item, payload, payload_hash
@@ -0,0 +1,92 @@
+"""
+This module selects the items an export or import works on.
+
+An ItemFilter combines the --id, --match, --owner and --tag options; an item
+is selected if it passes every option that was given:
+- ids: the key of the item (its id_key, name or title) is one of the IDs
+- pattern: the regular expression is found in the name or title
+- owners: the ownerId of the item is one of the owners
+- tags: the item has one of the tags, as a string or as an object with a
+  'name' or 'key' in its 'tags' list
+
+Options need the field they test; an item without it is not selected. On
+export, custom dashboards are filtered on their list entries, so details
+are never fetched for the dashboards that are left out. Filtered exports are
+written to FILTERED_EXPORT_DIR inside the export directory, so they never
+replace a complete export.
+"""
+
+import re
+
+from api_endpoints import API_CONFIG
+from utils import ConfigError, get_item_key
+
+FILTERED_EXPORT_DIR = "filtered"
+
+
+class ItemFilter:
+    """Predicate on exported items, built from the filter options."""
+
+    def __init__(self, ids=None, pattern=None, owners=None, tags=None):
+        self.ids = {str(item_id) for item_id in ids} if ids else None
+        try:
+            self.pattern = re.compile(pattern) if pattern else None
+        except re.error as e:
+            raise ConfigError(f"Invalid --match expression '{pattern}': {e}")
+        self.owners = set(owners) if owners else None
+        self.tags = set(tags) if tags else None
+
+    @classmethod
+    def from_args(cls, args):
+        """Returns the filter given on the command line, or None if there is none."""
+        item_filter = cls(args.ids, args.match, args.owners, args.tags)
+        return item_filter if item_filter.active else None
+
+    @property
+    def active(self):
+        """True if at least one option was given."""
+        return any(option is not None for option in (self.ids, self.pattern, self.owners, self.tags))
+
+    def matches(self, item, config_type):
+        """Returns True if an item, or its list entry, is selected."""
+        if not isinstance(item, dict):
+            return False
+        if self.ids is not None and str(get_item_key(item, API_CONFIG[config_type].get('id_key'))) not in self.ids:
+            return False
+        if self.pattern is not None:
+            label = item.get('name', item.get('title'))
+            if not isinstance(label, str) or not self.pattern.search(label):
+                return False
+        if self.owners is not None and item.get('ownerId') not in self.owners:
+            return False
+        if self.tags is not None and self.tags.isdisjoint(_tags(item)):
+            return False
+        return True
+
+    def select(self, items, config_type):
+        """Yields the selected items."""
+        for item in items:
+            if self.matches(item, config_type):
+                yield item
+
+    def select_data(self, data, config_type):
+        """Returns the response of a list endpoint with only the selected items.
+
+        Objects that are not lists of items, such as the configuration of
+        types imported with PUT, are returned as they are.
+        """
+        if isinstance(data, list):
+            return list(self.select(data, config_type))
+        if isinstance(data, dict) and isinstance(data.get('items'), list):
+            return dict(data, items=list(self.select(data['items'], config_type)))
+        return data
+
+
+def _tags(item):
+    tags = set()
+    for tag in item.get('tags') or ():
+        if isinstance(tag, dict):
+            tag = tag.get('name', tag.get('key'))
+        if isinstance(tag, str):
+            tags.add(tag)
+    return tags
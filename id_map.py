@@ -0,0 +1,162 @@
+"""
+This module contains the ID map of the Instana Migrator.
+
+Items created on a destination get new IDs, while the items that reference
+them still carry the IDs of the source. The ID map records, for every
+destination, type and source ID, the ID of the item on the destination. It
+is filled from the responses of the import and from the items matched by
+--sync, and kept in an NDJSON file, so later runs can reuse it.
+
+The references of a type are declared with "references" in
+api_endpoints.API_CONFIG: a list of {"path": ..., "type": ...} entries,
+where path is a dot-separated list of keys leading to an ID or a list of
+IDs of the given type. Lists met on the way are followed element by element.
+Before an item is sent, every referenced ID found in the map is replaced.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from api_endpoints import API_CONFIG
+from utils import ConfigError, InstanaMigratorError
+
+logger = logging.getLogger(__name__)
+
+ID_MAP_FILE = "id-map.ndjson"
+
+
+def _compile_references(config_type, references):
+    compiled = []
+    for reference in references:
+        if not reference.get('path') or reference.get('type') not in API_CONFIG:
+            raise ConfigError(f"Invalid reference {reference} of '{config_type}': needs a 'path' and a known 'type'")
+        compiled.append((tuple(reference['path'].split('.')), reference['type']))
+    return tuple(compiled)
+
+
+# Compiled once, when the module is loaded
+REFERENCES = {
+    config_type: _compile_references(config_type, cfg['references'])
+    for config_type, cfg in API_CONFIG.items()
+    if cfg.get('references')
+}
+
+
+def source_id(item, config_type):
+    """Returns the ID of an item on the source backend, or None."""
+    if not isinstance(item, dict):
+        return None
+    return item.get(API_CONFIG[config_type].get('id_key') or 'id') or item.get('id')
+
+
+def _rewrite(value, keys, lookup):
+    """Returns value with the IDs at keys replaced, sharing everything that is unchanged."""
+    if isinstance(value, list):
+        rewritten = [_rewrite(element, keys, lookup) for element in value]
+        return value if all(new is old for new, old in zip(rewritten, value)) else rewritten
+    if not keys:
+        if isinstance(value, (str, int)) and not isinstance(value, bool):
+            mapped = lookup(value)
+            if mapped is not None and mapped != value:
+                return mapped
+        return value
+    if isinstance(value, dict) and keys[0] in value:
+        child = value[keys[0]]
+        rewritten = _rewrite(child, keys[1:], lookup)
+        if rewritten is not child:
+            return {**value, keys[0]: rewritten}
+    return value
+
+
+class IdMap:
+    """Persistent map of source IDs to destination IDs.
+
+    Lookups are dict accesses. New mappings are appended to the file as they
+    are recorded; a line left incomplete by an interrupted run is ignored
+    when the map is loaded, and later lines override earlier ones.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._ids = {}
+        self._lock = threading.Lock()
+        self._file = None
+        self.recorded = 0
+        if os.path.exists(path):
+            self._load()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _load(self):
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self._ids[(entry.get('destination'), entry.get('type'), str(entry.get('source_id')))] = entry.get('destination_id')
+        logger.info(f"Loaded {len(self._ids)} ID mapping(s) from '{self.path}'.")
+
+    def get(self, destination, config_type, source_id):
+        """Returns the destination ID of an item, or None if it is not known."""
+        return self._ids.get((destination, config_type, str(source_id)))
+
+    def mapped_id(self, destination, config_type, item):
+        """Returns the destination ID recorded for an item of the source, or None."""
+        return self.get(destination, config_type, source_id(item, config_type))
+
+    def record(self, destination, config_type, source_id, destination_id):
+        """Records the destination ID of an item. Ignored if either ID is missing."""
+        if source_id is None or destination_id is None:
+            return
+        key = (destination, config_type, str(source_id))
+        with self._lock:
+            if self._ids.get(key) == destination_id:
+                return
+            self._ids[key] = destination_id
+            if self._file is None:
+                # Opened on the first new mapping, so dry runs leave no file behind
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._file = open(self.path, 'a')
+            self._file.write(json.dumps({
+                'time': time.time(),
+                'destination': destination,
+                'type': config_type,
+                'source_id': source_id,
+                'destination_id': destination_id,
+            }, separators=(',', ':')) + "\n")
+            self.recorded += 1
+
+    def rewrite(self, item, config_type, destination):
+        """Returns an item with the IDs it references replaced by their destination IDs.
+
+        The item itself is not modified; it is returned as it is if no
+        reference was replaced.
+        """
+        for keys, referenced_type in REFERENCES.get(config_type, ()):
+            item = _rewrite(item, keys, lambda value: self._ids.get((destination, referenced_type, str(value))))
+        return item
+
+    def close(self):
+        """Writes the pending mappings and closes the file."""
+        with self._lock:
+            if self._file is None or self._file.closed:
+                return
+            try:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError as e:
+                raise InstanaMigratorError(f"Could not write ID map '{self.path}': {e}")
+            finally:
+                self._file.close()
+        if self.recorded:
+            logger.info(f"{self.recorded} new ID mapping(s) written to '{self.path}'.")
@@ -0,0 +1,56 @@
+"""
+This module prepares the items of an import and sums up its outcome.
+
+Both migration engines read the items of a type through import_items and
+report the outcome of each type with import_result.
+"""
+
+from api_endpoints import API_CONFIG
+from cleaning import clean_for_import
+from export_files import export_file_path, find_export_file, iter_export_items, read_export_document, unwrap_items
+from utils import InstanaMigratorError, content_hash
+
+
+def import_result(counts):
+    """Returns the result of an import from a Counter of item outcomes."""
+    return {
+        'success': counts['created'] + counts['updated'] + counts['unchanged'] + counts['resumed'],
+        'failed': counts['failed'],
+        'created': counts['created'],
+        'updated': counts['updated'],
+        'unchanged': counts['unchanged'],
+        'resumed': counts['resumed'],
+    }
+
+
+def import_items(export_dir, config_type, item_filter=None):
+    """Returns the items of a type to import, as (item, payload, payload hash) tuples.
+
+    The payload is the item cleaned for import. Items are read and cleaned
+    lazily, so NDJSON exports are imported with constant memory. Types
+    imported with PUT yield a single tuple for the whole configuration. With
+    item_filter, only the items it selects are returned, before they are
+    cleaned; it does not apply to types imported with PUT.
+    """
+    file_path = find_export_file(export_dir, config_type)
+    if file_path is None:
+        raise InstanaMigratorError(f"Export file not found at '{export_file_path(export_dir, config_type, 'json')}'. Please run the export first.")
+
+    if API_CONFIG[config_type]['import_method'] == 'PUT':
+        data = read_export_document(file_path, config_type)
+        payload = clean_for_import(data, config_type)
+        return [(data, payload, content_hash(payload))]
+
+    # With IDs, bundles only decompress the blocks holding the selected items
+    keys = item_filter.ids if item_filter else None
+    items = iter_export_items(file_path, config_type, keys)
+    if config_type == 'services':
+        items = unwrap_items(items)
+    if item_filter:
+        items = item_filter.select(items, config_type)
+
+    def prepare(item):
+        payload = clean_for_import(item, config_type)
+        return item, payload, content_hash(payload)
+
+    return map(prepare, items)
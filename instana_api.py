@@ -1,34 +1,223 @@
-
 import requests
 import logging
 import json
+import math
+import random
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 
+from concurrency import ordered_map
+from metrics import METRICS
+from rate_control import limiter_for
 from utils import handle_api_error, get_api_headers, APIError
 
 logger = logging.getLogger(__name__)
 
+# --- Connection and Retry Defaults ---
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_FACTOR = 0.5
+DEFAULT_BACKOFF_MAX = 30.0
+DEFAULT_TIMEOUT = 60
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+# A POST may have created its item before a 502/504 or a dropped connection,
+# so it is only retried when the backend cannot have handled it
+POST_RETRY_STATUS_CODES = (429, 503)
+DEFAULT_PAGE_PREFETCH = 4
+
+
+def parse_retry_after(value):
+    """Returns the delay in seconds from a Retry-After header, or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def retry_status_codes(method):
+    """Returns the status codes on which a request with this method is retried."""
+    return POST_RETRY_STATUS_CODES if method == "POST" else RETRY_STATUS_CODES
+
+
+def connection_not_established(error):
+    """Returns True if a request failed before anything was sent to the backend."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    # Refused connections are raised as a ConnectionError wrapping a NewConnectionError
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def page_params(pagination, page):
+    """Returns the query parameters requesting a page of a paginated endpoint."""
+    return {pagination['page_param']: page, pagination['size_param']: pagination['page_size']}
+
+
+def page_items(pagination, body):
+    """Returns the items of a page."""
+    if not isinstance(body, dict):
+        return body or []
+    return body.get(pagination.get('items_key', 'items')) or []
+
+
+def served_page_size(pagination, body):
+    """Returns the number of items per page the backend serves, from its first page.
+
+    The backend may cap the page size below the one requested, so a page
+    with fewer items than requested is not necessarily the last one. The size
+    the first page reports is used if it has one, else its number of items.
+    """
+    reported = body.get(pagination['size_param']) if isinstance(body, dict) else None
+    if isinstance(reported, int) and reported > 0:
+        return min(reported, pagination['page_size'])
+    return min(len(page_items(pagination, body)), pagination['page_size'])
+
+
+def last_page(pagination, body):
+    """Returns the number of the last page from the first one, or None if unknown."""
+    total = body.get(pagination['total_key']) if pagination.get('total_key') and isinstance(body, dict) else None
+    if not isinstance(total, int):
+        return None
+    page_size = served_page_size(pagination, body)
+    if not page_size:
+        return pagination.get('first_page', 1)
+    return pagination.get('first_page', 1) + max(1, math.ceil(total / page_size)) - 1
+
 
 class InstanaAPI:
     """A wrapper for the Instana API."""
 
-    def __init__(self, backend_config):
+    def __init__(self, backend_config, config_type=None, metrics=None):
+        self.config_type = config_type
+        self.metrics = metrics or METRICS
         self.base_url = backend_config['api_url'].rstrip('/')
         self.headers = get_api_headers(backend_config['api_token'])
         self.verify = not backend_config.get('allow_self_signed_certs', False)
+        self.timeout = backend_config.get('timeout', DEFAULT_TIMEOUT)
+        self.max_retries = int(backend_config.get('max_retries', DEFAULT_MAX_RETRIES))
+        self.backoff_factor = float(backend_config.get('backoff_factor', DEFAULT_BACKOFF_FACTOR))
+        self.backoff_max = float(backend_config.get('backoff_max', DEFAULT_BACKOFF_MAX))
+        # Shared by every client of the same api_url, None unless enabled
+        self.limiter = limiter_for(backend_config, self.metrics)
+
+        # A single pooled session keeps connections alive between requests.
+        # pool_block makes extra threads wait for a free connection instead of
+        # opening throwaway ones.
+        pool_size = int(backend_config.get('pool_size', DEFAULT_POOL_SIZE))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.verify = self.verify
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Closes all pooled connections."""
+        self.session.close()
+
+    def _backoff(self, attempt, response=None):
+        """Returns the delay before the next attempt.
+
+        A Retry-After header is honoured as sent; otherwise the delay is a
+        full-jitter exponential backoff capped at backoff_max.
+        """
+        if response is not None:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is not None:
+                return retry_after
+        return random.uniform(0, min(self.backoff_max, self.backoff_factor * (2 ** attempt)))
+
+    def _send(self, method, url, **kwargs):
+        """Sends a single attempt of a request, within the adaptive limit if enabled."""
+        if self.limiter is None:
+            return self.session.request(method, url, **kwargs)
+        self.limiter.acquire()
+        started = time.monotonic()
+        status, headers = 0, None
+        try:
+            response = self.session.request(method, url, **kwargs)
+            status, headers = response.status_code, response.headers
+            return response
+        finally:
+            self.limiter.release()
+            self.limiter.record(time.monotonic() - started, status, headers)
 
     def _request(self, method, path, **kwargs):
-        """Makes a request to the Instana API."""
+        """Makes a request to the Instana API, retrying transient failures.
+
+        A POST is only retried on HTTP 429 and 503 and when the connection
+        could not be established, as otherwise the item may already have been
+        created. Every call is recorded in the metrics collector, with its
+        duration including retries.
+        """
         url = self.base_url + path
+        kwargs.setdefault('timeout', self.timeout)
+        retry_statuses = retry_status_codes(method)
+        started = time.monotonic()
+        status = 0
+        bytes_sent = bytes_received = 0
+        attempt = 0
         try:
-            response = requests.request(
-                method, url, headers=self.headers, verify=self.verify, **kwargs
+            while True:
+                try:
+                    response = self._send(method, url, **kwargs)
+                except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                    status = 0
+                    if method == "POST" and not connection_not_established(e):
+                        raise APIError(f"Request to {url} failed: {e}")
+                    if attempt >= self.max_retries:
+                        raise APIError(f"Request to {url} failed after {attempt + 1} attempt(s): {e}")
+                    delay = self._backoff(attempt)
+                    logger.debug(f"    - {method} {url} failed ({e}), retrying in {delay:.2f}s")
+                except requests.exceptions.RequestException as e:
+                    status = 0
+                    raise APIError(f"Request to {url} failed: {e}")
+                else:
+                    status = response.status_code
+                    bytes_sent += len(response.request.body or b"")
+                    if status not in retry_statuses or attempt >= self.max_retries:
+                        bytes_received = len(response.content)
+                        try:
+                            response.raise_for_status()  # Raise an exception for bad status codes
+                        except requests.exceptions.HTTPError as e:
+                            handle_api_error(e.response, url)
+                        if not response.content:
+                            return None
+                        try:
+                            return response.json()
+                        except json.JSONDecodeError as e:
+                            raise APIError(f"Invalid JSON in response from {url}: {e}")
+                    delay = self._backoff(attempt, response)
+                    logger.debug(f"    - {method} {url} returned {status}, retrying in {delay:.2f}s")
+                    response.close()
+
+                attempt += 1
+                time.sleep(delay)
+        finally:
+            self.metrics.record(
+                method, path, self.config_type, status, time.monotonic() - started,
+                bytes_sent, bytes_received, attempt,
             )
-            response.raise_for_status()  # Raise an exception for bad status codes
-            return response.json()
-        except requests.exceptions.HTTPError as e:
-            handle_api_error(e.response, url)
-        except requests.exceptions.RequestException as e:
-            raise APIError(f"Request to {url} failed: {e}")
 
     def get(self, path, **kwargs):
         """Makes a GET request."""
@@ -41,3 +230,31 @@ class InstanaAPI:
     def put(self, path, **kwargs):
         """Makes a PUT request."""
         return self._request("PUT", path, **kwargs)
+
+    def iter_pages(self, path, pagination):
+        """Yields the pages of a paginated endpoint in order.
+
+        If the first page tells how many items there are, the remaining pages
+        are fetched ahead in parallel, at most pagination['prefetch'] at a
+        time; otherwise pages are fetched one by one until a page holds fewer
+        items than the first one (see served_page_size), or none.
+        """
+        page = pagination.get('first_page', 1)
+        body = self.get(path, params=page_params(pagination, page))
+        yield body
+        last = last_page(pagination, body)
+        if last is not None:
+            pages = range(page + 1, last + 1)
+            prefetch = pagination.get('prefetch', DEFAULT_PAGE_PREFETCH)
+            yield from ordered_map(lambda number: self.get(path, params=page_params(pagination, number)), pages, prefetch)
+            return
+        page_size = served_page_size(pagination, body)
+        while page_size and len(page_items(pagination, body)) >= page_size:
+            page += 1
+            body = self.get(path, params=page_params(pagination, page))
+            yield body
+
+    def iter_items(self, path, pagination):
+        """Yields the items of a paginated endpoint without holding all pages in memory."""
+        for body in self.iter_pages(path, pagination):
+            yield from page_items(pagination, body)
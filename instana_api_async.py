@@ -0,0 +1,194 @@
+import asyncio
+import copy
+import json
+import logging
+import time
+
+import aiohttp
+
+from concurrency import async_ordered_map
+from instana_api import (
+    DEFAULT_BACKOFF_FACTOR, DEFAULT_BACKOFF_MAX, DEFAULT_MAX_RETRIES, DEFAULT_PAGE_PREFETCH, DEFAULT_TIMEOUT,
+    InstanaAPI, last_page, page_items, page_params, retry_status_codes, served_page_size,
+)
+from metrics import METRICS
+from rate_control import limiter_for
+from utils import APIError, get_api_headers, raise_api_error
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENCY = 100
+
+
+class AsyncInstanaAPI:
+    """An asyncio wrapper for the Instana API.
+
+    Offers the same get/post/put methods, retries and errors as InstanaAPI,
+    as coroutines. Instances created with for_type() share one connection
+    pool and one semaphore, which caps the requests in flight to the backend
+    at max_concurrency.
+    """
+
+    def __init__(self, backend_config, config_type=None, metrics=None):
+        self.backend_config = backend_config
+        self.config_type = config_type
+        self.metrics = metrics or METRICS
+        self.base_url = backend_config['api_url'].rstrip('/')
+        self.headers = get_api_headers(backend_config['api_token'])
+        self.verify = not backend_config.get('allow_self_signed_certs', False)
+        self.timeout = backend_config.get('timeout', DEFAULT_TIMEOUT)
+        self.max_retries = int(backend_config.get('max_retries', DEFAULT_MAX_RETRIES))
+        self.backoff_factor = float(backend_config.get('backoff_factor', DEFAULT_BACKOFF_FACTOR))
+        self.backoff_max = float(backend_config.get('backoff_max', DEFAULT_BACKOFF_MAX))
+        self.max_concurrency = int(backend_config.get('max_concurrency', DEFAULT_MAX_CONCURRENCY))
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        # Shared by every client of the same api_url, None unless enabled
+        self.limiter = limiter_for(backend_config, self.metrics)
+        self.session = None
+
+    async def __aenter__(self):
+        self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def open(self):
+        """Creates the connection pool. Must be called inside the event loop."""
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, ssl=None if self.verify else False)
+            self.session = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+
+    async def close(self):
+        """Closes all pooled connections."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def for_type(self, config_type):
+        """Returns a client for a configuration type that shares this pool.
+
+        Must be called after open().
+        """
+        client = copy.copy(self)
+        client.config_type = config_type
+        return client
+
+    # The backoff policy is the same as for the blocking client
+    _backoff = InstanaAPI._backoff
+
+    async def _send(self, method, url, data, params):
+        """Sends a single attempt of a request and returns the response and its body.
+
+        Waits for the semaphore and, if enabled, the adaptive limit first.
+        """
+        async with self.semaphore:
+            if self.limiter is None:
+                async with self.session.request(method, url, data=data, params=params) as response:
+                    return response, await response.read()
+            await self.limiter.acquire_async()
+            started = time.monotonic()
+            status, headers = 0, None
+            try:
+                async with self.session.request(method, url, data=data, params=params) as response:
+                    status, headers = response.status, response.headers
+                    return response, await response.read()
+            finally:
+                self.limiter.release()
+                self.limiter.record(time.monotonic() - started, status, headers)
+
+    async def _request(self, method, path, **kwargs):
+        """Makes a request to the Instana API, retrying transient failures.
+
+        Accepts the json and params keyword arguments of InstanaAPI, and
+        retries POST only as InstanaAPI does. Every call is recorded in the
+        metrics collector, with its duration including retries.
+        """
+        url = self.base_url + path
+        payload = kwargs.pop('json', None)
+        params = kwargs.pop('params', None)
+        data = None if payload is None else json.dumps(payload).encode('utf-8')
+        retry_statuses = retry_status_codes(method)
+        started = time.monotonic()
+        status = 0
+        bytes_sent = bytes_received = 0
+        attempt = 0
+        try:
+            while True:
+                try:
+                    response, body = await self._send(method, url, data, params)
+                except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError) as e:
+                    status = 0
+                    if method == "POST" and not isinstance(e, aiohttp.ClientConnectorError):
+                        raise APIError(f"Request to {url} failed: {e}")
+                    if attempt >= self.max_retries:
+                        raise APIError(f"Request to {url} failed after {attempt + 1} attempt(s): {e}")
+                    delay = self._backoff(attempt)
+                    logger.debug(f"    - {method} {url} failed ({e}), retrying in {delay:.2f}s")
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    status = 0
+                    raise APIError(f"Request to {url} failed: {e or type(e).__name__}")
+                else:
+                    status = response.status
+                    bytes_sent += len(data or b"")
+                    if status not in retry_statuses or attempt >= self.max_retries:
+                        bytes_received = len(body)
+                        text = body.decode(response.charset or 'utf-8', errors='replace')
+                        if status >= 400:
+                            raise_api_error(status, url, text)
+                        if not body:
+                            return None
+                        try:
+                            return json.loads(text)
+                        except ValueError as e:
+                            raise APIError(f"Invalid JSON in response from {url}: {e}")
+                    delay = self._backoff(attempt, response)
+                    logger.debug(f"    - {method} {url} returned {status}, retrying in {delay:.2f}s")
+
+                attempt += 1
+                await asyncio.sleep(delay)
+        finally:
+            self.metrics.record(
+                method, path, self.config_type, status, time.monotonic() - started,
+                bytes_sent, bytes_received, attempt,
+            )
+
+    async def get(self, path, **kwargs):
+        """Makes a GET request."""
+        return await self._request("GET", path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        """Makes a POST request."""
+        return await self._request("POST", path, **kwargs)
+
+    async def put(self, path, **kwargs):
+        """Makes a PUT request."""
+        return await self._request("PUT", path, **kwargs)
+
+    async def iter_pages(self, path, pagination):
+        """Yields the pages of a paginated endpoint in order, like InstanaAPI.iter_pages."""
+        page = pagination.get('first_page', 1)
+        body = await self.get(path, params=page_params(pagination, page))
+        yield body
+        last = last_page(pagination, body)
+        if last is not None:
+            pages = range(page + 1, last + 1)
+            prefetch = pagination.get('prefetch', DEFAULT_PAGE_PREFETCH)
+            async for body in async_ordered_map(lambda number: self.get(path, params=page_params(pagination, number)), pages, prefetch):
+                yield body
+            return
+        page_size = served_page_size(pagination, body)
+        while page_size and len(page_items(pagination, body)) >= page_size:
+            page += 1
+            body = await self.get(path, params=page_params(pagination, page))
+            yield body
+
+    async def iter_items(self, path, pagination):
+        """Yields the items of a paginated endpoint without holding all pages in memory."""
+        async for body in self.iter_pages(path, pagination):
+            for item in page_items(pagination, body):
+                yield item
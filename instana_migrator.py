@@ -1,21 +1,43 @@
 
 import argparse
-import json
+import asyncio
+import contextlib
 import logging
 import os
 import sys
+import tempfile
 import yaml
+from collections import Counter
 import urllib3
 
 from api_endpoints import API_CONFIG
+from concurrency import LogPrefixFilter, dependency_levels, ordered_map, run_tasks
+from dry_run import DryRunPlan, log_payload
+from bundle import BUNDLE_FORMAT, BundleWriter, bundle_path
+from export_files import EXPORT_FORMATS, open_export_writer, unwrap_items
+from fanout import SharedImports, combine_results, destination_configs, fanout_tasks, group_by_destination, split_task_name
+from filters import FILTERED_EXPORT_DIR, ItemFilter
+from id_map import ID_MAP_FILE, IdMap, source_id
+from imports import import_items, import_result
 from instana_api import InstanaAPI
-from utils import InstanaMigratorError, ConfigError, APIError
+from journal import ImportJournal
+from snapshots import LATEST, SNAPSHOT_STORE, SnapshotStore, SnapshotWriter
+from sync import StateIndex, comparison_hash, current_document, destination_id, fetch_current_state
+from metrics import METRICS, METRICS_FORMATS
+from manifest import ManifestBuilder, file_unchanged, load_manifest, save_manifest, unchanged_dashboards
+from verify import VERIFY_REPORT_FILE, VerifyReport, verify_state
+from utils import InstanaMigratorError, ConfigError, APIError, get_item_key
 
 # --- Configuration ---
 
 CONFIG_FILE = "config.yaml"
 EXPORT_DIR = "export"
 DRY_RUN_LOG_FILE = "dry_run_output.log"
+DRY_RUN_PLAN_FILE = "dry_run_plan.ndjson"
+DEFAULT_WORKERS = 8
+DEFAULT_PARALLEL_TYPES = 4
+JOURNAL_FILE = "import-journal.ndjson"
+ENGINES = ("sync", "async")
 
 # --- Setup ---
 
@@ -35,18 +57,23 @@ def setup_logging(log_level, log_file=None):
         root_logger.handlers.clear()
 
     # Define the formatter
-    log_format = "%(asctime)s [%(levelname)s] - %(message)s"
+    # The prefix names the configuration type a line belongs to, which keeps
+    # the output readable when several types are processed in parallel
+    log_format = "%(asctime)s [%(levelname)s] - %(prefix)s%(message)s"
     formatter = logging.Formatter(log_format)
+    prefix_filter = LogPrefixFilter()
 
     # Always add the console handler
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(formatter)
+    console_handler.addFilter(prefix_filter)
     root_logger.addHandler(console_handler)
 
     # Add the file handler if a filename is provided
     if log_file:
         file_handler = logging.FileHandler(log_file, mode='w')
         file_handler.setFormatter(formatter)
+        file_handler.addFilter(prefix_filter)
         root_logger.addHandler(file_handler)
 
 
@@ -61,266 +88,499 @@ def load_config(config_file):
         raise ConfigError(f"Error parsing YAML file: {e}")
 
 
-def clean_for_import(item, config_type):
-    """Removes backend-specific keys from an object before import."""
-    keys_to_remove = ['scope']
-
-    if config_type == 'global-custom-payloads':
-        keys_to_remove.extend(['lastUpdated', 'version'])
-    elif (config_type == 'sli' or config_type == 'custom-event-specifications'):
-        keys_to_remove.append('lastUpdated')
-    elif config_type == 'maintenance':
-        # Keep the 'id' for the PUT_ITERATE method, but remove other server-generated fields
-        keys_to_remove.extend(['lastUpdated', 'state', 'validVersion', 'occurrence', 'invalid'])
-    elif config_type == 'groups' or config_type == "custom-dashboards":
-        keys_to_remove.append('id')
-
-    for key in keys_to_remove:
-        if key in item:
-            del item[key]
-            logger.info(f"      - Removed {key}")
-    
-    # Special handling for mobile-app-config rbacTags
-    if config_type == 'mobile-app-config':
-        # The API expects rbacTags to be an array. If the export provides an
-        # empty object {} or a non-array value, it causes a deserialization error.
-        # Setting it to an empty array ensures the correct type is sent.
-        if 'rbacTags' in item:
-            logger.info("      - Ensuring rbacTags is an empty array for mobile-app-config.")
-            item['rbacTags'] = []
-
-    if config_type == 'custom-dashboards':
-        logger.info(" - Cleaning custom dashboard-specific fields...")
-
-        # Elimina ownerId
-        if 'ownerId' in item:
-            del item['ownerId']
-            logger.info(" - Removed ownerId")
-
-        # Normaliza accessRules
-        rules = item.get('accessRules', [])
-        if not isinstance(rules, list):
-            rules = []
-
-        # 1) Elimina reglas USER y cualquier otra no-GLOBAL (opcional)
-        rules = [r for r in rules if r.get('relationType') == 'GLOBAL']
-
-        # 2) Limpia relatedId en reglas GLOBAL (no es necesario/aceptado)
-        for r in rules:
-            if 'relatedId' in r:
-                r.pop('relatedId', None)
-
-        # 3) Asegura GLOBAL READ
-        has_global_read = any(r.get('relationType') == 'GLOBAL' and r.get('accessType') == 'READ' for r in rules)
-        if not has_global_read:
-            rules.append({'accessType': 'READ', 'relationType': 'GLOBAL'})
-            logger.debug(" - Added default GLOBAL READ access rule.")
-
-        # 4) Si el backend exige escritura, asegura al menos una READ_WRITE
-        has_write = any(r.get('accessType') == 'READ_WRITE' for r in rules)
-        if not has_write:
-            rules.append({'accessType': 'READ_WRITE', 'relationType': 'GLOBAL'})
-            logger.debug(" - Added default GLOBAL READ_WRITE access rule.")
-
-        item['accessRules'] = rules
-
-
-    if config_type == 'manual-services':
-        tfe = item.get('tagFilterExpression')
-        is_invalid = False
-        if tfe is not None:
-            if not isinstance(tfe, dict) or tfe.get('operator') is None:
-                is_invalid = True
-        
-        if is_invalid:
-            logger.debug("    - Cleaning manual-service-specific fields...")
-            if 'tagFilterExpression' in item:
-                del item['tagFilterExpression']
-                logger.debug("      - Removed invalid tagFilterExpression.")
-
-    return item
+def positive_int(value):
+    """Argparse type for options that must be a positive integer."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' is not an integer")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"'{value}' must be at least 1")
+    return number
+
+
+def parse_types(type_arg):
+    """Returns the list of configuration types selected by --type.
+
+    Accepts 'all' or a comma-separated list of configuration types.
+    """
+    if type_arg == 'all':
+        return list(API_CONFIG.keys())
+
+    types = [config_type.strip() for config_type in type_arg.split(',') if config_type.strip()]
+    unknown = [config_type for config_type in types if config_type not in API_CONFIG]
+    if unknown or not types:
+        raise ConfigError(f"Unknown configuration type(s) '{', '.join(unknown) or type_arg}'")
+    return list(dict.fromkeys(types))
+
+
+def log_summary(command, outcomes, destination=None):
+    """Logs a per-type summary of the results returned by run_tasks."""
+    details = {
+        'import': ('created', 'updated', 'unchanged', 'resumed'),
+        'verify': ('missing', 'drifted', 'extra'),
+    }.get(command, ())
+    logger.info(f"{command.capitalize()} summary{f' for {destination}' if destination else ''}:")
+    header = f"  {'Type':<34} {'Status':<8} {'Success':>8} {'Failed':>8}"
+    header += "".join(f" {detail.capitalize():>9}" for detail in details)
+    logger.info(f"{header} {'Duration':>10}")
+    for config_type, outcome in outcomes.items():
+        result = outcome['result'] or {}
+        if outcome['skipped']:
+            status = "SKIPPED"
+        else:
+            status = "ERROR" if outcome['error'] else "OK"
+        line = f"  {config_type:<34} {status:<8} {result.get('success', '-'):>8} {result.get('failed', '-'):>8}"
+        line += "".join(f" {result.get(detail, '-'):>9}" for detail in details)
+        logger.info(f"{line} {outcome['duration']:>9.2f}s")
+
+
+def show_snapshots(args):
+    """Lists the snapshots of the store, or logs the differences between two of them."""
+    store = SnapshotStore(args.snapshot_store)
+    if args.snapshots_command == "list":
+        snapshot_ids = store.snapshot_ids()
+        logger.info(f"{len(snapshot_ids)} snapshot(s) in {store.path}:")
+        for snapshot_id in snapshot_ids:
+            snapshot = store.load(snapshot_id)
+            items = sum(entry['count'] for entry in snapshot['types'].values())
+            logger.info(f"  {snapshot_id:<20} {len(snapshot['types']):>3} type(s) {items:>8} item(s)  {snapshot.get('source', '')}")
+        return
+
+    old, new = store.load(args.old), store.load(args.new)
+    differences = store.diff(old, new)
+    logger.info(f"Differences between snapshots {old['id']} and {new['id']}:")
+    if not differences:
+        logger.info("  None.")
+    for config_type, changes in differences.items():
+        logger.info(f"  {config_type}: {len(changes['added'])} added, {len(changes['removed'])} removed, {len(changes['changed'])} changed")
+        for marker, change in (('+', 'added'), ('-', 'removed'), ('~', 'changed')):
+            for key in changes[change]:
+                logger.info(f"    {marker} {key}")
+
+
+def restore_snapshot(args, config_types):
+    """Returns the directory to read the export from, and the temporary directory to clean up.
+
+    A snapshot given with --snapshot is restored by writing it out as export
+    files to a temporary directory first; otherwise the export directory is
+    used and there is nothing to clean up.
+    """
+    if not args.snapshot:
+        return args.export_dir, None
+    store = SnapshotStore(args.snapshot_store)
+    snapshot = store.load(args.snapshot)
+    restore_dir = tempfile.TemporaryDirectory(prefix="instana-snapshot-")
+    store.restore(snapshot, config_types, restore_dir.name)
+    logger.info(f"Restoring snapshot {snapshot['id']} from {store.path}")
+    return restore_dir.name, restore_dir
 
 
 # --- Core Functions ---
 
-def export_config(config_type, backend_config, export_dir):
-    """Exports a specific configuration type from a backend."""
+def export_config(config_type, backend_config, export_dir, workers=DEFAULT_WORKERS, export_format="json", incremental=False, bundle=None, snapshot=None, item_filter=None):
+    """Exports a specific configuration type from a backend.
+
+    A manifest of the exported items is saved next to the export. With
+    incremental, details are only fetched for new or changed items and the
+    export file is only rewritten if something changed. The items are
+    written to bundle, a BundleWriter, with the bundle format, and also
+    recorded in snapshot, a SnapshotWriter, if given. With item_filter, an
+    ItemFilter, only the items it selects are exported; dashboards are
+    selected by their list entry, before their details are fetched.
+
+    Returns a dict with the number of items that succeeded and failed.
+    """
     if config_type not in API_CONFIG:
         raise ConfigError(f"Unknown configuration type '{config_type}'")
 
-    api = InstanaAPI(backend_config)
-    cfg = API_CONFIG[config_type]
+    with InstanaAPI(backend_config, config_type) as api:
+        cfg = API_CONFIG[config_type]
     
-    logger.info(f"Exporting '{config_type}' from {api.base_url}...")
-
-    data_to_save = []
-
-    if config_type == 'custom-dashboards':
-        logger.debug(f"  - Fetching dashboard list from {cfg['export_path']}")
-        dashboard_summaries = api.get(cfg['export_path'])
-        logger.info(f"  - Found {len(dashboard_summaries)} dashboards to export.")
-
-        for summary in dashboard_summaries:
-            dashboard_id = summary.get('id')
-            if not dashboard_id:
-                continue
-            
-            detail_path = f"{cfg['export_path']}/{dashboard_id}"
-            logger.debug(f"    - Fetching full details for dashboard ID: {dashboard_id}")
-            try:
-                data_to_save.append(api.get(detail_path))
-            except APIError as e:
-                logger.warning(f"    - Could not fetch details for dashboard ID {dashboard_id}. Error: {e}")
-
-    else:
-        data_to_save = api.get(cfg['export_path'])
+        logger.info(f"Exporting '{config_type}' from {api.base_url}...")
+
+        os.makedirs(export_dir, exist_ok=True)
+        manifest = load_manifest(export_dir, config_type) if incremental else None
+        builder = ManifestBuilder(config_type, export_format)
+        failed_count = 0
+
+        if config_type == 'custom-dashboards':
+            logger.debug(f"  - Fetching dashboard list from {cfg['export_path']}")
+            dashboard_summaries = api.get(cfg['export_path'])
+            logger.info(f"  - Found {len(dashboard_summaries)} dashboards to export.")
+            summaries = [summary for summary in dashboard_summaries if summary.get('id')]
+            if item_filter:
+                summaries = list(item_filter.select(summaries, config_type))
+                logger.info(f"  - {len(summaries)} dashboard(s) match the filters.")
+
+            previous = unchanged_dashboards(export_dir, manifest, summaries) if manifest else {}
+
+            def fetch_dashboard(summary):
+                dashboard_id = summary['id']
+                if dashboard_id in previous:
+                    return previous[dashboard_id]
+                detail_path = f"{cfg['export_path']}/{dashboard_id}"
+                logger.debug(f"    - Fetching full details for dashboard ID: {dashboard_id}")
+                try:
+                    return api.get(detail_path)
+                except APIError as e:
+                    logger.warning(f"    - Could not fetch details for dashboard ID {dashboard_id}. Error: {e}")
+                    return None
+
+            # Details are fetched in parallel, but ordered_map keeps the summary order.
+            # Each dashboard is handed to the writer as soon as it is its turn.
+            with open_export_writer(export_dir, config_type, export_format, bundle, snapshot) as writer:
+                for summary, dashboard in zip(summaries, ordered_map(fetch_dashboard, summaries, workers)):
+                    if dashboard is not None:
+                        writer.write(dashboard)
+                        builder.add(summary['id'], dashboard, summary)
+                    else:
+                        failed_count += 1
+                new_manifest = builder.build()
+                if incremental and file_unchanged(manifest, new_manifest, writer.file_path):
+                    writer.discard()
+
+        elif cfg.get('pagination'):
+            # Items are written page by page, so large endpoints are exported
+            # completely without holding every page in memory
+            with open_export_writer(export_dir, config_type, export_format, bundle, snapshot) as writer:
+                for item in api.iter_items(cfg['export_path'], cfg['pagination']):
+                    if item_filter and not item_filter.matches(item, config_type):
+                        continue
+                    writer.write(item)
+                    builder.add(get_item_key(item, cfg.get('id_key')), item)
+                new_manifest = builder.build()
+                if incremental and file_unchanged(manifest, new_manifest, writer.file_path):
+                    writer.discard()
 
-    if not os.path.exists(export_dir):
-        os.makedirs(export_dir)
+        else:
+            data = api.get(cfg['export_path'])
+            if item_filter:
+                data = item_filter.select_data(data, config_type)
+            with open_export_writer(export_dir, config_type, export_format, bundle, snapshot) as writer:
+                if cfg['import_method'] == 'PUT':
+                    # Imported as a whole, so kept in the shape the backend returned it
+                    if data is not None:
+                        writer.write_document(data)
+                else:
+                    writer.write_data(data)
+                for item in unwrap_items(data if isinstance(data, list) else [data]):
+                    builder.add(get_item_key(item, cfg.get('id_key')), item)
+                new_manifest = builder.build()
+                if incremental and file_unchanged(manifest, new_manifest, writer.file_path):
+                    writer.discard()
+
+        save_manifest(export_dir, new_manifest)
+        count = writer.count
+        if writer.discarded:
+            logger.info(f"No changes since the last export, kept {count} item(s) in {writer.file_path}")
+        else:
+            logger.info(f"Successfully exported {count} item(s) to {writer.file_path}")
+        return {'success': count, 'failed': failed_count}
+
+
+def import_config(config_type, backend_config, export_dir, dry_run=False, workers=DEFAULT_WORKERS, sync=False, journal=None, plan=None, item_filter=None, prepared=None, id_map=None):
+    """Imports a specific configuration type to a backend.
+
+    With sync, the current state of the destination is fetched first and only
+    items that are missing or changed are sent. If a journal is given, the
+    outcome of every item is recorded in it, and items it lists as already
+    imported are skipped. In a dry run, the requests that would be made are
+    recorded in plan, if given. With item_filter, an ItemFilter, only the
+    items it selects are imported; it does not apply to types imported with
+    PUT. prepared optionally holds the items as returned by import_items, so
+    that an export imported into several destinations is only read and
+    cleaned once. With an id_map, the IDs items reference are replaced by
+    their destination IDs, and the destination IDs of created and matched
+    items are recorded.
+
+    Returns a dict with the number of items that succeeded and failed, and how
+    many of them were created, updated or left unchanged.
+    """
+    if config_type not in API_CONFIG:
+        raise ConfigError(f"Unknown configuration type '{config_type}'")
 
-    file_path = os.path.join(export_dir, f"{config_type}.json")
-    with open(file_path, 'w') as f:
-        json.dump(data_to_save, f, indent=2)
+    items = prepared if prepared is not None else import_items(export_dir, config_type, item_filter)
 
-    count = 0
-    if isinstance(data_to_save, list):
-        count = len(data_to_save)
-    elif isinstance(data_to_save, dict):
-        # Handle case where services are nested under 'items'
-        count = len(data_to_save.get('items', [1]))
+    with InstanaAPI(backend_config, config_type) as api:
+        cfg = API_CONFIG[config_type]
+        id_key = cfg.get('id_key')
 
-    logger.info(f"Successfully exported {count} item(s) to {file_path}")
+        logger.info(f"Importing '{config_type}' to {api.base_url}...")
+        if dry_run:
+            logger.info("DRY RUN: No actual changes will be made.")
 
+        state = None
+        if sync:
+            logger.info("Fetching the current state of the destination...")
+            state = StateIndex(fetch_current_state(api, config_type, workers), config_type)
+            logger.info(f"  - Found {len(state.items)} existing item(s).")
 
-def import_config(config_type, backend_config, export_dir, dry_run=False):
-    """Imports a specific configuration type to a backend."""
-    if config_type not in API_CONFIG:
-        raise ConfigError(f"Unknown configuration type '{config_type}'")
+        if cfg['import_method'] == 'PUT':
+            logger.info("Using PUT method to replace entire configuration...")
+            ((data, payload, payload_hash),) = items
 
-    file_path = os.path.join(export_dir, f"{config_type}.json")
-    if not os.path.exists(file_path):
-        raise InstanaMigratorError(f"Export file not found at '{file_path}'. Please run the export first.")
+            if journal and journal.is_done(api.base_url, config_type, config_type, payload_hash):
+                logger.info(f"Configuration for '{config_type}' was already imported, skipping.")
+                return import_result(Counter(['resumed']))
 
-    with open(file_path, 'r') as f:
-        data = json.load(f)
-    
-    if config_type == 'services' and isinstance(data, dict) and 'items' in data:
-        data = data['items']
-
-    api = InstanaAPI(backend_config)
-    cfg = API_CONFIG[config_type]
-    id_key = cfg.get('id_key')
-
-    logger.info(f"Importing '{config_type}' to {api.base_url}...")
-    if dry_run:
-        logger.info("DRY RUN: No actual changes will be made.")
-
-    if cfg['import_method'] == 'PUT':
-        logger.info("Using PUT method to replace entire configuration...")
-        payload = clean_for_import(data.copy(), config_type)
-        
-        if not dry_run:
-            api.put(cfg['import_path'], json=payload)
-        else:
-            logger.info(f"  - (Dry Run) Would replace configuration for '{config_type}'")
-            logger.info(f"    Payload: {json.dumps(payload, indent=2)}")
+            if state is not None and comparison_hash(current_document(state.items, data), config_type) == comparison_hash(data, config_type):
+                logger.info(f"Configuration for '{config_type}' is unchanged, nothing to import.")
+                if journal and not dry_run:
+                    journal.record(api.base_url, config_type, config_type, payload_hash, 'unchanged')
+                return import_result(Counter(['unchanged']))
 
-        logger.info(f"Successfully imported '{config_type}'.")
-    
-    elif cfg['import_method'] == 'POST':
-        if not isinstance(data, list):
-            data = [data]
-        
-        success_count = 0
-        for item in data:
-            item_id = 'N/A'
-            """ Search for the id_key, if not found then we need to use (if available): """
-            """ name or title """
-            if id_key and item.get(id_key):
-                item_id = item.get(id_key)
-            elif 'name' in item:
-                item_id = item.get('name')
-            elif 'title' in item:
-                item_id = item.get('title')
-
-            payload = clean_for_import(item.copy(), config_type)
-            
-            logger.info(f"  - Preparing to import item: {item_id}")
             if not dry_run:
                 try:
-                    api.post(cfg['import_path'], json=payload)
-                    success_count += 1
-                    logger.info(f"  - Successfully imported item: {item_id}")
-                except APIError as e:
-                    logger.error(f"  - Failed to import item: {item_id}")
-                    logger.error(f"    Error: {e}")
+                    api.put(cfg['import_path'], json=payload)
+                except APIError:
+                    if journal:
+                        journal.record(api.base_url, config_type, config_type, payload_hash, 'failed')
+                    raise
+                if journal:
+                    journal.record(api.base_url, config_type, config_type, payload_hash, 'updated')
             else:
-                success_count +=1
-                logger.info(f"  - (Dry Run) Would import item: {item_id}")
-                logger.info(f"    Payload: {json.dumps(payload, indent=2)}")
-
-        logger.info(f"Import complete. Successfully imported {success_count}/{len(data)} items.")
+                logger.info(f"  - (Dry Run) Would replace configuration for '{config_type}'")
+                log_payload(payload)
+                if plan:
+                    plan.record(config_type, 'PUT', api.base_url + cfg['import_path'], config_type, payload_hash)
 
-
-    elif cfg['import_method'] == 'PUT_ITERATE':
-        if not isinstance(data, list):
-            data = [data]
-
-        logger.info(f"Using PUT_ITERATE method to update items individually...")
-        success_count = 0
-        for item in data:
-            # Use the primary id_key to get the ID for the URL
-            item_id_for_url = item.get(id_key)
-            if not item_id_for_url:
-                logger.warning(f"  - Skipping item due to missing ID (using id_key: '{id_key}'). Item data: {item}")
-                continue
-            
-            # Use 'name' for logging if available, otherwise fall back to the ID
-            item_name_for_log = item.get('name', item_id_for_url)
+            logger.info(f"Successfully imported '{config_type}'.")
+            return import_result(Counter(['updated']))
+    
+        elif cfg['import_method'] == 'POST':
+            def import_item(entry):
+                """ Search for the id_key, if not found then we need to use (if available): """
+                """ name or title """
+                item, payload, payload_hash = entry
+                item_id = get_item_key(item, id_key) or 'N/A'
+                if id_map is not None:
+                    # The item is rewritten as well, so that --sync compares what is sent
+                    item, payload = id_map.rewrite(item, config_type, api.base_url), id_map.rewrite(payload, config_type, api.base_url)
+
+                def record(result, response=None, dest_id=None):
+                    if isinstance(response, dict) and response.get('id'):
+                        dest_id = response['id']
+                    if journal and not dry_run:
+                        journal.record(api.base_url, config_type, item_id, payload_hash, result, dest_id)
+                    if id_map is not None and not dry_run:
+                        id_map.record(api.base_url, config_type, source_id(item, config_type), dest_id)
+                    return result
+
+                if journal and journal.is_done(api.base_url, config_type, item_id, payload_hash):
+                    logger.info(f"  - Item was already imported, skipping: {item_id}")
+                    return 'resumed'
+
+                mapped_id = id_map.mapped_id(api.base_url, config_type, item) if id_map is not None else None
+                status, match = state.compare(item, mapped_id) if state is not None else ('missing', None)
+                if status == 'unchanged':
+                    logger.info(f"  - Item is unchanged, skipping: {item_id}")
+                    return record('unchanged', dest_id=destination_id(match, config_type))
+
+                if status == 'changed':
+                    # Existing items are replaced in place, using the destination ID
+                    dest_id = destination_id(match, config_type)
+                    if not dest_id:
+                        logger.warning(f"  - Skipping changed item without a destination ID: {item_id}")
+                        return record('failed')
+                    # The payload may be shared with other destinations, so it is copied
+                    payload = dict(payload, id=dest_id)
+                    import_url = f"{cfg['import_path']}/{dest_id}"
+                    logger.info(f"  - Preparing to update item: {item_id} (ID: {dest_id})")
+                    if not dry_run:
+                        try:
+                            response = api.put(import_url, json=payload)
+                            logger.info(f"  - Successfully updated item: {item_id}")
+                            return record('updated', response, dest_id)
+                        except APIError as e:
+                            logger.error(f"  - Failed to update item: {item_id}")
+                            logger.error(f"    Error: {e}")
+                            return record('failed')
+                    else:
+                        logger.info(f"  - (Dry Run) Would update item: {item_id}")
+                        logger.info(f"    URL: PUT {import_url}")
+                        log_payload(payload)
+                        if plan:
+                            plan.record(config_type, 'PUT', api.base_url + import_url, item_id, payload_hash)
+                        return 'updated'
+
+                logger.info(f"  - Preparing to import item: {item_id}")
+                if not dry_run:
+                    try:
+                        response = api.post(cfg['import_path'], json=payload)
+                        logger.info(f"  - Successfully imported item: {item_id}")
+                        return record('created', response)
+                    except APIError as e:
+                        logger.error(f"  - Failed to import item: {item_id}")
+                        logger.error(f"    Error: {e}")
+                        return record('failed')
+                else:
+                    logger.info(f"  - (Dry Run) Would import item: {item_id}")
+                    log_payload(payload)
+                    if plan:
+                        plan.record(config_type, 'POST', api.base_url + cfg['import_path'], item_id, payload_hash)
+                    return 'created'
+
+            counts = Counter(ordered_map(import_item, items, workers))
+            result = import_result(counts)
+            logger.info(f"Import complete. Successfully imported {result['success']}/{sum(counts.values())} items.")
+            if sync:
+                logger.info(f"  - Created: {counts['created']}, updated: {counts['updated']}, unchanged: {counts['unchanged']}")
+            if counts['resumed']:
+                logger.info(f"  - Skipped {counts['resumed']} item(s) already imported by a previous run.")
+            return result
+
+
+        elif cfg['import_method'] == 'PUT_ITERATE':
+            logger.info(f"Using PUT_ITERATE method to update items individually...")
+            def update_item(entry):
+                item, payload, payload_hash = entry
+                # Use the primary id_key to get the ID for the URL
+                item_id_for_url = item.get(id_key)
+                if not item_id_for_url:
+                    logger.warning(f"  - Skipping item due to missing ID (using id_key: '{id_key}'). Item data: {item}")
+                    return 'failed'
             
-            # The 'id' key must be in the payload for the PUT request to be valid
-            payload = clean_for_import(item.copy(), config_type)
-            import_url = f"{cfg['import_path']}/{item_id_for_url}"
-
-            logger.info(f"  - Preparing to update item: {item_name_for_log} (ID: {item_id_for_url})")
-            if not dry_run:
-                try:
+                # Use 'name' for logging if available, otherwise fall back to the ID
+                item_name_for_log = item.get('name', item_id_for_url)
+                if id_map is not None:
+                    item, payload = id_map.rewrite(item, config_type, api.base_url), id_map.rewrite(payload, config_type, api.base_url)
+
+                def record(result, response=None):
+                    if journal and not dry_run:
+                        dest_id = response.get('id') if isinstance(response, dict) else None
+                        journal.record(api.base_url, config_type, item_id_for_url, payload_hash, result, dest_id)
+                    return result
+
+                if journal and journal.is_done(api.base_url, config_type, item_id_for_url, payload_hash):
+                    logger.info(f"  - Item was already imported, skipping: {item_name_for_log}")
+                    return 'resumed'
+
+                mapped_id = id_map.mapped_id(api.base_url, config_type, item) if id_map is not None else None
+                status, _ = state.compare(item, mapped_id) if state is not None else ('changed', None)
+                if status == 'unchanged':
+                    logger.info(f"  - Item is unchanged, skipping: {item_name_for_log}")
+                    return record('unchanged')
+                outcome = 'created' if status == 'missing' else 'updated'
+
+                import_url = f"{cfg['import_path']}/{item_id_for_url}"
+
+                logger.info(f"  - Preparing to update item: {item_name_for_log} (ID: {item_id_for_url})")
+                if not dry_run:
+                    try:
+                        # The payload sent to the API for an update must contain the ID
+                        response = api.put(import_url, json=dict(payload, id=item_id_for_url))
+                        logger.info(f"  - Successfully updated item: {item_name_for_log}")
+                        return record(outcome, response)
+                    except APIError as e:
+                        logger.error(f"  - Failed to update item: {item_name_for_log}")
+                        logger.error(f"    Error: {e}")
+                        return record('failed')
+                else:
                     # The payload sent to the API for an update must contain the ID
-                    payload['id'] = item_id_for_url
-                    api.put(import_url, json=payload)
-                    success_count += 1
-                    logger.info(f"  - Successfully updated item: {item_name_for_log}")
-                except APIError as e:
-                    logger.error(f"  - Failed to update item: {item_name_for_log}")
-                    logger.error(f"    Error: {e}")
-            else:
-                success_count += 1
-                # The payload sent to the API for an update must contain the ID
-                payload['id'] = item_id_for_url
-                logger.info(f"  - (Dry Run) Would update item: {item_name_for_log}")
-                logger.info(f"    URL: PUT {import_url}")
-                logger.info(f"    Payload: {json.dumps(payload, indent=2)}")
+                    payload = dict(payload, id=item_id_for_url)
+                    logger.info(f"  - (Dry Run) Would update item: {item_name_for_log}")
+                    logger.info(f"    URL: PUT {import_url}")
+                    log_payload(payload)
+                    if plan:
+                        plan.record(config_type, 'PUT', api.base_url + import_url, item_id_for_url, payload_hash)
+                    return outcome
+
+            counts = Counter(ordered_map(update_item, items, workers))
+            result = import_result(counts)
+            logger.info(f"Import complete. Successfully processed {result['success']}/{sum(counts.values())} items.")
+            if sync:
+                logger.info(f"  - Created: {counts['created']}, updated: {counts['updated']}, unchanged: {counts['unchanged']}")
+            if counts['resumed']:
+                logger.info(f"  - Skipped {counts['resumed']} item(s) already imported by a previous run.")
+            return result
+
+def verify_config(config_type, backend_config, export_dir, workers=DEFAULT_WORKERS, item_filter=None, prepared=None, id_map=None, report=None):
+    """Checks that a backend holds the exported items of a specific configuration type.
+
+    The current state of the backend is fetched and compared with the export
+    by verify.verify_state; item_filter, prepared and id_map are used as by
+    import_config. The items that are not in sync are recorded in report, if
+    given.
+
+    Returns the counts of verify_state.
+    """
+    if config_type not in API_CONFIG:
+        raise ConfigError(f"Unknown configuration type '{config_type}'")
 
-        logger.info(f"Import complete. Successfully processed {success_count}/{len(data)} items.")
+    entries = prepared if prepared is not None else import_items(export_dir, config_type, item_filter)
+    with InstanaAPI(backend_config, config_type) as api:
+        logger.info(f"Verifying '{config_type}' on {api.base_url}...")
+        current = fetch_current_state(api, config_type, workers)
+        logger.info(f"  - Found {len(current)} item(s) on the destination.")
+        result = verify_state(config_type, entries, current, api.base_url, id_map, report, item_filter)
+        if report:
+            report.record_totals(api.base_url, config_type, result)
+        return result
 
 # --- Main Execution ---
 
+def add_filter_arguments(parser, command):
+    """Adds the options selecting the items to export, import or verify."""
+    parser.add_argument("--id", dest="ids", action="append", help=f"Only {command} the item with this ID (or name, for types without IDs). Can be given several times.")
+    parser.add_argument("--match", help=f"Only {command} the items whose name or title matches this regular expression.")
+    parser.add_argument("--owner", dest="owners", action="append", help=f"Only {command} the items owned by this user ID. Can be given several times.")
+    parser.add_argument("--tag", dest="tags", action="append", help=f"Only {command} the items with this tag. Can be given several times.")
+
+
 def main():
     """Main execution function."""
     parser = argparse.ArgumentParser(description="Instana Configuration Migrator")
     parser.add_argument("--config", default=CONFIG_FILE, help=f"Path to the configuration file (default: {CONFIG_FILE})")
     parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], help="Set the logging level (default: INFO)")
+    parser.add_argument("--metrics-file", help="Write the request metrics of the run to this file.")
+    parser.add_argument("--metrics-format", default="json", choices=METRICS_FORMATS, help="Format of --metrics-file: json, or a Prometheus textfile (default: json)")
+    parser.add_argument("--engine", default="sync", choices=ENGINES, help="Migration engine: sync uses a thread pool per type, async keeps up to the backend's max_concurrency requests in flight on one event loop (default: sync)")
+    parser.add_argument("--parallel-types", type=positive_int, default=DEFAULT_PARALLEL_TYPES, help=f"Maximum number of configuration types processed at the same time (default: {DEFAULT_PARALLEL_TYPES})")
+    parser.add_argument("--snapshot-store", default=SNAPSHOT_STORE, help=f"Directory of the snapshot store (default: {SNAPSHOT_STORE})")
 
     subparsers = parser.add_subparsers(dest="command", required=True)
 
     parser_export = subparsers.add_parser("export", help="Export configuration from the source backend.")
-    parser_export.add_argument("--type", required=True, help=f"The type of configuration to export. One of: {', '.join(list(API_CONFIG.keys()) + ['all'])}")
+    parser_export.add_argument("--type", required=True, help=f"The type of configuration to export, or a comma-separated list of types. One of: {', '.join(list(API_CONFIG.keys()) + ['all'])}")
     parser_export.add_argument("--export-dir", default=EXPORT_DIR, help=f"Directory to store exported files (default: {EXPORT_DIR})")
+    parser_export.add_argument("--format", dest="export_format", default="json", choices=EXPORT_FORMATS + (BUNDLE_FORMAT,), help="Format of the export files: pretty-printed json, ndjson with one item per line written as it arrives, or a single compressed bundle of all types (default: json)")
+    parser_export.add_argument("--incremental", action="store_true", help="Only fetch details for items that are new or changed since the last export, and only rewrite changed files.")
+    parser_export.add_argument("--full", action="store_true", help="Ignore the manifests of the previous export and fetch every item again, even with --incremental. The new manifests are saved as usual.")
+    parser_export.add_argument("--workers", type=positive_int, default=DEFAULT_WORKERS, help=f"Number of parallel requests used to fetch item details (default: {DEFAULT_WORKERS})")
+    parser_export.add_argument("--snapshot", action="store_true", help="Also record the export as a snapshot in the snapshot store.")
+    add_filter_arguments(parser_export, "export")
 
     parser_import = subparsers.add_parser("import", help="Import configuration to the destination backend.")
-    parser_import.add_argument("--type", required=True, help=f"The type of configuration to import. One of: {', '.join(list(API_CONFIG.keys()) + ['all'])}")
+    parser_import.add_argument("--type", required=True, help=f"The type of configuration to import, or a comma-separated list of types. One of: {', '.join(list(API_CONFIG.keys()) + ['all'])}")
     parser_import.add_argument("--export-dir", default=EXPORT_DIR, help=f"Directory to read exported files from (default: {EXPORT_DIR})")
     parser_import.add_argument("--dry-run", action="store_true", help="Simulate an import without making any changes.")
+    parser_import.add_argument("--plan-file", default=DRY_RUN_PLAN_FILE, help=f"With --dry-run, file to write the plan of the requests that would be made to (default: {DRY_RUN_PLAN_FILE})")
+    parser_import.add_argument("--sync", action="store_true", help="Compare with the current state of the destination and only create missing items and update changed ones.")
+    parser_import.add_argument("--journal", help=f"Journal file recording the outcome of every imported item (default: <export-dir>/{JOURNAL_FILE})")
+    parser_import.add_argument("--id-map", help=f"File mapping the IDs of imported items on the source to their IDs on the destination, used to rewrite references (default: <export-dir>/{ID_MAP_FILE})")
+    parser_import.add_argument("--resume", action="store_true", help="Skip the items the journal lists as already imported, instead of starting a new journal.")
+    parser_import.add_argument("--workers", type=positive_int, default=DEFAULT_WORKERS, help=f"Number of items imported in parallel for each type (default: {DEFAULT_WORKERS})")
+    parser_import.add_argument("--destination", dest="destinations", action="append", help="Only import into the destination with this name, when config.yaml lists several 'destinations'. Can be given several times.")
+    parser_import.add_argument("--snapshot", help=f"Restore this snapshot of the snapshot store ('{LATEST}' for the most recent one) instead of the export directory.")
+    add_filter_arguments(parser_import, "import")
+
+    parser_verify = subparsers.add_parser("verify", help="Check that the destination holds the exported configuration.")
+    parser_verify.add_argument("--type", required=True, help=f"The type of configuration to verify, or a comma-separated list of types. One of: {', '.join(list(API_CONFIG.keys()) + ['all'])}")
+    parser_verify.add_argument("--export-dir", default=EXPORT_DIR, help=f"Directory to read exported files from (default: {EXPORT_DIR})")
+    parser_verify.add_argument("--report", help=f"File to write the missing, drifted and extra items to (default: <export-dir>/{VERIFY_REPORT_FILE})")
+    parser_verify.add_argument("--id-map", help=f"ID map written by the import, used to match items and references by their destination IDs (default: <export-dir>/{ID_MAP_FILE})")
+    parser_verify.add_argument("--workers", type=positive_int, default=DEFAULT_WORKERS, help=f"Number of parallel requests used to fetch dashboard details (default: {DEFAULT_WORKERS})")
+    parser_verify.add_argument("--destination", dest="destinations", action="append", help="Only verify the destination with this name, when config.yaml lists several 'destinations'. Can be given several times.")
+    parser_verify.add_argument("--snapshot", help=f"Verify against this snapshot of the snapshot store ('{LATEST}' for the most recent one) instead of the export directory.")
+    add_filter_arguments(parser_verify, "verify")
+
+    parser_snapshots = subparsers.add_parser("snapshots", help="List or compare the snapshots of the snapshot store.")
+    snapshot_subparsers = parser_snapshots.add_subparsers(dest="snapshots_command", required=True)
+    snapshot_subparsers.add_parser("list", help="List the snapshots, oldest first.")
+    parser_diff = snapshot_subparsers.add_parser("diff", help="Show the items added, removed and changed between two snapshots.")
+    parser_diff.add_argument("old", help="ID of the older snapshot")
+    parser_diff.add_argument("new", nargs="?", default=LATEST, help=f"ID of the newer snapshot (default: {LATEST})")
 
     args = parser.parse_args()
     
@@ -332,22 +592,209 @@ def main():
     setup_logging(args.log_level.upper(), log_file=log_file)
 
     try:
+        if args.command == "snapshots":
+            show_snapshots(args)
+            return
+
         config = load_config(args.config)
-        types_to_process = list(API_CONFIG.keys()) if args.type == 'all' else [args.type]
+        types_to_process = parse_types(args.type)
+        item_filter = ItemFilter.from_args(args) if args.command in ("export", "import", "verify") else None
+        fanout = False
 
         if args.command == "export":
             backend_config = config.get('source')
             if not backend_config:
                 raise ConfigError("'source' configuration not found in config.yaml")
-            for config_type in types_to_process:
-                export_config(config_type, backend_config, args.export_dir)
+            # A filtered export is kept apart, so it never replaces the full
+            # export of a type or the manifest later incremental runs compare with
+            export_dir = args.export_dir
+            incremental = args.incremental and not args.full
+            if args.incremental and args.full:
+                logger.info("--full given, the manifests of the previous export are ignored")
+            if item_filter:
+                if args.snapshot:
+                    raise ConfigError("--snapshot cannot be combined with --id, --match, --owner or --tag: snapshots record complete exports")
+                export_dir = os.path.join(args.export_dir, FILTERED_EXPORT_DIR)
+                logger.info(f"Filters given, the selected items are exported to {export_dir}")
+            # All types are written to one bundle, which replaces the previous
+            # one once every type is done
+            bundle = snapshot = None
+            if args.export_format == BUNDLE_FORMAT:
+                bundle = BundleWriter(bundle_path(export_dir), {'source': backend_config.get('api_url')})
+            if args.snapshot:
+                snapshot = SnapshotWriter(SnapshotStore(args.snapshot_store), {'source': backend_config.get('api_url')})
+            with bundle or contextlib.nullcontext(), snapshot or contextlib.nullcontext():
+                if args.engine == "async":
+                    from async_migrator import export_config_async, run_types_async
+                    outcomes = asyncio.run(run_types_async(
+                        backend_config,
+                        types_to_process,
+                        lambda config_type, client: export_config_async(config_type, client, export_dir, args.export_format, incremental, bundle, snapshot, item_filter),
+                        args.parallel_types,
+                    ))
+                else:
+                    outcomes = run_tasks(
+                        types_to_process,
+                        lambda config_type: export_config(config_type, backend_config, export_dir, args.workers, args.export_format, incremental, bundle, snapshot, item_filter),
+                        args.parallel_types,
+                    )
 
         elif args.command == "import":
-            backend_config = config.get('destination')
-            if not backend_config:
-                raise ConfigError("'destination' configuration not found in config.yaml")
-            for config_type in types_to_process:
-                import_config(config_type, backend_config, args.export_dir, args.dry_run)
+            destinations = destination_configs(config, args.destinations)
+            backend_config = destinations[0][1]
+            # Types are started as soon as the types they reference have been imported
+            dependencies = {config_type: API_CONFIG[config_type].get('depends_on', []) for config_type in types_to_process}
+            levels = dependency_levels(types_to_process, dependencies)
+            for level, config_types in enumerate(levels, start=1):
+                logger.info(f"Import level {level}: {', '.join(config_types)}")
+            import_dir, restore_dir = restore_snapshot(args, types_to_process)
+            # Dry runs send nothing, so there is nothing to journal; they write
+            # the plan of the requests they would send instead
+            journal = plan = None
+            if args.dry_run:
+                plan = DryRunPlan(args.plan_file)
+            else:
+                journal = ImportJournal(args.journal or os.path.join(args.export_dir, JOURNAL_FILE), args.resume)
+            # References are rewritten from the IDs recorded by this and earlier runs
+            id_map = IdMap(args.id_map or os.path.join(args.export_dir, ID_MAP_FILE))
+            fanout = len(destinations) > 1
+            outcomes = {}
+            shared = None
+            try:
+                if fanout:
+                    # Every destination imports every type as a task of its own,
+                    # but the items of each type are read and cleaned only once
+                    logger.info(f"Importing into {len(destinations)} destinations: {', '.join(name for name, _ in destinations)}")
+                    shared = SharedImports(lambda config_type: import_items(import_dir, config_type, item_filter), len(destinations))
+                    names, task_dependencies = fanout_tasks(destinations, types_to_process, dependencies)
+                    backends = dict(destinations)
+
+                    def release_skipped(name):
+                        shared.release(split_task_name(name)[1])
+
+                    if args.engine == "async":
+                        from async_migrator import import_config_async, run_destinations_async
+
+                        async def import_task(name, client):
+                            config_type = split_task_name(name)[1]
+                            try:
+                                return await import_config_async(config_type, client, import_dir, args.dry_run, args.sync, journal, plan, item_filter, await asyncio.to_thread(shared.get, config_type), id_map)
+                            finally:
+                                shared.release(config_type)
+
+                        outcomes = asyncio.run(run_destinations_async(
+                            destinations, names, import_task, args.parallel_types * len(destinations), task_dependencies, release_skipped,
+                        ))
+                    else:
+                        def import_task(name):
+                            destination, config_type = split_task_name(name)
+                            try:
+                                return import_config(config_type, backends[destination], import_dir, args.dry_run, args.workers, args.sync, journal, plan, item_filter, shared.get(config_type), id_map)
+                            finally:
+                                shared.release(config_type)
+
+                        outcomes = run_tasks(names, import_task, args.parallel_types * len(destinations), task_dependencies, release_skipped)
+                elif args.engine == "async":
+                    from async_migrator import import_config_async, run_types_async
+                    outcomes = asyncio.run(run_types_async(
+                        backend_config,
+                        types_to_process,
+                        lambda config_type, client: import_config_async(config_type, client, import_dir, args.dry_run, args.sync, journal, plan, item_filter, None, id_map),
+                        args.parallel_types,
+                        dependencies,
+                    ))
+                else:
+                    outcomes = run_tasks(
+                        types_to_process,
+                        lambda config_type: import_config(config_type, backend_config, import_dir, args.dry_run, args.workers, args.sync, journal, plan, item_filter, None, id_map),
+                        args.parallel_types,
+                        dependencies,
+                    )
+            finally:
+                if shared:
+                    shared.close()
+                id_map.close()
+                if restore_dir:
+                    restore_dir.cleanup()
+                if journal:
+                    journal.close()
+                if plan:
+                    if fanout:
+                        plan.close(combine_results(outcomes))
+                    else:
+                        plan.close({config_type: outcome['result'] for config_type, outcome in outcomes.items()})
+
+        elif args.command == "verify":
+            destinations = destination_configs(config, args.destinations)
+            backend_config = destinations[0][1]
+            import_dir, restore_dir = restore_snapshot(args, types_to_process)
+            # Nothing is written to the destination, so every type is verified at once
+            report = VerifyReport(args.report or os.path.join(args.export_dir, VERIFY_REPORT_FILE))
+            id_map = IdMap(args.id_map or os.path.join(args.export_dir, ID_MAP_FILE))
+            fanout = len(destinations) > 1
+            outcomes = {}
+            shared = None
+            try:
+                if fanout:
+                    logger.info(f"Verifying {len(destinations)} destinations: {', '.join(name for name, _ in destinations)}")
+                    shared = SharedImports(lambda config_type: import_items(import_dir, config_type, item_filter), len(destinations))
+                    names, _ = fanout_tasks(destinations, types_to_process, {})
+                    backends = dict(destinations)
+                    if args.engine == "async":
+                        from async_migrator import run_destinations_async, verify_config_async
+
+                        async def verify_task(name, client):
+                            config_type = split_task_name(name)[1]
+                            try:
+                                return await verify_config_async(config_type, client, import_dir, item_filter, await asyncio.to_thread(shared.get, config_type), id_map, report)
+                            finally:
+                                shared.release(config_type)
+
+                        outcomes = asyncio.run(run_destinations_async(destinations, names, verify_task, args.parallel_types * len(destinations)))
+                    else:
+                        def verify_task(name):
+                            destination, config_type = split_task_name(name)
+                            try:
+                                return verify_config(config_type, backends[destination], import_dir, args.workers, item_filter, shared.get(config_type), id_map, report)
+                            finally:
+                                shared.release(config_type)
+
+                        outcomes = run_tasks(names, verify_task, args.parallel_types * len(destinations))
+                elif args.engine == "async":
+                    from async_migrator import run_types_async, verify_config_async
+                    outcomes = asyncio.run(run_types_async(
+                        backend_config,
+                        types_to_process,
+                        lambda config_type, client: verify_config_async(config_type, client, import_dir, item_filter, None, id_map, report),
+                        args.parallel_types,
+                    ))
+                else:
+                    outcomes = run_tasks(
+                        types_to_process,
+                        lambda config_type: verify_config(config_type, backend_config, import_dir, args.workers, item_filter, None, id_map, report),
+                        args.parallel_types,
+                    )
+            finally:
+                if shared:
+                    shared.close()
+                if restore_dir:
+                    restore_dir.cleanup()
+                report.close()
+
+        if fanout:
+            for destination, destination_outcomes in group_by_destination(outcomes).items():
+                log_summary(args.command, destination_outcomes, destination)
+        else:
+            log_summary(args.command, outcomes)
+        METRICS.log_report(logger)
+        if args.metrics_file:
+            METRICS.write(args.metrics_file, args.metrics_format)
+            logger.info(f"Request metrics written to {args.metrics_file}")
+        if any(outcome['error'] for outcome in outcomes.values()):
+            sys.exit(1)
+        # Missing and drifted items fail a verification, extra items do not
+        if args.command == "verify" and any((outcome['result'] or {}).get('failed') for outcome in outcomes.values()):
+            sys.exit(1)
 
     except (InstanaMigratorError, ConfigError, APIError) as e:
         logger.error(f"An error occurred: {e}")
@@ -0,0 +1,126 @@
+"""
+This module contains the import journal of the Instana Migrator.
+
+The journal is an NDJSON file with one record per imported item: the
+destination, the configuration type, the item key, the hash of the payload
+that was sent, the result and, where the API returned one, the ID of the
+item on the destination. A resumed import skips every item whose payload
+was already imported successfully into the same destination.
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from utils import InstanaMigratorError
+
+logger = logging.getLogger(__name__)
+
+SUCCESS_RESULTS = ("created", "updated", "unchanged")
+
+# Marks the end of the queue for the writer thread
+_STOP = object()
+
+
+class ImportJournal:
+    """Append-only journal of import outcomes.
+
+    Records are queued by the import workers and appended in whole lines by a
+    single background thread, so workers never wait for the disk and lines are
+    never interleaved. Incomplete lines left by an interrupted run are ignored
+    when the journal is loaded.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self._done = set()
+        if resume and os.path.exists(path):
+            self._load()
+        elif not resume and os.path.exists(path):
+            os.remove(path)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'a')
+        self._queue = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._write_records, name="import-journal", daemon=True)
+        self._writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _load(self):
+        """Reads the successfully imported items of previous runs."""
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Incomplete last line of an interrupted run
+                if record.get('result') in SUCCESS_RESULTS:
+                    self._done.add(self._done_key(
+                        record.get('destination'), record.get('type'), record.get('key'), record.get('payload_hash')
+                    ))
+        logger.info(f"Resuming from journal '{self.path}': {len(self._done)} item(s) already imported.")
+
+    @staticmethod
+    def _done_key(destination, config_type, key, payload_hash):
+        return (destination, config_type, str(key), payload_hash)
+
+    def is_done(self, destination, config_type, key, payload_hash):
+        """Returns True if the payload was already imported into the destination."""
+        return self._done_key(destination, config_type, key, payload_hash) in self._done
+
+    def record(self, destination, config_type, key, payload_hash, result, destination_id=None):
+        """Queues the outcome of an item for writing."""
+        record = {
+            'time': time.time(),
+            'destination': destination,
+            'type': config_type,
+            'key': key,
+            'payload_hash': payload_hash,
+            'result': result,
+        }
+        if destination_id is not None:
+            record['destination_id'] = destination_id
+        self._queue.put(record)
+
+    def _write_records(self):
+        """Writes queued records in batches until the journal is closed."""
+        while True:
+            records = [self._queue.get()]
+            while True:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = _STOP in records
+            lines = "".join(
+                json.dumps(record, separators=(',', ':')) + "\n"
+                for record in records if record is not _STOP
+            )
+            if lines:
+                self._file.write(lines)
+                self._file.flush()
+            if stop:
+                return
+
+    def close(self):
+        """Writes all pending records and closes the journal."""
+        if self._file.closed:
+            return
+        self._queue.put(_STOP)
+        self._writer.join()
+        try:
+            os.fsync(self._file.fileno())
+        except OSError as e:
+            raise InstanaMigratorError(f"Could not write journal '{self.path}': {e}")
+        finally:
+            self._file.close()
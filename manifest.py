@@ -0,0 +1,133 @@
+"""
+This module maintains the per-type export manifests of the Instana Migrator.
+
+A manifest records, for every exported item, its key, its 'lastUpdated'
+value where available and a content hash. An incremental export uses the
+previous manifest to fetch details only for new or changed items, judged by
+their list summary and its 'lastUpdated', and to leave export files
+untouched when nothing changed.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+from export_files import find_export_file, iter_export_items
+from utils import InstanaMigratorError, content_hash
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_DIR = "manifests"
+
+
+def manifest_path(export_dir, config_type):
+    """Returns the path of the manifest for a type."""
+    return os.path.join(export_dir, MANIFEST_DIR, f"{config_type}.json")
+
+
+def load_manifest(export_dir, config_type):
+    """Returns the manifest of the previous export of a type, or None."""
+    path = manifest_path(export_dir, config_type)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except json.JSONDecodeError as e:
+        raise InstanaMigratorError(f"Invalid manifest '{path}': {e}")
+
+
+def save_manifest(export_dir, manifest):
+    """Writes a manifest, replacing the previous one."""
+    path = manifest_path(export_dir, manifest['config_type'])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def summary_unchanged(manifest, key, summary):
+    """Returns True if a summary shows the item did not change since the previous manifest.
+
+    The summary must have the same content and the same 'lastUpdated' as
+    recorded. A summary without 'lastUpdated' is never considered unchanged,
+    as its details may have changed without it.
+    """
+    if not manifest or key is None or summary.get('lastUpdated') is None:
+        return False
+    entry = manifest['items'].get(str(key))
+    return (
+        entry is not None
+        and entry.get('lastUpdated') == summary['lastUpdated']
+        and entry.get('summary_hash') == content_hash(summary)
+    )
+
+
+def file_unchanged(manifest, new_manifest, file_path):
+    """Returns True if an export file does not need to be rewritten."""
+    return (
+        manifest is not None
+        and manifest.get('export_format') == new_manifest['export_format']
+        and manifest.get('file_hash') == new_manifest['file_hash']
+        and os.path.exists(file_path)
+    )
+
+
+class ManifestBuilder:
+    """Collects the manifest entries of the items of one export."""
+
+    def __init__(self, config_type, export_format):
+        self.config_type = config_type
+        self.export_format = export_format
+        self.items = {}
+        self._file_hash = hashlib.sha256()
+
+    def add(self, key, item, summary=None):
+        """Records an exported item and, if it has one, its list summary."""
+        item_hash = content_hash(item)
+        self._file_hash.update(item_hash.encode('utf-8'))
+        if key is None:
+            return
+
+        entry = {'hash': item_hash}
+        if summary is not None:
+            entry['summary_hash'] = content_hash(summary)
+        source = summary if summary is not None else item
+        if isinstance(source, dict) and source.get('lastUpdated') is not None:
+            entry['lastUpdated'] = source['lastUpdated']
+        self.items[str(key)] = entry
+
+    def build(self):
+        """Returns the manifest as a JSON-serializable dict."""
+        return {
+            'config_type': self.config_type,
+            'export_format': self.export_format,
+            'file_hash': self._file_hash.hexdigest(),
+            'items': self.items,
+        }
+
+
+def unchanged_dashboards(export_dir, manifest, summaries):
+    """Returns the dashboards of the previous export that did not change, see summary_unchanged.
+
+    In incremental mode these are taken from the previous export file instead
+    of the API. Returns a dict mapping dashboard IDs to dashboards.
+    """
+    config_type = 'custom-dashboards'
+    undated = sum(1 for summary in summaries if summary.get('lastUpdated') is None)
+    if undated:
+        logger.info(f"  - {undated} dashboard summaries have no lastUpdated, fetching their details again.")
+    unchanged_ids = {
+        summary['id'] for summary in summaries
+        if summary_unchanged(manifest, summary['id'], summary)
+    }
+    previous = {}
+    previous_file = find_export_file(export_dir, config_type)
+    if unchanged_ids and previous_file:
+        for dashboard in iter_export_items(previous_file, config_type, unchanged_ids):
+            if isinstance(dashboard, dict) and dashboard.get('id') in unchanged_ids:
+                previous[dashboard['id']] = dashboard
+    logger.info(f"  - {len(previous)} dashboard(s) unchanged, fetching details for {len(summaries) - len(previous)}.")
+    return previous
@@ -0,0 +1,294 @@
+"""
+This module collects per-request metrics for the Instana Migrator.
+
+InstanaAPI records every request in a RequestMetrics collector: the method,
+the endpoint (with IDs replaced by '{id}'), the configuration type, the final
+status code, the duration including retries, the bytes sent and received and
+the number of retries. At the end of a run the collector produces a latency
+histogram per endpoint, the slowest requests and the throughput per type, as
+a table in the log, as JSON or as a Prometheus textfile.
+"""
+
+import bisect
+import heapq
+import itertools
+import json
+import math
+import os
+import threading
+import time
+
+from api_endpoints import API_CONFIG
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf)
+SLOWEST_REQUESTS = 10
+METRICS_FORMATS = ("json", "prometheus")
+
+# Known endpoint paths, longest first, used to turn request paths into templates
+_ENDPOINT_PATHS = sorted(
+    {cfg[key] for cfg in API_CONFIG.values() for key in ('export_path', 'import_path')},
+    key=len,
+    reverse=True,
+)
+
+
+def endpoint_template(path):
+    """Returns the endpoint of a request path, with IDs replaced by '{id}'."""
+    path = path.split("?", 1)[0]
+    for endpoint in _ENDPOINT_PATHS:
+        if path == endpoint:
+            return endpoint
+        if path.startswith(endpoint + "/"):
+            return endpoint + "/{id}"
+    return path
+
+
+def percentile(values, fraction):
+    """Returns the nearest-rank percentile of a sorted list of values."""
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(math.ceil(fraction * len(values))) - 1))
+    return values[index]
+
+
+class _EndpointStats:
+    """Aggregated metrics of one method and endpoint."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.total_duration = 0.0
+        self.statuses = {}
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.durations = []
+
+
+class _TypeStats:
+    """Aggregated metrics of one configuration type."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.bytes_received = 0
+        self.first_start = None
+        self.last_end = None
+
+
+class RequestMetrics:
+    """Thread-safe collector of per-request metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Discards everything recorded so far."""
+        with self._lock:
+            self._endpoints = {}
+            self._types = {}
+            self._slowest = []
+            self._sequence = itertools.count()
+            self._gauges = {}
+
+    def record(self, method, path, config_type, status, duration, bytes_sent=0, bytes_received=0, retries=0):
+        """Records a finished request. A status of 0 means no response was received."""
+        endpoint = endpoint_template(path)
+        ended = time.time()
+        is_error = status == 0 or status >= 400
+        with self._lock:
+            stats = self._endpoints.get((method, endpoint))
+            if stats is None:
+                stats = self._endpoints[(method, endpoint)] = _EndpointStats()
+            stats.count += 1
+            stats.errors += is_error
+            stats.retries += retries
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+            stats.total_duration += duration
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            stats.buckets[bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+            stats.durations.append(duration)
+
+            type_stats = self._types.get(config_type or "-")
+            if type_stats is None:
+                type_stats = self._types[config_type or "-"] = _TypeStats()
+            type_stats.count += 1
+            type_stats.errors += is_error
+            type_stats.bytes_received += bytes_received
+            started = ended - duration
+            if type_stats.first_start is None or started < type_stats.first_start:
+                type_stats.first_start = started
+            if type_stats.last_end is None or ended > type_stats.last_end:
+                type_stats.last_end = ended
+
+            # The sequence number keeps entries with equal durations comparable
+            entry = (duration, next(self._sequence), method, path, status, config_type)
+            if len(self._slowest) < SLOWEST_REQUESTS:
+                heapq.heappush(self._slowest, entry)
+            elif duration > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def set_gauge(self, name, labels, value):
+        """Sets a gauge exported with the metrics, e.g. a current limit."""
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def durations(self):
+        """Returns the durations of all recorded requests."""
+        with self._lock:
+            return [duration for stats in self._endpoints.values() for duration in stats.durations]
+
+    def summary(self):
+        """Returns all metrics as a JSON-serializable dict."""
+        with self._lock:
+            endpoints = []
+            for (method, endpoint), stats in sorted(self._endpoints.items(), key=lambda entry: entry[0][1]):
+                durations = sorted(stats.durations)
+                endpoints.append({
+                    'method': method,
+                    'endpoint': endpoint,
+                    'requests': stats.count,
+                    'errors': stats.errors,
+                    'retries': stats.retries,
+                    'bytes_sent': stats.bytes_sent,
+                    'bytes_received': stats.bytes_received,
+                    'statuses': {str(status): count for status, count in sorted(stats.statuses.items())},
+                    'latency_seconds': {
+                        'sum': stats.total_duration,
+                        'p50': percentile(durations, 0.50),
+                        'p95': percentile(durations, 0.95),
+                        'p99': percentile(durations, 0.99),
+                        'max': durations[-1],
+                        'histogram': {
+                            ('+Inf' if bound == math.inf else str(bound)): count
+                            for bound, count in zip(LATENCY_BUCKETS, stats.buckets)
+                        },
+                    },
+                })
+
+            types = []
+            for config_type, stats in sorted(self._types.items()):
+                elapsed = stats.last_end - stats.first_start
+                types.append({
+                    'config_type': config_type,
+                    'requests': stats.count,
+                    'errors': stats.errors,
+                    'bytes_received': stats.bytes_received,
+                    'elapsed_seconds': elapsed,
+                    'requests_per_second': stats.count / elapsed if elapsed > 0 else None,
+                })
+
+            slowest = [
+                {'method': method, 'path': path, 'status': status, 'config_type': config_type, 'duration_seconds': duration}
+                for duration, _, method, path, status, config_type in sorted(self._slowest, reverse=True)
+            ]
+            gauges = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self._gauges.items())
+            ]
+        return {'endpoints': endpoints, 'types': types, 'slowest_requests': slowest, 'gauges': gauges}
+
+    def log_report(self, logger):
+        """Logs the metrics as human-readable tables."""
+        summary = self.summary()
+        if not summary['endpoints']:
+            return
+
+        def ms(value):
+            return f"{value * 1000:.0f}ms" if value is not None else "-"
+
+        logger.info("Request metrics per endpoint:")
+        logger.info(f"  {'Method':<6} {'Endpoint':<58} {'Requests':>8} {'Errors':>6} {'Retries':>7} {'p50':>7} {'p95':>7} {'p99':>7} {'Max':>7}")
+        for entry in summary['endpoints']:
+            latency = entry['latency_seconds']
+            logger.info(
+                f"  {entry['method']:<6} {entry['endpoint']:<58} {entry['requests']:>8} {entry['errors']:>6} "
+                f"{entry['retries']:>7} {ms(latency['p50']):>7} {ms(latency['p95']):>7} {ms(latency['p99']):>7} {ms(latency['max']):>7}"
+            )
+
+        logger.info("Slowest requests:")
+        for entry in summary['slowest_requests']:
+            logger.info(f"  {ms(entry['duration_seconds']):>8} {entry['method']:<6} {entry['path']} (status {entry['status']})")
+
+        logger.info("Throughput per type:")
+        logger.info(f"  {'Type':<34} {'Requests':>8} {'Errors':>6} {'Req/s':>8} {'KiB received':>13}")
+        for entry in summary['types']:
+            rate = entry['requests_per_second']
+            logger.info(
+                f"  {entry['config_type']:<34} {entry['requests']:>8} {entry['errors']:>6} "
+                f"{(f'{rate:.1f}' if rate else '-'):>8} {entry['bytes_received'] / 1024:>13.1f}"
+            )
+
+        for gauge in summary['gauges']:
+            labels = ", ".join(f"{name}={value}" for name, value in gauge['labels'].items())
+            logger.info(f"Gauge {gauge['name']} ({labels}): {gauge['value']}")
+
+    def to_prometheus(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        summary = self.summary()
+        lines = []
+
+        def label_text(labels):
+            escaped = (
+                '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                for name, value in labels.items()
+            )
+            return "{" + ",".join(escaped) + "}"
+
+        def metric(name, metric_type, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for suffix, labels, value in samples:
+                lines.append(f"{name}{suffix}{label_text(labels)} {value}")
+
+        histogram = []
+        for entry in summary['endpoints']:
+            labels = {'method': entry['method'], 'endpoint': entry['endpoint']}
+            cumulative = 0
+            for bound, count in entry['latency_seconds']['histogram'].items():
+                cumulative += count
+                histogram.append(("_bucket", dict(labels, le=bound), cumulative))
+            histogram.append(("_sum", labels, entry['latency_seconds']['sum']))
+            histogram.append(("_count", labels, entry['requests']))
+        metric("instana_migrator_request_duration_seconds", "histogram", "Duration of API requests, including retries.", histogram)
+
+        metric("instana_migrator_requests_total", "counter", "API requests by final status code.", [
+            ("", {'method': entry['method'], 'endpoint': entry['endpoint'], 'status': status}, count)
+            for entry in summary['endpoints'] for status, count in entry['statuses'].items()
+        ])
+        metric("instana_migrator_request_retries_total", "counter", "Retries of API requests.", [
+            ("", {'method': entry['method'], 'endpoint': entry['endpoint']}, entry['retries'])
+            for entry in summary['endpoints']
+        ])
+        metric("instana_migrator_request_bytes_sent_total", "counter", "Request body bytes sent.", [
+            ("", {'method': entry['method'], 'endpoint': entry['endpoint']}, entry['bytes_sent'])
+            for entry in summary['endpoints']
+        ])
+        metric("instana_migrator_response_bytes_received_total", "counter", "Response body bytes received.", [
+            ("", {'method': entry['method'], 'endpoint': entry['endpoint']}, entry['bytes_received'])
+            for entry in summary['endpoints']
+        ])
+        metric("instana_migrator_type_requests_per_second", "gauge", "Request throughput per configuration type.", [
+            ("", {'config_type': entry['config_type']}, entry['requests_per_second'] or 0)
+            for entry in summary['types']
+        ])
+        for gauge in summary['gauges']:
+            metric(gauge['name'], "gauge", gauge['name'].replace("_", " ") + ".", [("", gauge['labels'], gauge['value'])])
+        return "\n".join(lines) + "\n"
+
+    def write(self, path, metrics_format="json"):
+        """Writes the metrics to a file as JSON or as a Prometheus textfile."""
+        content = self.to_prometheus() if metrics_format == "prometheus" else json.dumps(self.summary(), indent=2)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        # Prometheus' textfile collector must never see a partially written file
+        os.replace(tmp_path, path)
+
+
+# Collector used by every InstanaAPI instance unless another one is given
+METRICS = RequestMetrics()
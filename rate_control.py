@@ -0,0 +1,241 @@
+"""
+This module contains the adaptive concurrency controller of the Instana Migrator.
+
+An AdaptiveLimiter caps the number of requests in flight to one backend and
+adjusts that cap from the backend's responses, AIMD style: the limit grows by
+a fixed step after every window of requests that kept the limit in use and
+whose p95 latency stayed close to the best seen so far, and is cut by a
+factor on HTTP 429 responses, when more than a few requests of a window got
+an HTTP 5xx response or no response at all, or when the p95 latency rises.
+Optionally, Instana's X-RateLimit-* headers are followed: once no requests
+remain, no request is started until the reset time the backend announced.
+
+All InstanaAPI and AsyncInstanaAPI clients for the same api_url share one
+limiter, see limiter_for().
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+
+from metrics import METRICS, percentile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INITIAL_CONCURRENCY = 8
+DEFAULT_MIN_CONCURRENCY = 1
+DEFAULT_MAX_CONCURRENCY = 100
+WINDOW_SIZE = 20
+INCREASE_STEP = 1
+DECREASE_FACTOR = 0.5
+# A window whose p95 latency exceeds the baseline by this factor is congested
+LATENCY_TOLERANCE = 2.0
+# A window with a larger share of 5xx responses and connection errors is congested
+ERROR_TOLERANCE = 0.1
+LIMIT_GAUGE = "instana_migrator_concurrency_limit"
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter_for(backend_config, metrics=None):
+    """Returns the limiter shared by all clients of a backend, or None.
+
+    Returns None unless adaptive_concurrency is enabled for the backend.
+    """
+    if not backend_config.get('adaptive_concurrency', False):
+        return None
+    api_url = backend_config['api_url'].rstrip('/')
+    with _limiters_lock:
+        limiter = _limiters.get(api_url)
+        if limiter is None:
+            limiter = _limiters[api_url] = AdaptiveLimiter(
+                api_url,
+                initial=int(backend_config.get('initial_concurrency', DEFAULT_INITIAL_CONCURRENCY)),
+                min_limit=int(backend_config.get('min_concurrency', DEFAULT_MIN_CONCURRENCY)),
+                max_limit=int(backend_config.get('max_concurrency', DEFAULT_MAX_CONCURRENCY)),
+                follow_rate_limit_headers=backend_config.get('follow_rate_limit_headers', True),
+                metrics=metrics,
+            )
+        return limiter
+
+
+class AdaptiveLimiter:
+    """Thread-safe AIMD limit on the requests in flight to one backend.
+
+    Threads call acquire() and release() around every attempt, coroutines
+    acquire_async() and release(); both then report the outcome with
+    record(). The two can be mixed, as the state is guarded by a lock and
+    waiting coroutines are woken on their own event loop.
+    """
+
+    def __init__(self, name, initial=DEFAULT_INITIAL_CONCURRENCY, min_limit=DEFAULT_MIN_CONCURRENCY,
+                 max_limit=DEFAULT_MAX_CONCURRENCY, follow_rate_limit_headers=True, metrics=None):
+        self.name = name
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial)))
+        self.follow_rate_limit_headers = follow_rate_limit_headers
+        self.metrics = metrics or METRICS
+        self.in_flight = 0
+        self.baseline = None
+        self._window = []
+        # Most requests in flight at the same time during the current window
+        self._window_peak = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._async_waiters = deque()
+        self._publish()
+
+    def _free_slots(self):
+        return int(self.limit) - self.in_flight
+
+    def _pause_remaining(self):
+        return self._paused_until - time.monotonic()
+
+    def acquire(self):
+        """Blocks until a request may be started."""
+        while True:
+            with self._available:
+                pause = self._pause_remaining()
+                if pause <= 0:
+                    if self._free_slots() > 0:
+                        self._start()
+                        return
+                    self._available.wait()
+                    continue
+            time.sleep(pause)
+
+    async def acquire_async(self):
+        """Waits until a request may be started, without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                pause = self._pause_remaining()
+                if pause <= 0:
+                    if self._free_slots() > 0:
+                        self._start()
+                        return
+                    future = loop.create_future()
+                    self._async_waiters.append((loop, future))
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            try:
+                await future
+            except asyncio.CancelledError:
+                # A wake-up meant for this coroutine is handed on
+                with self._lock:
+                    self._wake()
+                raise
+
+    def _start(self):
+        """Counts a request as started. Must hold the lock."""
+        self.in_flight += 1
+        self._window_peak = max(self._window_peak, self.in_flight)
+
+    def release(self):
+        """Marks a request started with acquire() or acquire_async() as finished."""
+        with self._lock:
+            self.in_flight -= 1
+            self._wake()
+
+    def _wake(self):
+        """Wakes as many waiters as there are free slots. Must hold the lock."""
+        free = self._free_slots()
+        if free <= 0:
+            return
+        self._available.notify(free)
+        while free > 0 and self._async_waiters:
+            loop, future = self._async_waiters.popleft()
+            if not future.done():
+                loop.call_soon_threadsafe(_resolve, future)
+                free -= 1
+
+    def record(self, duration, status, headers=None):
+        """Adjusts the limit from the outcome of a request.
+
+        status is the HTTP status code, or 0 if no response was received;
+        connection errors and timeouts count as failed like HTTP 5xx responses.
+        """
+        with self._lock:
+            if self.follow_rate_limit_headers and headers:
+                self._follow_headers(headers)
+            # Requests started before the last cut report the congestion that
+            # caused it, so they neither cut the limit again nor count as samples
+            if time.monotonic() - duration < self._last_decrease:
+                return
+            if status == 429:
+                self._decrease("HTTP 429")
+                return
+
+            self._window.append((duration, status == 0 or status >= 500))
+            if len(self._window) < WINDOW_SIZE:
+                return
+            p95 = percentile(sorted(duration for duration, _ in self._window), 0.95)
+            errors = sum(failed for _, failed in self._window)
+            # The limit is only raised if the window actually used all of it
+            saturated = self._window_peak >= int(self.limit)
+            self._window = []
+            self._window_peak = self.in_flight
+            # A single 5xx is often unrelated to load, a burst of them is not
+            if errors > WINDOW_SIZE * ERROR_TOLERANCE:
+                self._decrease(f"{errors} failed requests (HTTP 5xx or no response) in the last {WINDOW_SIZE} requests")
+                return
+            if self.baseline is not None and p95 > self.baseline * LATENCY_TOLERANCE:
+                self._decrease(f"p95 latency {p95 * 1000:.0f}ms, baseline {self.baseline * 1000:.0f}ms")
+                # A backend that stays slower at the minimum sets a new baseline
+                if self.limit <= self.min_limit:
+                    self.baseline = p95
+                return
+            # The baseline follows lasting latency changes slowly
+            self.baseline = p95 if self.baseline is None else min(p95, self.baseline * 0.9 + p95 * 0.1)
+            if saturated and self.limit < self.max_limit:
+                self.limit = min(self.max_limit, self.limit + INCREASE_STEP)
+                logger.debug(f"Concurrency limit for {self.name} raised to {int(self.limit)}")
+                self._publish()
+                self._wake()
+
+    def _decrease(self, reason):
+        """Cuts the limit by DECREASE_FACTOR. Must hold the lock."""
+        self._last_decrease = time.monotonic()
+        if self.limit <= self.min_limit:
+            return
+        self._window = []
+        self._window_peak = self.in_flight
+        self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+        logger.info(f"Concurrency limit for {self.name} lowered to {int(self.limit)} ({reason})")
+        self._publish()
+
+    def _follow_headers(self, headers):
+        """Applies Instana's X-RateLimit-* headers. Must hold the lock."""
+        try:
+            remaining = int(headers.get('X-RateLimit-Remaining'))
+        except (TypeError, ValueError):
+            return
+        if remaining > 0:
+            return
+        try:
+            reset = float(headers.get('X-RateLimit-Reset'))
+        except (TypeError, ValueError):
+            return
+        # The reset time is sent in UTC epoch seconds, or milliseconds
+        if reset > 1e12:
+            reset /= 1000.0
+        pause = reset - time.time()
+        if pause > 0 and time.monotonic() + pause > self._paused_until:
+            self._paused_until = time.monotonic() + pause
+            log = logger.info if pause >= 1 else logger.debug
+            log(f"Rate limit of {self.name} exhausted, pausing new requests for {pause:.1f}s")
+
+    def _publish(self):
+        self.metrics.set_gauge(LIMIT_GAUGE, {'api_url': self.name}, int(self.limit))
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
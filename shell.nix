@@ -5,6 +5,6 @@
 pkgs.mkShell {
   buildInputs = with pkgs; [
     (python3.withPackages
-      (ps: with ps; [ requests pyyaml ]))
+      (ps: with ps; [ requests pyyaml aiohttp ]))
   ];
 }
@@ -0,0 +1,283 @@
+"""
+This module contains the snapshot store of the Instana Migrator.
+
+A snapshot store keeps the history of exports without storing the same data
+twice. Every exported item is saved once, zlib-compressed, under the hash of
+its content in objects/<first 2 hex digits>/<rest of the hash>. The list of
+item keys and hashes of one type is stored the same way (a "tree"), so a
+type that did not change between two runs costs nothing. Each run only adds
+a small JSON file to snapshots/, mapping every type to its tree.
+
+Storage and write I/O therefore grow with the amount of change between
+runs, not with the number of runs.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import zlib
+
+from api_endpoints import API_CONFIG
+from export_files import ExportWriter, export_file_path
+from utils import ConfigError, InstanaMigratorError, get_item_key
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_STORE = "snapshots"
+OBJECTS_DIR = "objects"
+SNAPSHOTS_DIR = "snapshots"
+LATEST = "latest"
+
+
+def _canonical(obj):
+    """Returns the bytes hashed and stored for an object, as hashed by utils.content_hash."""
+    return json.dumps(obj, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+class SnapshotStore:
+    """Reads and writes the objects and snapshots of a store directory."""
+
+    def __init__(self, path=SNAPSHOT_STORE):
+        self.path = path
+        self.new_objects = 0
+        self.new_bytes = 0
+        self._known = set()
+        self._lock = threading.Lock()
+
+    def _object_path(self, object_hash):
+        return os.path.join(self.path, OBJECTS_DIR, object_hash[:2], object_hash[2:])
+
+    def snapshot_path(self, snapshot_id):
+        """Returns the path of the file of a snapshot."""
+        return os.path.join(self.path, SNAPSHOTS_DIR, f"{snapshot_id}.json")
+
+    def put(self, obj):
+        """Stores an object unless the store already has it. Returns its hash."""
+        data = _canonical(obj)
+        object_hash = hashlib.sha256(data).hexdigest()
+        if object_hash in self._known:
+            return object_hash
+        path = self._object_path(object_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            compressed = zlib.compress(data)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, 'wb') as f:
+                f.write(compressed)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self.new_objects += 1
+                self.new_bytes += len(compressed)
+        self._known.add(object_hash)
+        return object_hash
+
+    def get(self, object_hash):
+        """Returns a stored object."""
+        path = self._object_path(object_hash)
+        try:
+            with open(path, 'rb') as f:
+                return json.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            raise InstanaMigratorError(f"Object {object_hash} is missing from the snapshot store '{self.path}'")
+        except (ValueError, zlib.error) as e:
+            raise InstanaMigratorError(f"Object {object_hash} in the snapshot store '{self.path}' is corrupt: {e}")
+
+    def snapshot_ids(self):
+        """Returns the IDs of the snapshots in the store, oldest first."""
+        directory = os.path.join(self.path, SNAPSHOTS_DIR)
+        if not os.path.isdir(directory):
+            return []
+        return sorted((name[:-len(".json")] for name in os.listdir(directory) if name.endswith(".json")), key=_snapshot_order)
+
+    def load(self, snapshot_id):
+        """Returns the snapshot with an ID, or the most recent one for 'latest'."""
+        if snapshot_id == LATEST:
+            snapshot_ids = self.snapshot_ids()
+            if not snapshot_ids:
+                raise ConfigError(f"The snapshot store '{self.path}' holds no snapshots")
+            snapshot_id = snapshot_ids[-1]
+        path = self.snapshot_path(snapshot_id)
+        if not os.path.exists(path):
+            raise ConfigError(f"Snapshot '{snapshot_id}' not found in '{self.path}'")
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def entries(self, snapshot, config_type):
+        """Returns the [key, hash] pairs of the items of a type in a snapshot."""
+        entry = snapshot['types'].get(config_type)
+        return self.get(entry['tree']) if entry else []
+
+    def iter_items(self, snapshot, config_type):
+        """Yields the items of a type in a snapshot, in export order."""
+        for _, item_hash in self.entries(snapshot, config_type):
+            yield self.get(item_hash)
+
+    def diff(self, old, new):
+        """Compares two snapshots.
+
+        Returns a dict mapping every type that differs to a dict with the
+        'added', 'removed' and 'changed' item keys. Types whose tree is the
+        same in both snapshots are not read.
+        """
+        differences = {}
+        for config_type in sorted(set(old['types']) | set(new['types'])):
+            old_entry, new_entry = old['types'].get(config_type), new['types'].get(config_type)
+            if old_entry and new_entry and old_entry['tree'] == new_entry['tree']:
+                continue
+            old_items = _keyed(self.entries(old, config_type))
+            new_items = _keyed(self.entries(new, config_type))
+            differences[config_type] = {
+                'added': sorted(key for key in new_items if key not in old_items),
+                'removed': sorted(key for key in old_items if key not in new_items),
+                'changed': sorted(key for key in new_items if key in old_items and old_items[key] != new_items[key]),
+            }
+        return differences
+
+    def restore(self, snapshot, config_types, directory):
+        """Writes the types of a snapshot as NDJSON export files, for import_config."""
+        missing = [config_type for config_type in config_types if config_type not in snapshot['types']]
+        if missing:
+            raise ConfigError(f"Snapshot '{snapshot['id']}' holds no export of: {', '.join(missing)}")
+        os.makedirs(directory, exist_ok=True)
+        for config_type in config_types:
+            with ExportWriter(export_file_path(directory, config_type, "ndjson"), "ndjson") as writer:
+                for item in self.iter_items(snapshot, config_type):
+                    writer.write(item)
+
+
+def _snapshot_order(snapshot_id):
+    """Sorts snapshot IDs by time, then by the number added to IDs created in the same second."""
+    base_id, _, suffix = snapshot_id.partition("-")
+    return base_id, int(suffix) if suffix.isdigit() else 1, snapshot_id
+
+
+def _keyed(entries):
+    """Maps the keys of [key, hash] pairs to their hash. Items without a key are keyed by their hash."""
+    return {str(key) if key is not None else f"#{item_hash}": item_hash for key, item_hash in entries}
+
+
+class SnapshotWriter:
+    """Records the items of an export run as a new snapshot.
+
+    Each type is recorded through a SnapshotTypeWriter wrapping its export
+    writer. A type is added to the snapshot only once its export finished;
+    the snapshot file is written on close.
+    """
+
+    def __init__(self, store, metadata=None):
+        self.store = store
+        self.metadata = metadata or {}
+        self._types = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def type_writer(self, config_type, writer):
+        """Returns a writer storing the items of a type and passing them on to writer."""
+        return SnapshotTypeWriter(self, config_type, writer)
+
+    def _commit(self, config_type, entries):
+        tree_hash = self.store.put(entries)
+        with self._lock:
+            self._types[config_type] = {'tree': tree_hash, 'count': len(entries)}
+
+    def close(self):
+        """Writes the snapshot file. Returns the snapshot ID, or None if no type was exported."""
+        with self._lock:
+            types = dict(sorted(self._types.items()))
+        if not types:
+            logger.warning("No type was exported, no snapshot recorded.")
+            return None
+        directory = os.path.join(self.store.path, SNAPSHOTS_DIR)
+        os.makedirs(directory, exist_ok=True)
+        base_id = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+        snapshot_id, suffix = base_id, 1
+        while os.path.exists(self.store.snapshot_path(snapshot_id)):
+            suffix += 1
+            snapshot_id = f"{base_id}-{suffix}"
+        snapshot = {
+            'id': snapshot_id,
+            'created': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            **self.metadata,
+            'types': types,
+        }
+        path = self.store.snapshot_path(snapshot_id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f, indent=2)
+        os.replace(tmp_path, path)
+        logger.info(
+            f"Snapshot {snapshot_id} recorded in {self.store.path}: {len(types)} type(s), "
+            f"{self.store.new_objects} new object(s) ({self.store.new_bytes} bytes)"
+        )
+        return snapshot_id
+
+
+class SnapshotTypeWriter:
+    """Wraps the export writer of a type and stores every item it is given."""
+
+    def __init__(self, snapshot, config_type, writer):
+        self.snapshot = snapshot
+        self.config_type = config_type
+        self.writer = writer
+        self._id_key = API_CONFIG.get(config_type, {}).get('id_key')
+        self._entries = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.writer.__exit__(exc_type, exc_value, traceback)
+        # Unchanged exports are discarded by the writer, but still belong to the snapshot
+        if exc_type is None:
+            self.snapshot._commit(self.config_type, self._entries)
+
+    @property
+    def file_path(self):
+        return self.writer.file_path
+
+    @property
+    def count(self):
+        return self.writer.count
+
+    @property
+    def discarded(self):
+        return self.writer.discarded
+
+    def discard(self):
+        self.writer.discard()
+
+    def _store(self, item):
+        key = get_item_key(item, self._id_key)
+        self._entries.append([str(key) if key is not None else None, self.snapshot.store.put(item)])
+
+    def write(self, item):
+        """Adds a single item to the export and the snapshot."""
+        self.writer.write(item)
+        self._store(item)
+
+    def write_document(self, data):
+        """Adds a whole configuration; the snapshot stores it as a single item."""
+        self.writer.write_document(data)
+        self._store(data)
+
+    def write_data(self, data):
+        """Adds the response of a list endpoint; the snapshot stores its items one by one."""
+        self.writer.write_data(data)
+        if isinstance(data, list):
+            items = data
+        elif isinstance(data, dict) and isinstance(data.get('items'), list):
+            items = data['items']
+        else:
+            items = [] if data is None else [data]
+        for item in items:
+            self._store(item)
@@ -0,0 +1,145 @@
+"""
+This module compares exported items with the current state of a backend.
+
+Items are normalized with the import cleaning rules and compared through a
+content hash, so matching and comparing is linear in the number of items.
+"""
+
+import logging
+
+from api_endpoints import API_CONFIG
+from cleaning import clean_for_import
+from concurrency import ordered_map
+from export_files import unwrap_items
+from utils import APIError, content_hash
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_current_state(api, config_type, workers):
+    """Returns the items of a type as they currently exist on a backend.
+
+    Uses the same export_path as the export, following its pagination. Custom
+    dashboards are fetched with their full details, in parallel.
+    """
+    cfg = API_CONFIG[config_type]
+    if cfg.get('pagination'):
+        return list(api.iter_items(cfg['export_path'], cfg['pagination']))
+    data = api.get(cfg['export_path'])
+    if data is None:
+        return []
+    items = list(unwrap_items(data if isinstance(data, list) else [data]))
+
+    if config_type == 'custom-dashboards':
+        def fetch_dashboard(summary):
+            try:
+                return api.get(f"{cfg['export_path']}/{summary['id']}")
+            except APIError as e:
+                logger.warning(f"    - Could not fetch details for dashboard ID {summary['id']}. Error: {e}")
+                return None
+
+        summaries = [summary for summary in items if summary.get('id')]
+        items = [dashboard for dashboard in ordered_map(fetch_dashboard, summaries, workers) if dashboard is not None]
+
+    return items
+
+
+def current_document(items, data):
+    """Returns the current configuration of a type imported with PUT, in the shape of the exported data.
+
+    fetch_current_state returns a list; an exported object is compared with
+    its only element.
+    """
+    if isinstance(data, list):
+        return items
+    return items[0] if len(items) == 1 else items
+
+
+def strip_ids(payload, config_type):
+    """Returns a cleaned item without its ID, leaving payload itself unchanged."""
+    if not isinstance(payload, dict):
+        return payload
+    id_keys = {API_CONFIG[config_type].get('id_key') or 'id', 'id'}
+    return {key: value for key, value in payload.items() if key not in id_keys}
+
+
+def normalize(item, config_type):
+    """Returns an item as it would be sent on import, without its ID.
+
+    IDs are assigned by each backend, so they are left out of the comparison.
+    """
+    return strip_ids(clean_for_import(item, config_type), config_type)
+
+
+def comparison_hash(item, config_type):
+    """Returns the hash used to decide whether two items are the same."""
+    return content_hash(normalize(item, config_type))
+
+
+class StateIndex:
+    """Indexes the items of a type by ID and by name/title.
+
+    Items are looked up by their destination ID from the ID map, if known,
+    then by their id_key, and fall back to their name or title, as the import
+    does when it identifies items. Types without an id_key are indexed by
+    their 'id', so that they can be found from the ID map too.
+    """
+
+    def __init__(self, items, config_type):
+        self.config_type = config_type
+        self.id_key = API_CONFIG[config_type].get('id_key')
+        self.items = items
+        self.by_id = {}
+        self.by_name = {}
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            item_id = item.get(self.id_key or 'id')
+            if item_id:
+                self.by_id.setdefault(item_id, item)
+            name = item.get('name', item.get('title'))
+            if name is not None:
+                self.by_name.setdefault(name, item)
+        self._hashes = {}
+
+    def find(self, item, mapped_id=None):
+        """Returns the indexed item matching item, or None.
+
+        mapped_id is the destination ID of the item recorded in the ID map, if
+        any; it is looked up first, so items renamed on the destination are
+        still found.
+        """
+        if not isinstance(item, dict):
+            return None
+        if mapped_id is not None and mapped_id in self.by_id:
+            return self.by_id[mapped_id]
+        if self.id_key and item.get(self.id_key) in self.by_id:
+            return self.by_id[item[self.id_key]]
+        name = item.get('name', item.get('title'))
+        if name is not None:
+            return self.by_name.get(name)
+        return None
+
+    def hash_of(self, indexed_item):
+        """Returns the comparison hash of an indexed item, computed once."""
+        key = id(indexed_item)
+        if key not in self._hashes:
+            self._hashes[key] = comparison_hash(indexed_item, self.config_type)
+        return self._hashes[key]
+
+    def compare(self, item, mapped_id=None):
+        """Returns ('missing', None), ('unchanged', match) or ('changed', match)."""
+        match = self.find(item, mapped_id)
+        if match is None:
+            return 'missing', None
+        if self.hash_of(match) == comparison_hash(item, self.config_type):
+            return 'unchanged', match
+        return 'changed', match
+
+
+def destination_id(match, config_type):
+    """Returns the ID of a matched destination item, or None."""
+    id_key = API_CONFIG[config_type].get('id_key') or 'id'
+    if not isinstance(match, dict):
+        return None
+    return match.get(id_key) or match.get('id')
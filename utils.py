@@ -1,4 +1,5 @@
 
+import hashlib
 import json
 
 # --- Custom Exceptions ---
@@ -27,8 +28,29 @@ def get_api_headers(token):
 
 def handle_api_error(response, url):
     """Raises a formatted APIError from an API response."""
+    raise_api_error(response.status_code, url, response.text)
+
+def raise_api_error(status_code, url, text):
+    """Raises a formatted APIError from a status code and response body."""
     try:
-        details = json.dumps(response.json(), indent=2)
+        details = json.dumps(json.loads(text), indent=2)
     except json.JSONDecodeError:
-        details = response.text
-    raise APIError(f"API Error: {response.status_code} for URL: {url}\n{details}")
+        details = text
+    raise APIError(f"API Error: {status_code} for URL: {url}\n{details}")
+
+def content_hash(obj):
+    """Returns a stable SHA-256 hash of a JSON-serializable object."""
+    canonical = json.dumps(obj, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def get_item_key(item, id_key=None):
+    """Returns the value that identifies an item: its id_key, name or title."""
+    if not isinstance(item, dict):
+        return None
+    if id_key and item.get(id_key):
+        return item.get(id_key)
+    if 'name' in item:
+        return item.get('name')
+    if 'title' in item:
+        return item.get('title')
+    return None
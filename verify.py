@@ -0,0 +1,207 @@
+"""
+This module checks that a destination holds the configuration of an export.
+
+The exported items and the current items of the destination are normalized
+with the import cleaning rules, as --sync does. The destination items are
+indexed by ID and by name/title (sync.StateIndex), every exported item is
+looked up in the index and compared through its content hash, so a type is
+verified in linear time. Field-level differences are only computed for the
+items whose hash differs.
+
+Each exported item is reported as:
+- missing: no destination item matches it
+- drifted: the matching destination item has different content
+and every destination item no exported item matched is reported as extra.
+"""
+
+import json
+import logging
+import os
+import threading
+
+from api_endpoints import API_CONFIG
+from sync import StateIndex, current_document, normalize, strip_ids
+from utils import content_hash, get_item_key
+
+logger = logging.getLogger(__name__)
+
+VERIFY_REPORT_FILE = "verify-report.ndjson"
+# Differences kept per item in the report, and logged per item
+MAX_DIFFERENCES = 50
+MAX_LOGGED_DIFFERENCES = 5
+
+_ABSENT = object()
+
+
+def field_differences(expected, actual, path="", limit=MAX_DIFFERENCES):
+    """Returns the differences between two normalized items, at most limit of them.
+
+    Each difference is a dict with the 'path' of the field, such as
+    'widgets[2].config.metric', and its 'expected' and 'actual' values; a
+    value is left out on the side where the field does not exist.
+    """
+    differences = []
+
+    def compare(expected, actual, path):
+        if len(differences) >= limit or expected == actual:
+            return
+        if isinstance(expected, dict) and isinstance(actual, dict):
+            for key in sorted(set(expected) | set(actual), key=str):
+                compare(expected.get(key, _ABSENT), actual.get(key, _ABSENT), f"{path}.{key}" if path else str(key))
+        elif isinstance(expected, list) and isinstance(actual, list):
+            for index in range(max(len(expected), len(actual))):
+                compare(
+                    expected[index] if index < len(expected) else _ABSENT,
+                    actual[index] if index < len(actual) else _ABSENT,
+                    f"{path}[{index}]",
+                )
+        else:
+            difference = {'path': path or '.'}
+            if expected is not _ABSENT:
+                difference['expected'] = expected
+            if actual is not _ABSENT:
+                difference['actual'] = actual
+            differences.append(difference)
+
+    compare(expected, actual, path)
+    return differences
+
+
+def _short(difference, side):
+    if side not in difference:
+        return "(absent)"
+    value = json.dumps(difference[side], sort_keys=True)
+    return value if len(value) <= 60 else value[:57] + "..."
+
+
+def _log_drift(key, differences):
+    logger.info(f"  - Drifted: {key} ({len(differences)}{'+' if len(differences) >= MAX_DIFFERENCES else ''} field(s))")
+    for difference in differences[:MAX_LOGGED_DIFFERENCES]:
+        logger.info(f"      {difference['path']}: expected {_short(difference, 'expected')}, found {_short(difference, 'actual')}")
+    if len(differences) > MAX_LOGGED_DIFFERENCES:
+        logger.info(f"      ... {len(differences) - MAX_LOGGED_DIFFERENCES} more in the report")
+
+
+def verify_state(config_type, entries, current, destination=None, id_map=None, report=None, item_filter=None):
+    """Compares the exported items of a type with the items of a destination.
+
+    entries are the items to verify as returned by import_items, and current
+    the items of the destination as returned by fetch_current_state. With an
+    id_map, references are rewritten as the import does, and items whose
+    destination ID is known are matched by that ID first. The outcome of
+    every item that is not in sync is recorded in report, if given. With
+    item_filter, the items the export was filtered with, destination items it
+    does not select are not reported as extra.
+
+    Returns a dict with the number of items in sync ('success'), missing or
+    drifted ('failed'), and the 'matched', 'missing', 'drifted' and 'extra'
+    counts.
+    """
+    cfg = API_CONFIG[config_type]
+    counts = {'matched': 0, 'missing': 0, 'drifted': 0, 'extra': 0}
+
+    def drifted(key, expected, actual):
+        differences = field_differences(expected, actual)
+        counts['drifted'] += 1
+        _log_drift(key, differences)
+        if report:
+            report.record(destination, config_type, 'drifted', key, differences)
+
+    if cfg['import_method'] == 'PUT':
+        # The whole configuration is one object, there is nothing to match
+        ((data, payload, _),) = entries
+        actual = normalize(current_document(current, data), config_type)
+        expected = strip_ids(payload, config_type)
+        counts['matched'] = 1
+        if content_hash(expected) != content_hash(actual):
+            drifted(config_type, expected, actual)
+        return _result(counts)
+
+    state = StateIndex(current, config_type)
+    id_key = cfg.get('id_key')
+    matched = set()
+    for item, payload, _ in entries:
+        key = get_item_key(item, id_key)
+        if id_map is not None:
+            item, payload = id_map.rewrite(item, config_type, destination), id_map.rewrite(payload, config_type, destination)
+        mapped_id = id_map.mapped_id(destination, config_type, item) if id_map is not None else None
+        match = state.find(item, mapped_id)
+        if match is None:
+            counts['missing'] += 1
+            logger.info(f"  - Missing: {key}")
+            if report:
+                report.record(destination, config_type, 'missing', key)
+            continue
+        matched.add(id(match))
+        counts['matched'] += 1
+        expected = strip_ids(payload, config_type)
+        if content_hash(expected) != state.hash_of(match):
+            drifted(key, expected, normalize(match, config_type))
+
+    for item in state.items:
+        # With filters, only the destination items they select can be extra
+        if id(item) in matched or (item_filter and not item_filter.matches(item, config_type)):
+            continue
+        key = get_item_key(item, id_key)
+        counts['extra'] += 1
+        logger.info(f"  - Extra: {key}")
+        if report:
+            report.record(destination, config_type, 'extra', key)
+    return _result(counts)
+
+
+def _result(counts):
+    result = {'success': counts['matched'] - counts['drifted'], 'failed': counts['missing'] + counts['drifted'], **counts}
+    logger.info(
+        f"Verification complete. {result['success']}/{result['success'] + result['failed']} item(s) in sync: "
+        f"{counts['missing']} missing, {counts['drifted']} drifted, {counts['extra']} extra."
+    )
+    return result
+
+
+class VerifyReport:
+    """Collects the items found out of sync by a verification and writes them on close.
+
+    The report is an NDJSON file with one line per missing, drifted or extra
+    item, drifted items with their field-level differences, followed by one
+    line of totals per type. Entries are sorted, so the reports of two runs
+    can be compared with diff.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = []
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def record(self, destination, config_type, status, key, differences=None):
+        """Adds an item that is not in sync."""
+        entry = {'destination': destination, 'type': config_type, 'status': status, 'key': key}
+        if differences is not None:
+            entry['differences'] = differences
+        with self._lock:
+            self._entries.append(entry)
+
+    def record_totals(self, destination, config_type, result):
+        """Adds the result of verify_state for a type."""
+        with self._lock:
+            self._totals[(str(destination), config_type)] = result
+
+    def close(self):
+        """Writes the report file."""
+        with self._lock:
+            entries = sorted(self._entries, key=lambda entry: (
+                str(entry['destination']), entry['type'], entry['status'], str(entry['key']),
+            ))
+            totals = sorted(self._totals.items())
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            for entry in entries:
+                f.write(json.dumps(entry, separators=(',', ':'), default=str) + "\n")
+            for (destination, config_type), result in totals:
+                f.write(json.dumps({'destination': destination, 'type': config_type, 'totals': result}, separators=(',', ':')) + "\n")
+        os.replace(tmp_path, self.path)
+        logger.info(f"Verification report with {len(entries)} item(s) out of sync written to {self.path}")